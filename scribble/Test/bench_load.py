@@ -0,0 +1,103 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark for reading designs.
+   python -m scribble.Test.bench_load
+
+Compares Element.read(), which builds elements as the file is parsed,
+against parsing into dicts and converting them afterwards with the original
+recursive from_obj(). The lazy read converts only the element it touches,
+as does the binary design. Yaml files are also read again, from the
+process wide cache of parsed yaml.
+"""
+import json
+import os
+import tempfile
+from datetime import date
+from numbers import Number
+from timeit import timeit
+
+import scribble.config_file as config
+from scribble.scope import Element
+from scribble.Test.bench_memory import design_text
+
+
+def recursive_from_obj(cls, obj):
+    """
+    The original from_obj(), which recursed and built each dictionary twice.
+    """
+    if isinstance(obj, list):
+        return [recursive_from_obj(cls, item) for item in obj]
+    elif isinstance(obj, dict):
+        d = {k: recursive_from_obj(cls, v) for k, v in obj.items()}
+        return cls(**{k: v for k, v in d.items() if v is not None})
+    elif isinstance(obj, (str, Number, date)) or obj is None:
+        return obj
+    return recursive_from_obj(cls, obj.__dict__)
+
+
+def main():
+    text = design_text()
+    with tempfile.TemporaryDirectory() as directory:
+        # A binary design, read straight from the mapped file.
+        name = os.path.join(directory, "design.sbd")
+        config.write(json.loads(text), name)
+        number = 5
+        binary = timeit(lambda: Element.read(name).regs[0], number=number)
+        print(f".sbd   open and touch one element {binary / number:6.3f}s")
+
+        for suffix in [".json", ".yaml"]:
+            name = os.path.join(directory, "design" + suffix)
+            design = json.loads(text)
+            if suffix == ".yaml":  # Yaml is much slower. Use a smaller design.
+                design["regs"] = design["regs"][: len(design["regs"]) // 10]
+            config.write(design, name)
+            assert Element.read(name) == recursive_from_obj(Element, config.read(name))
+
+            # Parse the file every time, rather than copying a cached parse.
+            def uncached(read):
+                config.cache.clear()
+                return read()
+
+            number = 5
+            before = timeit(
+                lambda: uncached(lambda: recursive_from_obj(Element, config.read(name))),
+                number=number,
+            )
+            after = timeit(lambda: uncached(lambda: Element.read(name)), number=number)
+            shared = timeit(
+                lambda: uncached(lambda: Element.read(name, share_strings=True)), number=number
+            )
+            lazy = timeit(
+                lambda: uncached(lambda: Element.read(name, lazy=True).regs[0]),
+                number=number,
+            )
+            if suffix == ".yaml":  # Yaml files are parsed once, then copied.
+                cached = timeit(lambda: Element.read(name), number=number)
+                print(f".yaml  read again from the cache {cached / number:6.3f}s")
+            if suffix == ".json":  # Leave out the registers, as design_include would.
+                dropped = timeit(lambda: Element.read(name, include=["core"]), number=number)
+                print(f".json  dropping the registers {dropped / number:6.3f}s")
+            print(
+                f"{suffix:6} parse+convert {before / number:6.3f}s   "
+                f"read {after / number:6.3f}s ({before / after:3.1f}x)   "
+                f"shared {shared / number:6.3f}s ({before / shared:3.1f}x)   "
+                f"lazy {lazy / number:6.3f}s ({before / lazy:3.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Memory benchmark for design trees.
+   python -m scribble.Test.bench_memory
+
+Loads a synthetic design of 100k elements in a fresh process for each
+representation and reports the growth in resident memory (RSS).
+  - unslotted: Elements with a per-object __dict__, as they used to be.
+  - element:   Elements as they are now.
+  - shared:    Elements sharing repeated keys and strings ("design_share_strings").
+String sharing only dedupes strings, so the heap shrinks more than RSS does.
+"""
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from scribble.scope import Element
+
+ELEMENTS = 100_000
+
+
+class Unslotted(Element):
+    """
+    An Element with a per-object __dict__, like Elements before they had __slots__.
+    """
+
+
+def design_text() -> str:
+    regs = [
+        {
+            "_types": ["Reg", "Field"],
+            "name": f"reg{n}",
+            "access": "RW" if n % 3 else "RO",
+            "offset": n * 4,
+            "width": 32,
+            "reset": {"value": 0, "mask": "0xffffffff"},
+        }
+        for n in range(ELEMENTS // 2)
+    ]
+    return json.dumps({"_types": ["Chip"], "regs": regs})
+
+
+def rss() -> int:
+    """
+    The current resident memory of this process, in bytes.
+    """
+    gc.collect()
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(mode: str, metric: str) -> int:
+    """
+    Bytes added by reading the design into elements.
+    :param metric: "rss" for resident memory, "heap" for memory still allocated by Python.
+      RSS includes memory freed while reading (eg. the parsed JSON) but not yet
+      returned to the system, so it can hide savings that show up in the heap.
+    """
+    text = design_text()
+    kind = Unslotted if mode == "unslotted" else Element
+    if metric == "heap":
+        tracemalloc.start()
+    before = rss() if metric == "rss" else tracemalloc.get_traced_memory()[0]
+    design = kind.from_obj(json.loads(text), share_strings=(mode == "shared"))
+    gc.collect()
+    after = rss() if metric == "rss" else tracemalloc.get_traced_memory()[0]
+    assert len(design.regs) == ELEMENTS // 2
+    return after - before
+
+
+def main():
+    # CASE: child process. Take one measurement.
+    if len(sys.argv) > 1:
+        print(measure(*sys.argv[1:3]))
+        return
+
+    # OTHERWISE, measure each mode in a fresh process so they don't share memory.
+    print(f"{'':10} {'RSS':>28}   {'heap':>28}")
+    for mode in ["unslotted", "element", "shared"]:
+        columns = []
+        for metric in ["rss", "heap"]:
+            output = subprocess.check_output(
+                [sys.executable, "-m", "scribble.Test.bench_memory", mode, metric]
+            )
+            used = int(output)
+            baseline = BASELINE.setdefault(metric, used)
+            per = used * 100_000 / ELEMENTS / 2 ** 20
+            columns.append(f"{per:7.1f} MiB/100k ({1 - used / baseline:6.1%} saved)")
+        print(f"{mode:10} {columns[0]}   {columns[1]}")
+
+
+# The "unslotted" measurements, which the others are compared against.
+BASELINE = {}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark for path lookups.
+   python -m scribble.Test.bench_paths
+
+Compares get_path with compiled paths against splitting the path on every lookup,
+the way get_path used to work.
+"""
+import re
+from timeit import timeit
+
+from scribble.obj import compile_path, get_path, splitter
+
+LOOKUPS = 100_000
+PATHS = ["name", "regs[1].offset", "memoryRegions[0].baseAddress", "a.b.c.d"]
+
+
+def split_get_path(obj, key):
+    """
+    The original get_path, which splits the path each time.
+    """
+    val = obj
+    for p in re.findall(splitter, key):
+        if isinstance(val, list) and 0 <= int(p) < len(val):
+            val = val[int(p)]
+        elif isinstance(val, dict) and p in val:
+            val = val[p]
+        else:
+            return None
+    return val
+
+
+def main():
+    obj = {
+        "name": "core0",
+        "regs": [{"offset": 0}, {"offset": 4}],
+        "memoryRegions": [{"baseAddress": 0x8000}],
+        "a": {"b": {"c": {"d": 1}}},
+    }
+
+    for path in PATHS:
+        accessor = compile_path(path)
+        assert split_get_path(obj, path) == get_path(obj, path) == accessor.get(obj)
+
+        split = timeit(lambda: split_get_path(obj, path), number=LOOKUPS)
+        compiled = timeit(lambda: get_path(obj, path), number=LOOKUPS)
+        direct = timeit(lambda: accessor.get(obj), number=LOOKUPS)
+        print(
+            f"{path:30} split {split:6.3f}s   get_path {compiled:6.3f}s "
+            f"({split / compiled:4.1f}x)   accessor {direct:6.3f}s ({split / direct:4.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from scribble.scope import MemoizedQueryStream
+
+
+@pytest.fixture(autouse=True)
+def query_memo():
+    """
+    Query memoizing is global to the process, so don't let one test's memo leak into the next.
+    """
+    yield
+    MemoizedQueryStream.disable()
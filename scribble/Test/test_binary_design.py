@@ -0,0 +1,89 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import date
+
+import pytest
+
+import scribble.config_file as config
+from scribble.binary_design import BinaryDesign, NodeRef, main
+from scribble.exceptions import DocumentException
+from scribble.objdict import INVALID
+from scribble.scope import Element
+
+DESIGN = {
+    "_types": ["Chip"],
+    "name": "chip",
+    "cores": [
+        {"_types": ["Core", "Component"], "name": "core0", "regs": [{"_types": ["Reg"]}]},
+        {"_types": ["Core", "Component"], "name": "core1", "note": None},
+    ],
+    "uart": {"_types": ["Uart", "Component"], "baseAddress": 2 ** 70, "clock": 1.5e6},
+    "values": [None, True, False, -5, 0.25, "", "µs", date(2020, 1, 2), [[]], {}],
+}
+
+
+def test_round_trip(tmp_path):
+    name = str(tmp_path / "design.sbd")
+    config.write(DESIGN, name)
+
+    # Reading the whole file gives back what was written.
+    assert config.read(name) == DESIGN
+    read = config.read(name, object_pairs_hook=Element.from_pairs)
+    assert read == Element.from_obj(DESIGN) and isinstance(read.uart, Element)
+
+    # Only dictionaries and lists can be saved.
+    with pytest.raises(DocumentException):
+        config.write(5, name)
+    with pytest.raises(DocumentException):
+        config.write({"a": object()}, name)
+    (tmp_path / "bad.sbd").write_bytes(b"")
+    with pytest.raises(DocumentException):
+        BinaryDesign(str(tmp_path / "bad.sbd"))
+
+
+def test_lazy_element(tmp_path):
+    name = str(tmp_path / "design.sbd")
+    config.write(DESIGN, name)
+
+    # Nodes stay in the file until they are used.
+    design = Element.read(name)
+    assert isinstance(design, Element)
+    assert isinstance(dict.__getitem__(design, "uart"), NodeRef)
+    assert design.uart.clock == 1.5e6 and design["uart"] is design.uart
+    assert design.cores[1].note is INVALID and design.cores[0].regs[0].is_instance("Reg")
+
+    # Once touched, it is just like the eager design.
+    assert design == Element.from_obj(DESIGN)
+    assert [e.name for e in design.query().is_instance("Core")] == ["core0", "core1"]
+    assert design.get_path("values.7") == date(2020, 1, 2)
+
+    # The type index finds elements without reading the rest of the design.
+    design = Element.read(name)
+    binary = BinaryDesign(name)
+    assert binary.types() == {"Chip": 1, "Core": 2, "Component": 3, "Uart": 1, "Reg": 1}
+    assert binary.location(binary.instances("Reg")[0]) == ["cores", 0, "regs", 0]
+    core0, core1, uart = binary.elements(design, "Component")
+    assert core1 is design.cores[1] and uart.name is INVALID and core0.name == "core0"
+    assert isinstance(dict.__getitem__(design, "values"), NodeRef)
+
+
+def test_convert(tmp_path, capsys):
+    source = tmp_path / "design.yaml"
+    config.write(DESIGN, str(source))
+
+    main([str(source), "--info"])
+    assert "Component" in capsys.readouterr().out
+    assert config.read(str(tmp_path / "design.sbd")) == config.read(str(source))
@@ -0,0 +1,90 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from scribble.exceptions import DocumentException
+from scribble.obj import sorted_by, grouped_by, remove_duplicates
+from scribble.scope import Element, Query
+from scribble.table import ObjectTable
+from scribble.util import consistent_values
+
+np = pytest.importorskip("numpy")
+
+
+def fields():
+    """
+    Register fields with ints, floats, bools, strings, lists and missing values.
+    """
+    rows = [
+        ("a", 8, 1.5, True, [1]),
+        ("b", 0, 0.5, False, None),
+        ("c", 8, 2.5, True, [1]),
+        ("d", 4, 0.5, True, [2]),
+        ("e", 0, 1.5, False, [1]),
+    ]
+    return [
+        Element.from_obj(
+            {"name": n, "offset": o, "width": w, "rw": rw, "tags": t, "bits": {"lsb": o}}
+        )
+        for n, o, w, rw, t in rows
+    ]
+
+
+def names(seq):
+    return [e.name for e in seq]
+
+
+def test_frame():
+    elements = fields()
+    frame = Query(elements).to_columns(["offset", "width", "rw", "name"])
+    assert frame.column("offset").dtype == np.int64
+    assert frame.column("width").dtype == np.float64
+    assert frame.column("name").dtype == object
+    assert names(frame) == names(elements)
+
+    # The vectorized routines give the same answers as the element-by-element ones.
+    for path in ["offset", "width", "rw", "name", "bits.lsb"]:
+        for reverse in [False, True]:
+            assert names(frame.sorted_by(path, reverse)) == names(
+                sorted_by(elements, path, reverse)
+            )
+        assert [names(g) for g in frame.grouped_by(path)] == [
+            names(g) for g in grouped_by(elements, path)
+        ]
+        assert names(frame.remove_duplicates(path)) == names(
+            remove_duplicates(elements, path)
+        )
+
+    # Columns travel with the elements.
+    assert frame.sorted_by("offset").column("width").tolist() == [0.5, 1.5, 0.5, 1.5, 2.5]
+    assert [names(g) for g in frame.grouped_by("tags")] == [["a", "c", "e"], ["b"], ["d"]]
+    assert frame.take([]).grouped_by("offset") == []
+
+
+def test_frame_helpers():
+    frame = Query(fields()).to_columns(["offset"])
+    consistent_values(frame.grouped_by("offset")[0], "offset", "rw", "tags")
+    with pytest.raises(DocumentException, match="offset -- 8|0"):
+        consistent_values(frame, "offset")
+    with pytest.raises(DocumentException, match=r"tags -- \[1\]|None"):
+        consistent_values(frame, "tags")
+
+    # Tables can be built straight from a frame.
+    fn = lambda e: e.name.upper()  # noqa: E731
+    table = ObjectTable(frame.sorted_by("offset"), ["name", "offset", "rw", fn])
+    expected = ObjectTable(sorted_by(fields(), "offset"), ["name", "offset", "rw", fn])
+    assert [r.cells for r in table.rows] == [r.cells for r in expected.rows]
+    assert table.rows[0].cells[1].contents == "0"
@@ -13,10 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 from os import remove
 from os.path import dirname
 
 import scribble.config_file as config
+from scribble.objdict import Objdict
 
 DIR = f"{dirname(__file__)}"
 
@@ -88,3 +90,43 @@ def test_mixed():
     read_write([{}])
     read_write({"a": []})
     read_write([{"a": [], "b": {}, "c": [{"d": []}]}])
+
+
+def test_cache(tmp_path):
+    name = tmp_path / "config.yaml"
+    name.write_text("a: {b: [1, 2]}\n")
+    cache = config.YamlCache(str(tmp_path / "cache"))
+    status = os.stat(name)
+
+    # Each read gets its own copy, built with the hook.
+    first = cache.load(str(name), status)
+    first["a"]["b"].append(3)
+    second = cache.load(str(name), status, object_pairs_hook=Objdict.pairs_hook(False))
+    assert second == {"a": {"b": [1, 2]}} and isinstance(second.a, Objdict)
+    assert cache.stats()[:3] == (1, 0, 1)
+
+    # A later run finds the parsed file on disk.
+    later = config.YamlCache(str(tmp_path / "cache"))
+    assert later.load(str(name), status) == {"a": {"b": [1, 2]}}
+    assert later.stats()[:3] == (0, 1, 0)
+
+    # A changed file is parsed again.
+    name.write_text("a: {b: [3]}\n")
+    os.utime(name, ns=(status.st_atime_ns, status.st_mtime_ns + 1))
+    assert cache.load(str(name), os.stat(name)) == {"a": {"b": [3]}}
+    assert later.load(str(name), os.stat(name)) == {"a": {"b": [3]}}
+    assert cache.stats()[:3] == (1, 0, 2)
+
+
+def test_cache_aliases(tmp_path):
+    # Cached copies, from memory or from disk, don't share values repeated by aliases.
+    name = tmp_path / "config.yaml"
+    name.write_text("defaults: &d {width: 8, bits: [1]}\nregs: [*d, *d]\n")
+    status = os.stat(name)
+    directory = str(tmp_path / "cache")
+    for cache in [config.YamlCache(directory), config.YamlCache(directory)]:
+        for _ in range(2):
+            obj = cache.load(str(name), status, object_pairs_hook=Objdict.pairs_hook(False))
+            obj.regs[0].width = 16
+            obj.regs[0].bits.append(2)
+            assert obj.regs[1] == {"width": 8, "bits": [1]} == obj.defaults
@@ -13,13 +13,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 from copy import deepcopy
 from os.path import dirname
-from scribble.fixup import apply_patches
+import pytest
+import scribble.config_file as config
+import scribble.fixup as fixup
+from scribble.exceptions import DocumentException
+from scribble.fixup import FixupAudit, FixupRegistry, LazyFixups, apply_patches, fixup_snippet
+from scribble.index import DesignIndex
 
 
 from scribble.model import document
+from scribble.obj import PatchPlan, Pending, scan
+from scribble.scope import Element, MemoizedQueryStream
 
 
 def assert_patch(obj, patch, result):
@@ -53,6 +61,39 @@ def test_patches():
     assert_patch({"a": 1}, {"a": 2}, {"a": 2})
 
 
+def test_patch_plan():
+    """
+    Compiled patches have the same effect as setting each path in turn.
+    """
+    obj = {"a": {"b": 1}, "regs": [{"name": "r0"}, {"name": "r1"}], "x": 0}
+    for patches in [
+        {"a.c": 2, "a.d.e": 3, "x": 1, "a.f": [4]},
+        {"a.c": 2, "a": {"z": 1}, "a.d": 3},
+        {"regs[0].name": "s0", "regs[1].width": 8, "regs[+]": {"name": "r2"}, "regs[2].w": 1},
+        {"new[+]": 2, "regs[++]": [{}, {}], "regs[3].x": 1},
+    ]:
+        expected = deepcopy(obj)
+        apply_patches(expected, patches)
+        plan = PatchPlan(patches)
+        for _ in range(2):
+            patched = deepcopy(obj)
+            plan.apply(patched, copy=True)
+            assert patched == expected
+
+    # Shared walks are only joined when nothing in between interferes.
+    plan = PatchPlan({"a.b": 1, "a.c": 2, "x": 0, "a.d": 3, "l[0].x": 1, "l[+]": 2, "l[0].y": 1})
+    assert [op[:2] for op in plan.ops] == [
+        ("descend", "a"),
+        ("set", "x"),
+        ("descend", "l"),
+    ]
+    assert [op[:2] for op in plan.ops[2][3]] == [
+        ("descend", "0"),
+        ("set", "+"),
+        ("descend", "0"),
+    ]
+
+
 def test_document():
 
     # Process a trivial document.
@@ -78,3 +119,279 @@ def test_document():
 
 
 DIR = f"{dirname(__file__)}"
+
+
+def test_registry(tmp_path):
+    # A snippet whose Fixup.py numbers the elements it fixes, and whose patch adds a list.
+    component = tmp_path / "components" / "Reg"
+    component.mkdir(parents=True)
+    (component / "Fixup.py").write_text(
+        "from itertools import count\n"
+        "numbers = count()\n"
+        "def Fixup(element, doc):\n"
+        "    element.number = next(numbers)\n"
+    )
+    (component / "Fixup.yaml").write_text("notes: [patched]\n")
+
+    registry = FixupRegistry([str(tmp_path)])
+    document = Element(snippets=[str(tmp_path)])
+    regs = [Element(_types=["Reg"]), Element(_types=["Reg"]), Element(_types=["Other"])]
+    for reg in regs:
+        fixup_snippet(reg, document, registry)
+
+    # The module was loaded once, and each element got its own copy of the patch.
+    assert [reg.number for reg in regs[:2]] == [0, 1]
+    regs[0].notes.append("changed")
+    assert regs[1].notes == ["patched"] and not regs[2].notes
+    assert registry.fixups("Other") == []
+
+
+def test_batch(tmp_path):
+    # A batch fixup sees all the elements of its type at once, before its patches.
+    component = tmp_path / "components" / "Reg"
+    component.mkdir(parents=True)
+    (component / "Fixup.py").write_text(
+        "def FixupBatch(elements, doc):\n"
+        "    for n, element in enumerate(elements):\n"
+        "        element.number = n\n"
+        "        element.count = len(elements)\n"
+        "def Fixup(element, doc):\n"
+        "    raise Exception('Not called when there is a batch')\n"
+    )
+    (component / "Fixup.yaml").write_text("count: 0\n")
+
+    design = Element.from_obj(
+        {"regs": [{"_types": ["Reg"], "name": "a"}, {"_types": ["Reg"], "name": "b"}]}
+    )
+    registry = FixupRegistry([str(tmp_path)])
+    document = Element(snippets=[str(tmp_path)], design=design)
+    scan(design, lambda element: fixup_snippet(element, document, registry))
+    assert not design.regs[0].number
+    registry.run_batches(document)
+    assert [(reg.name, reg.number, reg.count) for reg in design.regs] == [
+        ("a", 0, 0),
+        ("b", 1, 0),
+    ]
+
+    # A more specific type can't fix an element up ahead of the general type's batch.
+    component = tmp_path / "components" / "Status"
+    component.mkdir(parents=True)
+    (component / "Fixup.yaml").write_text("count: 1\n")
+    status = Element(_types=["Status", "Reg"], name="status")
+    registry = FixupRegistry([str(tmp_path)])
+    with pytest.raises(DocumentException, match="fixups for Status .* FixupBatch for Reg"):
+        fixup_snippet(status, document, registry)
+    with pytest.raises(DocumentException):
+        LazyFixups(registry, document).defer(Element(regs=[status]))
+
+    # Batching the specific type too keeps them in order, general to specific.
+    (component / "Fixup.py").write_text(
+        "def FixupBatch(elements, doc):\n"
+        "    for element in elements:\n"
+        "        element.specific = element.number\n"
+    )
+    registry = FixupRegistry([str(tmp_path)])
+    fixup_snippet(status, document, registry)
+    registry.run_batches(document)
+    assert (status.number, status.specific, status.count) == (0, 0, 1)
+
+
+def test_batch_top_down(tmp_path):
+    # A core batch sets up its registers before they are fixed up, as well as any it adds.
+    #   (Lazy fixups can't add elements)
+    for typ, body in [
+        (
+            "Core",
+            "def FixupBatch(elements, doc):\n"
+            "    for core in elements:\n"
+            "        for reg in core.regs:\n"
+            "            reg.width = 32\n"
+            "        if not doc.fixup_lazy:\n"
+            "            core.regs.append(type(core)(_types=['Reg'], width=64))\n",
+        ),
+        ("Reg", "def Fixup(element, doc):\n    element.bytes = element.width // 8\n"),
+    ]:
+        component = tmp_path / "components" / typ
+        component.mkdir(parents=True)
+        (component / "Fixup.py").write_text(body)
+
+    design = Element.from_obj(
+        {"cores": [{"_types": ["Core"], "regs": [{"_types": ["Reg"], "width": 8}]}]}
+    )
+    document = Element(snippets=[str(tmp_path)], design=design)
+    for lazy in (False, True):
+        fixed = deepcopy(design)
+        document.fixup_lazy, document.design = lazy, fixed
+        fixup.fixup_document(document)
+        assert [reg.bytes for reg in fixed.cores[0].regs] == [4, 8][: 1 + (not lazy)]
+
+
+def test_lazy(tmp_path):
+    # The chip notes what its registers look like. Registers are numbered in the order fixed.
+    for typ, body in [
+        ("Chip", "    element.saw = [reg.get('number') for reg in element.regs]\n"),
+        ("Reg", "    element.number = next(numbers)\n"),
+    ]:
+        component = tmp_path / "components" / typ
+        component.mkdir(parents=True)
+        (component / "Fixup.py").write_text(
+            "from itertools import count\n"
+            "numbers = count()\n"
+            f"def Fixup(element, doc):\n{body}"
+        )
+
+    design = Element.from_obj(
+        {"_types": ["Chip"], "regs": [{"_types": ["Reg"]}, {"_types": ["Reg"]}]}
+    )
+    document = Element(snippets=[str(tmp_path)], design=design)
+    LazyFixups(FixupRegistry([str(tmp_path)]), document).defer(design)
+
+    # Nothing is fixed up yet, not even by indexing the design.
+    index = DesignIndex(design, Element)
+    with Pending.hold():
+        regs = list(design.regs)
+    assert all(isinstance(e, Pending) for e in [design, *regs])
+    assert list(map(id, index.instances(design, "Reg"))) == list(map(id, regs))
+
+    # Using a register fixes up the chip first. The chip saw unfixed registers.
+    assert regs[1].number == 0 and isinstance(regs[0], Pending)
+    assert design.saw == [None, None] and not isinstance(design, Pending)
+    assert deepcopy(design.regs[0]) == {"_types": ["Reg"], "number": 1}
+    assert type(design.regs[0]) is Element
+
+
+def test_lazy_shape(tmp_path):
+    # A core fixup which adds a register.
+    component = tmp_path / "components" / "Core"
+    component.mkdir(parents=True)
+    (component / "Fixup.yaml").write_text("regs[+]: {_types: [Reg], name: extra}\n")
+
+    def fixed(indexed: bool) -> Element:
+        design = Element.from_obj(
+            {"cores": [{"_types": ["Core"], "regs": [{"_types": ["Reg"], "name": "a"}]}]}
+        )
+        document = Element(snippets=[str(tmp_path)], design=design)
+        LazyFixups(FixupRegistry([str(tmp_path)]), document).defer(design)
+        if indexed:
+            MemoizedQueryStream.enable(design)
+        return design
+
+    # Before the design is indexed, the fixup can add elements.
+    design = fixed(indexed=False)
+    assert [reg.name for reg in design.query().is_instance("Reg")] == ["a", "extra"]
+
+    # Afterwards, the index misses them. The core's fixup hasn't run yet, since the query
+    #   doesn't use the core, but once it is used the document fails.
+    design = fixed(indexed=True)
+    assert [reg.name for reg in design.query().is_instance("Reg")] == ["a"]
+    with pytest.raises(DocumentException, match="'cores\\[0\\]' added, removed or retyped"):
+        design.cores[0].regs
+
+
+def test_lazy_design(tmp_path):
+    # Each core notes it was fixed up. Registers are numbered in one batch, in document order.
+    for typ, name, body in [
+        ("Core", "Fixup.yaml", "fixed: true\n"),
+        (
+            "Reg",
+            "Fixup.py",
+            "def FixupBatch(elements, doc):\n"
+            "    for n, element in enumerate(elements):\n"
+            "        element.number = n\n",
+        ),
+    ]:
+        component = tmp_path / "components" / typ
+        component.mkdir(parents=True)
+        (component / name).write_text(body)
+
+    cores = [
+        {"_types": ["Core"], "regs": [{"_types": ["Reg"]}, {"_types": ["Reg"]}]}
+        for _ in range(2)
+    ]
+    name = tmp_path / "design.json"
+    config.write({"cores": cores, "uart": {"_types": ["Core"], "regs": []}}, str(name))
+    design = Element.read(str(name), lazy=True)
+    document = Element(snippets=[str(tmp_path)], design=design)
+    LazyFixups(FixupRegistry([str(tmp_path)]), document).defer(design)
+
+    # Deferring the fixups doesn't convert the design, and neither does using one core.
+    assert type(dict.__getitem__(design, "cores")) is list
+    assert design.cores[1].fixed and isinstance(design.cores[1], Element)
+    assert type(dict.__getitem__(design, "uart")) is dict
+
+    # The first register used runs the batch, which finds the rest of the registers.
+    assert design.cores[1].regs[0].number == 2
+    assert [reg.number for core in design.cores for reg in core.regs] == [0, 1, 2, 3]
+    assert design.cores[0].fixed and design.uart.fixed
+
+
+def test_audit(tmp_path, capsys):
+    component = tmp_path / "components" / "Reg"
+    component.mkdir(parents=True)
+    (component / "Fixup.py").write_text(
+        "def Fixup(element, doc):\n"
+        "    if element.name == 'a':\n"
+        "        element.width = 8\n"
+    )
+    (component / "Fixup.yaml").write_text("fields[+]: {name: f}\n")
+
+    design = Element.from_obj(
+        {"regs": [{"_types": ["Reg"], "name": "a"}, {"_types": ["Reg"], "name": "b"}]}
+    )
+    document = Element(snippets=[str(tmp_path)], design=design)
+    fixup.audit = FixupAudit(document)
+    try:
+        registry = FixupRegistry([str(tmp_path)])
+        scan(design, lambda element: fixup_snippet(element, document, registry))
+        fixup.audit.write(str(tmp_path / "audit.json"))
+    finally:
+        fixup.audit = None
+
+    # Each source lists the elements it was applied to and what it changed.
+    report = json.loads((tmp_path / "audit.json").read_text())
+    function, patches = report[f"{component}/Fixup.py"], report[f"{component}/Fixup.yaml"]
+    assert function["elements"] == 2 and function["writes"] == [["design.regs[0].width"]]
+    assert patches["writes"] == [["design.regs[0].fields"], ["design.regs[1].fields"]]
+    assert "Slowest fixups" in capsys.readouterr().err
+
+    # Once the report is written, fixups still run but are no longer audited.
+    element = Element.from_obj({"_types": ["Reg"], "name": "a", "fields": []})
+    fixup.audit = FixupAudit(document)
+    try:
+        fixups = FixupRegistry([str(tmp_path)]).fixups("Reg")
+        fixup.audit.write(str(tmp_path / "audit.json"))
+        fixups[0][0](element, document)
+        fixups[0][1].apply(element)
+        assert element.width == 8 and element.fields[0].name == "f"
+        assert not fixup.audit.sources
+    finally:
+        fixup.audit = None
+
+    # Without an audit, the fixups are not wrapped.
+    fixups = FixupRegistry([str(tmp_path)]).fixups("Reg")[0]
+    assert isinstance(fixups[1], PatchPlan)
+
+
+def test_audit_paths():
+    document = Element(design=Element(_types=["Chip"]))
+    audit = FixupAudit(document)
+
+    # A document fixup which replaces the design with a dict which has no types.
+    def replace():
+        document.design = Element(name="chip")
+
+    audit.run("Fixup.py", [document], replace)
+    audit.run("Fixup.yaml", [document.design], lambda: document.design.update(width=8))
+    writes = audit.sources["Fixup.py"]["writes"]
+    assert writes == [["document.design._types", "document.design.name"]]
+    assert audit.sources["Fixup.yaml"]["writes"] == [["<new element>.width"]]
+
+    # Trees deeper than the recursion limit are copied and compared.
+    deep = Element()
+    leaf = deep
+    for _ in range(5000):
+        leaf.child = Element()
+        leaf = leaf.child
+    audit.run("Deep.py", [deep], lambda: leaf.update(value=[1, 2]))
+    writes = audit.sources["Deep.py"]["writes"]
+    assert writes == [["<new element>" + ".child" * 5000 + ".value"]]
@@ -0,0 +1,331 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import scribble.config_file as config
+
+from scribble.exceptions import DocumentException
+from scribble.index import DesignIndex, OrderedIndex
+from scribble.objdict import INVALID
+from scribble.registry import TYPES
+from scribble.scope import Element, MemoizedQueryStream, Query, type_mask
+
+
+def design() -> Element:
+    """
+    A small design with a couple of cores, each with registers.
+    """
+
+    def reg(name, offset, access="RW"):
+        return {"_types": ["Reg"], "name": name, "offset": offset, "access": access}
+
+    return Element.from_obj(
+        {
+            "_types": ["Chip"],
+            "cores": [
+                {
+                    "_types": ["Core", "Component"],
+                    "name": "core0",
+                    "regs": [reg("a", 8), reg("b", 0, "RO")],
+                },
+                {
+                    "_types": ["Core", "Component"],
+                    "name": "core1",
+                    "regs": [reg("c", 4), reg("d", 12)],
+                },
+            ],
+            "uart": {"_types": ["Uart", "Component"], "regs": [reg("tx", 0)]},
+        }
+    )
+
+
+def scanned(element: Element, *types: str):
+    """
+    The results of an is_instance query, found by scanning the tree.
+    """
+    return [
+        e
+        for e in element.subtrees()
+        if isinstance(e, Element) and e.is_instance(*types)
+    ]
+
+
+def same(lst1, lst2):
+    assert [id(e) for e in lst1] == [id(e) for e in lst2]
+
+
+def test_instances():
+    chip = design()
+    index = DesignIndex(chip, Element)
+
+    # Every element is indexed, in the same order subtrees() visits them.
+    same(index.elements, [e for e in chip.subtrees() if isinstance(e, Element)])
+
+    # Queries against the whole design and against subtrees match a scan.
+    for scope in [chip, chip.cores[0], chip.cores[1], chip.uart, chip.uart.regs[0]]:
+        for types in [("Reg",), ("Core",), ("Reg", "Uart"), ("Component", "Core")]:
+            same(index.instances(scope, *types), scanned(scope, *types))
+
+    # Unknown types are simply not found.
+    assert index.instances(chip, "Nothing") == []
+    assert index.hits == 21
+
+
+def test_memoized_query():
+    chip = design()
+    MemoizedQueryStream.enable(chip)
+    index = MemoizedQueryStream.index
+
+    # Queries on the frozen design come from the index.
+    same(chip.cores[1].query().is_instance("Reg"), scanned(chip.cores[1], "Reg"))
+    assert (index.hits, index.scans) == (1, 0)
+
+    # Elements outside the design still work, but they have to be scanned.
+    other = design()
+    same(other.query().is_instance("Reg"), scanned(other, "Reg"))
+    assert (index.hits, index.scans) == (1, 1)
+
+    # A plain query is just a slice of the index.
+    core = chip.cores[1]
+    same(core.query(), [e for e in core.subtrees() if isinstance(e, Element)])
+    assert (index.hits, index.scans) == (2, 1)
+
+
+def test_secondary():
+    chip = design()
+    chip.uart.cores = [chip.cores[1]]
+    chip.uart.tags = ["serial", "console"]
+    chip.cores[0].tags = "serial"
+    index = DesignIndex(chip, Element)
+    core1 = index.scope(chip.cores[1])
+
+    def check(scope, stream):
+        """
+        The index agrees with running the same query step by scanning.
+        """
+        (step,) = stream.plan
+        expected = list(step.run(index.elements[scope.lo : scope.hi]))
+        same([index.elements[p] for p in scope.lookup(step)], expected)
+
+    for scope in [index.scope(chip), core1]:
+        check(scope, Query([]).has_key_value("access", "RW"))
+        check(scope, Query([]).has_key_value("offset", 4))
+        check(scope, Query([]).has_key_value("name", None))
+        check(scope, Query([]).hasnt_key_value("access", "RW", "RO"))
+        check(scope, Query([]).contains_key("access"))
+        check(scope, Query([]).value_contains("cores", chip.cores[1]))
+        check(scope, Query([]).value_contains("tags", "serial"))
+
+    # Indexes are shared by every subtree of the design they were built for.
+    assert len(index.secondary) == 5
+
+    # Containers hold elements by identity, not just equality.
+    stranger = Query([]).value_contains("cores", design().cores[1]).plan[0]
+    assert list(index.scope(chip).lookup(stranger)) == []
+
+    # Unhashable values can't be looked up.
+    assert core1.lookup(Query([]).has_key_value("regs", []).plan[0]) is None
+
+
+def test_ordered():
+    chip = design()
+
+    def queries():
+        def regs():
+            return chip.query().is_instance("Reg")
+
+        return [
+            regs().sorted_by("offset", reverse=True),
+            regs().between("offset", 1, 8),
+            regs().sorted_by("offset").between("offset", 0, 4),
+            regs().top_k("offset", 3),
+            regs().top_k("offset", 2, reverse=True),
+            regs().top_k("offset", -1),
+            regs().has_key_value("access", "RW").between("offset", 9, 1),
+            chip.query().between("offset", 0, 100),
+        ]
+
+    # Run the queries without an index to get the expected answers.
+    MemoizedQueryStream.disable()
+    expected = [[e.name for e in q] for q in queries()]
+    expected.append(
+        [chip.query().min_by("offset").name, chip.query().max_by("offset").name]
+    )
+    assert expected[0] == ["d", "a", "c", "b", "tx"]
+    assert expected[3] == ["b", "tx", "c"]
+    assert expected[-1] == ["b", "d"]
+
+    # The ordered index gives the same answers, sorting the registers only once.
+    MemoizedQueryStream.enable(chip)
+    actual = [[e.name for e in q] for q in queries()]
+    actual.append(
+        [chip.query().min_by("offset").name, chip.query().max_by("offset").name]
+    )
+    assert actual == expected
+    ordered = [k for k in MemoizedQueryStream.memo.entries if "ordered" in k]
+    assert len(ordered) == 4  # registers, sorted registers, RW registers, everything
+
+    # Elements without a numeric value are left out of the index.
+    index = OrderedIndex([*chip.cores, *chip.cores[1].regs], "offset")
+    assert not index.complete
+    assert [e.name for e in index.sorted()] == ["c", "d"]
+    assert index.min() is chip.cores[1].regs[0]
+    assert OrderedIndex([], "offset").max() is None
+
+    # NaN is left out, whether or not the query is answered by the index.
+    regs = Element.from_obj({"regs": [{"name": "0", "offset": 1}, {"name": "1"}]})
+    regs.regs[1].offset = float("nan")
+
+    def nan_queries():
+        def query():
+            return regs.query().contains_key("offset")
+
+        return [
+            query().top_k("offset", 2, reverse=True),
+            query().top_k("offset", 2),
+            query().between("offset", 0, 2),
+            [query().max_by("offset")],
+        ]
+
+    MemoizedQueryStream.disable()
+    expected = [[e.name for e in q] for q in nan_queries()]
+    assert expected == [["0"], ["0"], ["0"], ["0"]]
+    MemoizedQueryStream.enable(regs)
+    assert [[e.name for e in q] for q in nan_queries()] == expected
+
+
+def test_intervals():
+    def device(name, base, size):
+        return {"_types": ["Device"], "name": name, "baseAddress": base, "size": size}
+
+    soc = Element.from_obj(
+        {
+            "_types": ["Soc"],
+            "devices": [
+                device("rom", 0x1000, 0x1000),
+                device("ram", 0x8000, 0x8000),
+                device("uart", 0x2000, 0x100),
+                device("alias", 0x8000, 0x10),
+                device("empty", 0x3000, 0),
+                {"_types": ["Device"], "name": "none"},
+            ],
+        }
+    )
+
+    def queries():
+        return [
+            soc.query().overlapping(0x1800, 0x2010),
+            soc.query().overlapping(0x2000, 0x2000),
+            soc.query().overlapping(0x2040, 0x2040),
+            soc.query().overlapping(0x1900, 0x1800),
+            soc.query().containing(0x8008),
+            soc.query().containing(0x2000).is_instance("Device"),
+            soc.query().containing(0x3000),
+            soc.query().containing(0x10, base="offset", size="width"),
+        ]
+
+    # Run the queries by scanning to get the expected answers.
+    MemoizedQueryStream.disable()
+    expected = [[e.name for e in q] for q in queries()]
+    assert expected[:6] == [["rom", "uart"], [], [], [], ["ram", "alias"], ["uart"]]
+
+    # The interval tree gives the same answers, in document order.
+    MemoizedQueryStream.enable(soc)
+    assert [[e.name for e in q] for q in queries()] == expected
+    assert "index: containing(32768, 'baseAddress', 'size') --> 2 elements" in (
+        soc.query().containing(0x8000).explain()
+    )
+
+
+def test_parents():
+    chip = design()
+    core0, core1 = chip.cores
+    reg = core1.regs[1]
+
+    # Without a frozen design, there are no parents.
+    MemoizedQueryStream.disable()
+    assert reg.parent is INVALID and reg.path is INVALID
+    with pytest.raises(DocumentException):
+        chip.query().ancestors_of(reg).collect()
+
+    MemoizedQueryStream.enable(chip)
+    assert reg.parent is core1 and core1.parent is chip and chip.parent is INVALID
+    assert reg.path == "cores[1].regs[1]" and chip.uart.path == "uart"
+    same(reg.ancestors(), [core1, chip])
+    same(core0.siblings(), [core1, chip.uart])
+
+    # The stream operators are answered from the index.
+    index = MemoizedQueryStream.index
+    hits = index.hits
+    same(chip.query().ancestors_of(reg), [core1, chip])
+    same(core1.query().ancestors_of(reg), [core1])
+    same(chip.query().siblings(reg).is_instance("Reg"), [core1.regs[0]])
+    same(chip.query().is_instance("Component").siblings(core1), [core0, chip.uart])
+    assert index.hits == hits + 4 and index.scans == 0
+
+    # A data item named "parent" or "path" takes precedence.
+    chip.uart.path = "/dev/ttyS0"
+    assert chip.uart.path == "/dev/ttyS0"
+
+
+def test_type_masks():
+    chip = design()
+    chip.cores[0].regs[0]._types = []
+    elements = [e for e in chip.subtrees() if isinstance(e, Element)]
+    queries = [("Reg",), ("Core", "Uart"), ("Nothing",), ("Reg", "Nothing"), ()]
+
+    def answers():
+        return [
+            [bool(e.is_instance(*q)) for e in elements]
+            + [bool(e.is_not_instance(*q)) for e in elements]
+            for q in queries
+        ]
+
+    # Indexing gives each element a mask, and the answers stay the same.
+    expected = answers()
+    assert all(type_mask(e) >= 0 for e in DesignIndex(chip, Element).elements)
+    assert answers() == expected
+    assert type_mask(chip.cores[0].regs[0]) == 0
+
+    # Types are registered once, and new types don't upset the cached masks.
+    assert TYPES.mask(("Reg",)) == TYPES.element_mask(["Reg"])
+    assert not chip.uart.is_instance("NewType")
+    chip.uart._types.append("NewType")
+    DesignIndex(chip, Element)
+    assert chip.uart.is_instance("NewType")
+
+    # The documentation for a type is only created once.
+    assert chip.uart.documentationType == "Uart"
+    assert TYPES.documentation["Uart"] == "Uart"
+
+
+def test_lazy_design(tmp_path):
+    name = tmp_path / "design.json"
+    config.write(Element.to_dict(design()), str(name))
+    eager, chip = design(), Element.read(str(name), lazy=True)
+    MemoizedQueryStream.enable(chip, lazy=True)
+
+    # Until the index is needed, queries scan just their own subtree.
+    core = chip.cores[1]
+    assert MemoizedQueryStream.index is None and type(dict.__getitem__(chip, "uart")) is dict
+    assert [r.name for r in core.query().is_instance("Reg")] == ["c", "d"]
+    assert MemoizedQueryStream.index is None
+
+    # A query from the top, or a question about parents, builds the index.
+    assert core.regs[0].parent is core and MemoizedQueryStream.index is not None
+    for types in [("Reg",), ("Component",), ("Chip", "Uart")]:
+        assert chip.query().is_instance(*types).collect() == scanned(eager, *types)
+    assert isinstance(chip.uart, Element) and chip.uart.path == "uart"
@@ -0,0 +1,62 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from scribble.memo import QueryMemo, sizeof
+
+
+class Owner:
+    pass
+
+
+def test_lru():
+    memo = QueryMemo(max_entries=2)
+    owner = Owner()
+
+    memo.put("a", owner, [1])
+    memo.put("b", owner, [2])
+    assert memo.get("a", owner) == [1]  # "a" is now the most recently used.
+
+    # Adding a third entry evicts the least recently used one, "b".
+    memo.put("c", owner, [3])
+    assert "b" not in memo
+    assert memo.get("a", owner) == [1]
+    assert memo.get("c", owner) == [3]
+    assert memo.get("b", owner) is None
+    assert memo.stats == (3, 1, 1, 2, sizeof([1]) + sizeof([3]))
+
+
+def test_bytes():
+    memo = QueryMemo(max_bytes=sizeof([0] * 10) * 2)
+    owner = Owner()
+
+    # Two values fit in the budget, a third evicts the oldest.
+    memo.put("a", owner, [0] * 10)
+    memo.put("b", owner, [0] * 10)
+    memo.put("c", owner, [0] * 10)
+    assert len(memo) == 2 and "a" not in memo
+
+    # A value too big for the budget is returned, but not remembered.
+    assert memo.put("d", owner, [0] * 100) == [0] * 100
+    assert "d" not in memo and len(memo) == 2
+
+
+def test_owner():
+    memo = QueryMemo()
+    owner = Owner()
+    memo.put(("key", id(owner)), owner, "value")
+
+    # A different object with the same key does not see the value.
+    assert memo.get(("key", id(owner)), Owner()) is None
+    assert memo.get(("key", id(owner)), owner) == "value"
@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+
+import scribble.config_file as config
 from scribble.exceptions import DocumentException
 from scribble.objdict import Objdict, INVALID
 
@@ -152,3 +155,105 @@ def test_path():
     assert obj.get_path("") is obj
     assert obj.get_path("howdy") == {"doody": 10}
     assert obj.get_path("howdy.partner") is None
+
+
+# Verify sharing strings gives the same objects, but with one copy of repeated strings.
+def test_share_strings():
+    text = """{"regs": [{"_types": ["Reg"], "access": "RW", "note": null},
+                        {"_types": ["Reg"], "access": "RW"}]}"""
+    plain = Objdict.from_obj(json.loads(text))
+    shared = Objdict.from_obj(json.loads(text), share_strings=True)
+    assert shared == plain
+    assert shared.regs[0].note is INVALID and "note" not in shared.regs[0]
+
+    # Identical short strings are the very same object.
+    first, second = shared.regs
+    assert first.access is second.access and first._types[0] is second._types[0]
+    long = "x" * 100
+    assert Objdict.from_obj({"a": long}, share_strings=True).a is long
+
+    # No per-object dictionary. Attributes are still items.
+    assert type(shared).__dictoffset__ == 0
+    shared.regs[0].access = "RO"
+    assert shared.regs[0]["access"] == "RO"
+
+    # The constructor merges old values and keywords, dropping Nones.
+    obj = Objdict({"a": 1, "b": 2, "c": None}, b=None, d=4)
+    assert list(obj.items()) == [("a", 1), ("d", 4)]
+
+
+# Verify very deep objects convert without recursing.
+def test_deep():
+    obj = leaf = {"depth": 0}
+    for depth in range(1, 5000):
+        obj = {"depth": depth, "children": [obj], "none": None}
+    converted = Objdict.from_obj(obj)
+    for depth in range(4999, 0, -1):
+        assert converted.depth == depth and "none" not in converted
+        converted = converted.children[0]
+    assert converted == leaf and isinstance(converted, Objdict)
+
+
+# Verify objects built while parsing match those converted afterwards.
+def test_read(tmp_path):
+    obj = {
+        "_types": ["Chip"],
+        "regs": [{"name": "a", "access": "RW", "note": None}, {"name": "b", "list": [[1]]}],
+        "empty": {},
+    }
+    json_file, yaml_file = tmp_path / "design.json", tmp_path / "design.yaml"
+    config.write(obj, str(json_file))
+    config.write(obj, str(yaml_file))
+
+    for share_strings in [False, True]:
+        for name in [json_file, yaml_file]:
+            read = Objdict.read(str(name), share_strings=share_strings)
+            assert read == Objdict.from_obj(obj)
+            assert isinstance(read.regs[1], Objdict) and "note" not in read.regs[0]
+            assert isinstance(read.empty, Objdict)
+
+    # Yaml merge keys and anchors still work.
+    yaml_file.write_text("base: &b {x: 1}\nmerged:\n  <<: *b\n  y: 2\nsame: *b\n")
+    read = Objdict.read(str(yaml_file))
+    assert read.merged == {"x": 1, "y": 2} and read.same == read.base
+    assert read.same is not read.base
+    assert isinstance(read.merged, Objdict)
+
+    # Each alias is an object of its own, so changing one leaves the others alone.
+    yaml_file.write_text("defaults: &d {width: 8}\nregs: [*d, *d]\n")
+    read = config.load_yaml(str(yaml_file), Objdict.pairs_hook(False))
+    assert read.regs[0] is not read.regs[1] and read.regs[0] is not read.defaults
+    read.regs[0].width = 16
+    assert read.regs[1].width == 8 and read.defaults.width == 8
+
+
+# Verify lazy objects convert their values when first used, and match eager ones.
+def test_lazy(tmp_path):
+    obj = {
+        "_types": ["Chip"],
+        "regs": [{"name": "a", "note": None, "fields": [{"bits": 1}]}, [{"x": 1}]],
+        "core": {"name": "c", "none": None},
+    }
+    name = tmp_path / "design.json"
+    config.write(obj, str(name))
+
+    for share_strings in [False, True]:
+        read = Objdict.read(str(name), share_strings=share_strings, lazy=True)
+        assert isinstance(read, Objdict) and type(dict.__getitem__(read, "core")) is dict
+
+        # Values are converted in place on first use, and stay the same object.
+        core = read.core
+        assert isinstance(core, Objdict) and read["core"] is core and read.get("core") is core
+        assert "none" not in core and core.missing is INVALID
+        assert type(dict.__getitem__(read, "regs")) is list
+        assert read.get_path("regs.0.fields.0.bits") == 1
+        assert isinstance(read.regs[1][0], Objdict) and read.regs[-2] is read.regs[0]
+        assert all(isinstance(r, (Objdict, list)) for r in read.regs[:])
+
+        # Traversal and conversion back to plain values see the converted values.
+        eager = Objdict.from_obj(obj)
+        assert read == eager and Objdict.to_dict(read) == Objdict.to_dict(eager)
+        assert all(type(v) not in (dict, list) for v in read.subtrees())
+        read.set_path("core.more.x", 2)
+        assert read.core.more.x == 2 and isinstance(read.core.more, Objdict)
+        assert read.pop("core") is core and read.setdefault("core", 5) == 5
@@ -13,7 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from scribble.obj import subtrees, elevate, split_path, get_path, set_path, scan_leaves
+import pytest
+
+from scribble.obj import (
+    subtrees,
+    subdicts,
+    scan,
+    elevate,
+    split_path,
+    get_path,
+    set_path,
+    scan_leaves,
+    compile_path,
+)
 from scribble.objdict import Objdict
 
 
@@ -34,6 +46,30 @@ def test_flatten():
     assert isinstance(list(Objdict().subtrees())[-1], Objdict)
 
 
+def test_deep_traversal():
+    # Build a tree far deeper than the recursion limit.
+    obj = leaf = {"n": 0}
+    for n in range(1, 5000):
+        obj = {"n": n, "child": [obj]}
+
+    # Children come before parents, and subdicts() skips lists and leaves.
+    dicts = list(subdicts(obj))
+    assert [d["n"] for d in dicts] == list(range(5000))
+    assert dicts[0] is leaf and dicts[-1] is obj
+    assert [d for d in subtrees(obj) if isinstance(d, dict)] == dicts
+
+    # scan() visits parents first, and can change the tree as it goes.
+    visited = []
+
+    def visit(d):
+        visited.append(d["n"])
+        if d["n"] == 4000:
+            d["child"] = []
+
+    scan(obj, visit)
+    assert visited == list(range(4999, 3999, -1))
+
+
 def meq(fn, obj1, obj2):
     m = map(fn, obj1)
     assert obj2 == m
@@ -93,6 +129,19 @@ def test_from_path():
     frompath("[0]", [], None)  # Treat bad index same as missing field.
 
 
+# Verify paths are compiled once, with the list indices already parsed.
+def test_compiled_path():
+    accessor = compile_path("a.b[1].c")
+    assert accessor is compile_path("a.b[1].c")
+    assert accessor.steps == (("a", None), ("b", None), ("1", 1), ("c", None))
+    assert accessor.get({"a": {"b": [{}, {"c": 7}]}}) == 7
+    assert accessor.get({"a": {"b": [{}]}}) is None
+
+    # Words can't index into a list.
+    with pytest.raises(ValueError):
+        get_path({"a": [1, 2]}, "a.b")
+
+
 # Verify we can insrt values based on path
 def topath(path, obj, val):
     set_path(obj, path, val)
@@ -0,0 +1,90 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+
+import scribble.config_file as config
+from scribble.exceptions import DocumentException
+from scribble.projection import ExcludedObject, include_tree, load_json
+from scribble.scope import Element
+
+DESIGN = {
+    "_types": ["Chip"],
+    "name": "chip",
+    "cores": [
+        {"_types": ["Core"], "name": "c0", "regs": [{"name": "r"}]},
+        {"_types": ["Core"], "name": "c1", "regs": []},
+    ],
+    "memoryMap": {"regions": [{"base": 0}], "other": {"x": [1, {"y": 2}]}, "size": 10},
+    "uart": {"_types": ["Uart"], "regs": [{"name": "tx", "notes": ["]}\\\"{[", "\\"]}]},
+    "empty": {},
+}
+
+
+def test_include_tree():
+    assert include_tree(["cores", "memoryMap.regions", "", "cores.regs"]) == {
+        "cores": None,
+        "memoryMap": {"regions": None},
+    }
+    assert include_tree(["a.b", "a"]) == {"a": None}
+
+    # List items can't be picked out, so an index is an error rather than leaving out the list.
+    with pytest.raises(DocumentException, match="'cores\\[0\\].regs' has a list index"):
+        include_tree(["cores[0].regs"])
+
+
+def test_load_json():
+    text = json.dumps(DESIGN, indent=1)
+    tree = include_tree(["cores", "memoryMap.regions"])
+    obj = load_json(text, tree)
+
+    # What is kept is parsed normally. Simple values are always kept.
+    assert obj["cores"] == DESIGN["cores"] and obj["name"] == "chip"
+    assert obj["_types"] == ["Chip"] and obj["memoryMap"]["size"] == 10
+    assert obj["memoryMap"]["regions"] == [{"base": 0}]
+
+    # The rest is left out, and remembers where it came from.
+    assert isinstance(obj["uart"], ExcludedObject) and obj["empty"].path == "empty"
+    assert obj["memoryMap"]["other"].path == "memoryMap.other"
+
+    # Everything is kept when everything is included. Errors are still caught.
+    assert load_json(text, include_tree(["cores", "memoryMap", "uart", "empty"])) == DESIGN
+    assert load_json(" [1, {}] ", {}) == [1, {}]
+    for bad in ['{"a": [1, 2}', '{"a" 1}', '{"a": 1,}', '{"a": 1} x', '{"uart": [1, "]']:
+        with pytest.raises(json.JSONDecodeError):
+            load_json(bad, {})
+
+
+def test_design_include(tmp_path):
+    for suffix in [".json", ".yaml", ".sbd"]:
+        name = str(tmp_path / f"design{suffix}")
+        config.write(DESIGN, name)
+        for lazy in [False, True]:
+            design = Element.read(name, lazy=lazy, include=["cores", "memoryMap.regions"])
+            assert design.cores[0].regs[0].name == "r" and design.memoryMap.size == 10
+            assert [c.name for c in design.query().is_instance("Core")] == ["c0", "c1"]
+
+            # Using a left out path fails with a clear message.
+            for use in [
+                lambda: design.uart.regs,
+                lambda: design.get_path("memoryMap.other.x"),
+                lambda: str(design.empty),
+                lambda: bool(design.uart),
+                lambda: design.set_path("uart.regs", []),
+            ]:
+                with pytest.raises(DocumentException, match="design_include"):
+                    use()
@@ -0,0 +1,143 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from scribble.memo import QueryMemo
+from scribble.plan import QueryPlan
+from scribble.scope import Element, MemoizedQueryStream, Query
+from scribble.Test.test_index import design
+
+
+def names(stream):
+    return [e.name for e in stream]
+
+
+def test_chain():
+    chip = design()
+
+    # Run the query without memoizing to get the expected answers.
+    def query():
+        return chip.query().is_instance("Reg").has_key_value("access", "RW")
+
+    MemoizedQueryStream.disable()
+    expected = names(query().sorted_by("offset"))
+    expected_groups = [names(g) for g in query().grouped_by("offset")]
+    assert expected == ["tx", "c", "a", "d"]
+
+    # Memoize the same query.
+    memo = QueryMemo()
+    MemoizedQueryStream.enable(chip, memo)
+    assert names(query().sorted_by("offset")) == expected
+    assert memo.stats.misses == 3  # The chain, the registers, and their ordered index.
+
+    # The second time around, the whole chain comes from the memo.
+    assert names(query().sorted_by("offset")) == expected
+    assert memo.stats.hits == 1
+
+    # Lambdas run on top of the remembered results.
+    fn = query().sorted_by("offset").filter(lambda e: e.offset > 4)
+    assert names(fn) == ["a", "d"]
+    assert memo.stats.hits == 2
+
+    # Groups are remembered too, but the caller gets a copy.
+    groups = query().grouped_by("offset")
+    assert [names(g) for g in groups] == expected_groups
+    groups[0].clear()
+    assert [names(g) for g in query().grouped_by("offset")] == expected_groups
+
+
+def test_partial():
+    chip = design()
+    MemoizedQueryStream.enable(chip)
+
+    # Taking the first element, then continuing the query, picks up where we left off.
+    stream = chip.query().is_instance("Reg")
+    assert stream.first().name == "a"
+    assert names(stream.has_key_value("access", "RW")) == ["c", "d", "tx"]
+
+    # Plain queries still work.
+    assert names(Query(chip.cores).sorted_by("name", reverse=True)) == [
+        "core1",
+        "core0",
+    ]
+
+
+def test_disable():
+    chip = design()
+    MemoizedQueryStream.enable(chip)
+    names(chip.query().is_instance("Reg"))
+    assert MemoizedQueryStream.memo.entries
+
+    # Disabling forgets the index and everything remembered.
+    MemoizedQueryStream.disable()
+    assert not MemoizedQueryStream.enabled and MemoizedQueryStream.index is None
+    assert MemoizedQueryStream.pending is None and not MemoizedQueryStream.memo.entries
+    assert names(chip.query().is_instance("Reg"))[:1] == ["a"]
+
+
+def test_explain():
+    chip = design()
+    MemoizedQueryStream.enable(chip)
+
+    # Both filters are answered by the index, so only the matching registers are scanned.
+    def query():
+        return (
+            chip.query()
+            .has_key_value("access", "RW")
+            .is_instance("Reg")
+            .sorted_by("offset")
+            .sorted_by("offset")
+        )
+
+    stream = query()
+    report = stream.explain()
+    assert "index: has_key_value('access', 'RW') --> 4 elements" in report
+    assert "index: is_instance('Reg') --> 5 elements" in report
+    assert "ordered: sorted_by('offset', False) --> 4 elements" in report
+    assert "skip: sorted_by('offset', False), already in order" in report
+    assert report.endswith("scanned: 4 elements")
+
+    # The stream still has its results.
+    assert names(stream) == ["tx", "c", "a", "d"]
+
+    # Run it again, and nothing is scanned.
+    report = query().explain()
+    assert "memo: all 4 steps remembered" in report
+    assert report.endswith("scanned: 0 elements")
+
+
+def test_planner():
+    # Filters are reordered, most selective first, with lambdas last.
+    fn = lambda e: True  # noqa: E731
+    plan = (
+        Query([])
+        .filter(fn)
+        .hasnt_key_value("a", 1)
+        .contains_key("b")
+        .has_key_value("c", 2)
+        .sorted_by("d")
+        .is_not_instance("E")
+        .is_instance("F")
+        .plan
+    )
+    optimized = [str(step) for step, _ in QueryPlan(plan).steps]
+    assert optimized == [
+        "has_key_value('c', 2)",
+        "contains_key('b')",
+        "hasnt_key_value('a', 1)",
+        f"filter({fn!r})",
+        "sorted_by('d', False)",
+        "is_instance('F')",
+        "is_not_instance('E')",
+    ]
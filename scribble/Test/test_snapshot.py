@@ -0,0 +1,113 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+from copy import deepcopy
+from os.path import dirname
+
+import scribble.config_file as config
+from scribble.index import DesignIndex
+from scribble.model import document
+from scribble.objdict import Objdict, lazy_class
+from scribble.scope import Element
+from scribble.snapshot import Snapshot
+
+DESIGN = {
+    "_types": ["Chip"],
+    "name": "chip",
+    "cores": [
+        {"_types": ["Core"], "name": "c0", "regs": [{"_types": ["Reg"], "name": "r"}]},
+        {"_types": ["Core"], "name": "c1"},
+    ],
+}
+
+
+def test_pickle():
+    # Elements, lazy or not, survive a round trip.
+    design = Element.from_obj(DESIGN)
+    lazy = lazy_class(Element)(DESIGN)
+    for obj in (design, lazy):
+        copy = pickle.loads(pickle.dumps(obj))
+        assert copy == design and type(copy) is type(obj)
+        assert copy.cores[0].regs[0].name == "r"
+    assert deepcopy(design) == design
+
+    # The index rebuilds its positions and type masks.
+    index = DesignIndex(design, Element)
+    design, index = pickle.loads(pickle.dumps((design, index)))
+    assert [e.name for e in index.instances(design, "Core")] == ["c0", "c1"]
+    assert index.instances(design, "Reg")[0] is design.cores[0].regs[0]
+    assert design.cores[0]._type_mask != 0
+
+
+def test_snapshot(tmp_path):
+    doc = Objdict(design_file="design.yaml", values=["a=1"])
+    fixups = tmp_path / "fixups"
+    fixups.mkdir()
+    snapshot = Snapshot(str(tmp_path / "cache"), doc)
+    assert snapshot.load() is None
+
+    # A snapshot is found by the document's settings.
+    design = Element.from_obj(DESIGN)
+    snapshot.save(Objdict(doc, design=design), DesignIndex(design, Element), [str(fixups)])
+    saved = Snapshot(str(tmp_path / "cache"), doc).load()
+    assert saved is not None and saved[0].design == design
+    assert Snapshot(str(tmp_path / "cache"), Objdict(doc, values=["a=2"])).load() is None
+
+    # Adding a fixup file to a directory which was searched invalidates it.
+    (fixups / "Fixup.yaml").write_text("name: changed\n")
+    assert snapshot.load() is None
+
+
+def test_document(tmp_path, monkeypatch):
+    # A second run starts from the snapshot, and produces the same document.
+    outputs = []
+    output = tmp_path / "document.adoc"
+
+    def run(cache_dir: str = str(tmp_path / "cache"), values: list = None):
+        document(
+            config=f"{DIR}/testdoc_directory/config/document.yaml",
+            directories=[f"{DIR}/testdoc_directory"],
+            output=str(output),
+            cache_dir=cache_dir,
+            values=values,
+        )
+        outputs.append(output.read_text())
+
+    run()
+    run()
+    assert outputs[0] == outputs[1]
+    assert len(list((tmp_path / "cache").glob("*.pickle"))) == 1
+
+    # A new snippet directory on the path gets a snapshot of its own, with its fixups.
+    component = tmp_path / "snippets" / "components" / "MyComponent"
+    component.mkdir(parents=True)
+    (component / "Fixup.yaml").write_text("things[+]: XP\n")
+    monkeypatch.syspath_prepend(str(tmp_path / "snippets"))
+    run()
+    assert "XP" in outputs[-1].split(", ")
+    assert len(list((tmp_path / "cache").glob("*.pickle"))) == 2
+
+    # An audited run skips the snapshot, so the fixups run and are reported.
+    audit = tmp_path / "audit.json"
+    run(values=[f"fixup_audit={audit}"])
+    assert audit.is_file() and outputs[-1] == outputs[-2]
+
+    # A run without a cache directory doesn't keep using the last one.
+    run(cache_dir="")
+    assert not config.cache.directory
+
+
+DIR = f"{dirname(__file__)}"
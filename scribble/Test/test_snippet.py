@@ -13,9 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 from os.path import dirname
 from importlib import import_module
 
+import pytest
+
+import scribble.section as section
+from scribble.exceptions import SnippetNotFound
 from scribble.importer import addImportPath, JinjaFileLoader
 from scribble.model import Snippet, Element
 
@@ -48,3 +53,25 @@ def xtest_jinja_snippet():
     scope = Element.from_obj({"title": "Hello", "_types": ["MyComponent"]})
     text = Snippet("template_snippet", scope, subtitle="World")
     assert f"{text}" == "Hello World!\n\n"
+
+
+def test_snippet_cache(tmp_path):
+    # Found and missing snippets are both remembered.
+    scope = Element.from_obj({"title": "Hello", "_types": ["Other", "MyComponent"]})
+    assert f"{Snippet('function_snippet', scope, subtitle='World')}" == "Hello World!"
+    with pytest.raises(SnippetNotFound):
+        Snippet("new_snippet", scope)
+    assert section.snippets_found[("function_snippet", ("Other", "MyComponent"))]
+    assert section.snippets_found[("new_snippet", ("Other", "MyComponent"))] is None
+
+    # Adding a snippet on a new import path makes it visible.
+    component = tmp_path / "components" / "Other"
+    component.mkdir(parents=True)
+    (component / "new_snippet.py").write_text(
+        "def new_snippet(scope, **kwargs):\n    return ['new']\n"
+    )
+    addImportPath(str(tmp_path))
+    try:
+        assert f"{Snippet('new_snippet', scope)}" == "new"
+    finally:
+        sys.path.remove(str(tmp_path))
@@ -0,0 +1,495 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (
+    annotations,
+)  # flake8: noqa F821 - Allows access to class name from within.
+
+import argparse
+import mmap
+import struct
+from collections import Counter
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from scribble.exceptions import DocumentException
+from scribble.obj import Deferred
+
+#########################################################################
+# Binary design files (.sbd)
+#
+# A big json design is parsed in full on every build, even when the document
+#   only uses a small part of it. A binary design is converted from the json
+#   (or yaml) once. It is then memory mapped, and each dict or list is read
+#   from the file only when it is first used.
+#
+# Layout. All numbers are little endian.
+#   header      magic, version and the location and size of each table.
+#   strings     (begin, end) of each string in the string blob. Keys and string
+#               values are stored once, and referred to by number.
+#   blob        the strings, utf-8 encoded.
+#   nodes       (offset, parent, slot) for each dict or list. Nodes are numbered
+#               in the order subtrees() visits them, children before parents,
+#               so the top of the design is the last node.
+#   types       (type, first, count) for each type named in an "_types" list,
+#               giving a run of the node numbers which have that type.
+#   bodies      each node: its kind and size, followed by its entries.
+#               dict entries are (key, tag, payload), list entries (tag, payload).
+#
+# A payload is 8 bytes: an int, the bits of a float, or the number of a string
+#   or node, depending on the tag.
+#########################################################################
+
+SUFFIX = ".sbd"
+MAGIC = b"SBD1"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIIIIII")
+STRING_ROW = struct.Struct("<II")
+NODE_ROW = struct.Struct("<III")
+TYPE_ROW = struct.Struct("<III")
+BODY = struct.Struct("<BI")
+NUMBER = struct.Struct("<I")
+DICT_ENTRY = struct.Struct("<IBq")
+LIST_ENTRY = struct.Struct("<Bq")
+DOUBLE = struct.Struct("<d")
+BITS = struct.Struct("<q")
+
+# Kinds of node.
+DICT, LIST = 0, 1
+
+# Value tags.
+NONE, FALSE, TRUE, INT, FLOAT, STR, NODE, BIG_INT, DATE, DATETIME = range(10)
+
+NO_PARENT = 0xFFFFFFFF
+INT64 = range(-(2 ** 63), 2 ** 63)
+
+
+def is_binary(filename: str) -> bool:
+    """
+    Is the file a binary design file?
+    """
+    return filename.endswith(SUFFIX)
+
+
+#########################################################################
+# Writing.
+#########################################################################
+
+
+def write_design(obj: Union[dict, list], filename: str):
+    """
+    Write a design (the parsed contents of a json or yaml file) as a binary design file.
+    """
+    with open(filename, "wb") as fp:
+        fp.write(encode(obj))
+
+
+def encode(obj: Union[dict, list]) -> bytes:
+    """
+    The binary form of a design.
+    """
+    if not isinstance(obj, (dict, list)):
+        raise DocumentException(
+            "A binary design must hold a dictionary or a list, "
+            f"not {type(obj).__name__}"
+        )
+
+    strings = {}  # string --> number
+    bodies = []  # encoded body of each node
+    children = []  # node numbers of each node's children, along with their slots.
+    types = {}  # string number of a type --> numbers of the nodes with the type
+
+    def string(s: str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    def value(v: Any) -> Tuple[int, int]:
+        """
+        The (tag, payload) of a leaf value.
+        """
+        if v is None:
+            return NONE, 0
+        elif v is True or v is False:
+            return (TRUE if v else FALSE), 0
+        elif isinstance(v, int):
+            return (INT, v) if v in INT64 else (BIG_INT, string(str(v)))
+        elif isinstance(v, float):
+            return FLOAT, BITS.unpack(DOUBLE.pack(v))[0]
+        elif isinstance(v, str):
+            return STR, string(v)
+        elif isinstance(v, datetime):
+            return DATETIME, string(v.isoformat())
+        elif isinstance(v, date):
+            return DATE, string(v.isoformat())
+        raise DocumentException(f"Can't save {v!r} in a binary design")
+
+    # Walk the design with an explicit stack, finishing each node after its children.
+    #   Each entry is (keys of a dict or None for a list, items still to encode,
+    #   (tag, payload) of the items encoded so far).
+    stack = [(list(obj) if isinstance(obj, dict) else None, iter(values(obj)), [])]
+    while stack:
+        keys, items, encoded = stack[-1]
+        for item in items:
+            if isinstance(item, (dict, list)):
+                keys = list(item) if isinstance(item, dict) else None
+                stack.append((keys, iter(values(item)), []))
+                break
+            encoded.append(value(item))
+
+        # All the items are encoded. Finish the node.
+        else:
+            stack.pop()
+            number = len(bodies)
+            if keys is None:
+                body = [BODY.pack(LIST, len(encoded))]
+                body.extend(LIST_ENTRY.pack(tag, payload) for tag, payload in encoded)
+            else:
+                body = [BODY.pack(DICT, len(encoded))]
+                for key, (tag, payload) in zip(keys, encoded):
+                    body.append(DICT_ENTRY.pack(string(str(key)), tag, payload))
+                    if key == "_types" and tag == NODE:
+                        for name in set(type_names(bodies[payload])):
+                            types.setdefault(name, []).append(number)
+            bodies.append(b"".join(body))
+            kids = [(p, slot) for slot, (tag, p) in enumerate(encoded) if tag == NODE]
+            children.append(kids)
+            if stack:
+                stack[-1][2].append((NODE, number))
+
+    # Find each node's parent and its slot within the parent.
+    parents = [(NO_PARENT, 0)] * len(bodies)
+    for parent, kids in enumerate(children):
+        for child, slot in kids:
+            parents[child] = (parent, slot)
+
+    # The type index, ordered by the string number of the type's name.
+    index = sorted(types.items())
+
+    # Lay out the tables.
+    blob = [s.encode("utf-8") for s in strings]
+    string_table = HEADER.size
+    blob_offset = string_table + STRING_ROW.size * len(blob)
+    node_table = blob_offset + sum(map(len, blob))
+    type_table = node_table + NODE_ROW.size * len(bodies)
+    type_numbers = type_table + TYPE_ROW.size * len(index)
+    body_offset = type_numbers + NUMBER.size * sum(len(n) for _, n in index)
+
+    out = [
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            0,
+            len(blob),
+            string_table,
+            blob_offset,
+            len(bodies),
+            node_table,
+            len(index),
+            type_table,
+        )
+    ]
+    begin = 0
+    for b in blob:
+        out.append(STRING_ROW.pack(begin, begin + len(b)))
+        begin += len(b)
+    out.extend(blob)
+    offset = body_offset
+    for body, (parent, slot) in zip(bodies, parents):
+        out.append(NODE_ROW.pack(offset, parent, slot))
+        offset += len(body)
+    first = 0
+    for name, numbers in index:
+        out.append(TYPE_ROW.pack(name, first, len(numbers)))
+        first += len(numbers)
+    for _, numbers in index:
+        out.extend(NUMBER.pack(n) for n in numbers)
+    out.extend(bodies)
+    return b"".join(out)
+
+
+def values(obj: Union[dict, list]) -> Any:
+    return obj.values() if isinstance(obj, dict) else obj
+
+
+def type_names(body: bytes) -> List[int]:
+    """
+    The string numbers of the strings in an encoded "_types" list.
+    """
+    entries = LIST_ENTRY.iter_unpack(body[BODY.size :])
+    return [payload for tag, payload in entries if tag == STR]
+
+
+#########################################################################
+# Reading.
+#########################################################################
+
+
+class BinaryDesign:
+    """
+    A memory mapped binary design file. Nodes and strings are read as they are needed.
+    """
+
+    data: mmap.mmap
+    strings: List[Optional[str]]  # strings read so far, by number.
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as fp:
+            try:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                self.data = b""
+        if len(self.data) < HEADER.size:
+            raise DocumentException(f"{filename} is not a binary design file")
+        (
+            magic,
+            version,
+            _,
+            string_count,
+            self.string_table,
+            self.blob,
+            self.node_count,
+            self.node_table,
+            self.type_count,
+            self.type_table,
+        ) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise DocumentException(
+                f"{filename} is not a version {VERSION} binary design file"
+            )
+        self.filename = filename
+        self.strings = [None] * string_count
+
+    def string(self, number: int) -> str:
+        s = self.strings[number]
+        if s is None:
+            offset = self.string_table + STRING_ROW.size * number
+            begin, end = STRING_ROW.unpack_from(self.data, offset)
+            s = self.strings[number] = str(
+                self.data[self.blob + begin : self.blob + end], "utf-8"
+            )
+        return s
+
+    def node(self, number: int) -> Union[dict, list]:
+        """
+        Read a node as a plain dict or list. Nested nodes are left as NodeRefs.
+        """
+        row = self.node_table + NODE_ROW.size * number
+        offset, _, _ = NODE_ROW.unpack_from(self.data, row)
+        kind, count = BODY.unpack_from(self.data, offset)
+        start = offset + BODY.size
+        value = self.value
+        if kind == DICT:
+            entries = self.data[start : start + DICT_ENTRY.size * count]
+            string = self.string
+            return {
+                string(key): value(tag, payload)
+                for key, tag, payload in DICT_ENTRY.iter_unpack(entries)
+            }
+        entries = self.data[start : start + LIST_ENTRY.size * count]
+        return [value(tag, payload) for tag, payload in LIST_ENTRY.iter_unpack(entries)]
+
+    def value(self, tag: int, payload: int) -> Any:
+        if tag == STR:
+            return self.string(payload)
+        elif tag == INT:
+            return payload
+        elif tag == NODE:
+            return NodeRef(self, payload)
+        elif tag == NONE:
+            return None
+        elif tag == TRUE or tag == FALSE:
+            return tag == TRUE
+        elif tag == FLOAT:
+            return DOUBLE.unpack(BITS.pack(payload))[0]
+        elif tag == BIG_INT:
+            return int(self.string(payload))
+        elif tag == DATE:
+            return date.fromisoformat(self.string(payload))
+        elif tag == DATETIME:
+            return datetime.fromisoformat(self.string(payload))
+        raise DocumentException(f"{self.filename}: unknown value tag {tag}")
+
+    def root(self) -> NodeRef:
+        """
+        The top of the design, still unread.
+        """
+        return NodeRef(self, self.node_count - 1)
+
+    def decode(self, object_pairs_hook: Callable = None) -> Union[dict, list]:
+        """
+        Read the entire design, as the json library would parse it.
+        :param object_pairs_hook: builds each dictionary from its (key, value) pairs.
+        """
+        top = []
+        stack = [(None, iter((self.root(),)), top)]
+        while stack:
+            keys, items, converted = stack[-1]
+            for item in items:
+                if isinstance(item, NodeRef):
+                    node = self.node(item.number)
+                    keys = list(node) if isinstance(node, dict) else None
+                    stack.append((keys, iter(values(node)), []))
+                    break
+                converted.append(item)
+            else:
+                stack.pop()
+                if keys is None:
+                    value = converted
+                elif object_pairs_hook is None:
+                    value = dict(zip(keys, converted))
+                else:
+                    value = object_pairs_hook(list(zip(keys, converted)))
+                if stack:
+                    stack[-1][2].append(value)
+        return top[0]
+
+    def types(self) -> Dict[str, int]:
+        """
+        The number of nodes of each type.
+        """
+        counts = {}
+        for n in range(self.type_count):
+            offset = self.type_table + TYPE_ROW.size * n
+            name, _, count = TYPE_ROW.unpack_from(self.data, offset)
+            counts[self.string(name)] = count
+        return counts
+
+    def instances(self, *types: str) -> List[int]:
+        """
+        Numbers of the nodes which have any of the types, in subtrees() order.
+        """
+        wanted = set(types)
+        found = set()
+        numbers = self.type_table + TYPE_ROW.size * self.type_count
+        for n in range(self.type_count):
+            offset = self.type_table + TYPE_ROW.size * n
+            name, first, count = TYPE_ROW.unpack_from(self.data, offset)
+            if self.string(name) in wanted:
+                begin = numbers + NUMBER.size * first
+                rows = self.data[begin : begin + NUMBER.size * count]
+                found.update(number for number, in NUMBER.iter_unpack(rows))
+        return sorted(found)
+
+    def location(self, number: int) -> List[Union[str, int]]:
+        """
+        The keys and list indices leading from the top of the design to a node.
+        """
+        steps = []
+        row = self.node_table + NODE_ROW.size * number
+        _, parent, slot = NODE_ROW.unpack_from(self.data, row)
+        while parent != NO_PARENT:
+            offset, grandparent, parent_slot = NODE_ROW.unpack_from(
+                self.data, self.node_table + NODE_ROW.size * parent
+            )
+            kind, _ = BODY.unpack_from(self.data, offset)
+            if kind == DICT:
+                entry = offset + BODY.size + DICT_ENTRY.size * slot
+                steps.append(self.string(DICT_ENTRY.unpack_from(self.data, entry)[0]))
+            else:
+                steps.append(slot)
+            parent, slot = grandparent, parent_slot
+        return steps[::-1]
+
+    def elements(self, top: Any, *types: str) -> List[Any]:
+        """
+        The elements which have any of the types,
+          reading only them and the elements above them.
+        :param top: the design as read from this file, not yet changed.
+        """
+        found = []
+        for number in self.instances(*types):
+            element = top
+            for step in self.location(number):
+                element = element[step]
+            found.append(element)
+        return found
+
+
+class NodeRef(Deferred):
+    """
+    A node of a binary design, not yet read.
+    """
+
+    __slots__ = ("design", "number")
+
+    def __init__(self, design: BinaryDesign, number: int):
+        self.design = design
+        self.number = number
+
+    def materialize(self) -> Union[dict, list]:
+        return self.design.node(self.number)
+
+    def __repr__(self):
+        return f"NodeRef({self.design.filename!r}, {self.number})"
+
+
+def read_design(filename: str, object_pairs_hook: Callable = None, lazy: bool = False):
+    """
+    Read a binary design file.
+    :param object_pairs_hook: builds each dictionary, as for json.
+    :param lazy: return the top of the design unread.
+       Its nodes are read as they are used.
+    """
+    design = BinaryDesign(filename)
+    return design.root() if lazy else design.decode(object_pairs_hook)
+
+
+#########################################################################
+# Command line converter.
+#########################################################################
+
+
+def main(argv: List[str] = None):
+    """
+    Convert a json or yaml design to a binary design.
+       python3 -m scribble.binary_design design.json [--output design.sbd] [--info]
+    """
+    import scribble.config_file as config
+
+    args = parse_args(argv)
+    if args.input.endswith(SUFFIX):
+        output = args.input
+    else:
+        output = args.output or args.input.rsplit(".", 1)[0] + SUFFIX
+        write_design(config.read(args.input), output)
+
+    if args.info:
+        design = BinaryDesign(output)
+        print(
+            f"{output}: {design.node_count} nodes, {len(design.strings)} strings, "
+            f"{len(design.data)} bytes"
+        )
+        for name, count in Counter(design.types()).most_common():
+            print(f"  {name:30} {count}")
+
+
+def parse_args(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert a json or yaml design to a binary design file"
+    )
+    parser.add_argument(
+        "input", help="The design file, .json or .yaml (or .sbd for --info)"
+    )
+    parser.add_argument(
+        "--output", help=f"The binary design file. Defaults to input{SUFFIX}"
+    )
+    parser.add_argument(
+        "--info", help="Summarize the binary design", action="store_true"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main()
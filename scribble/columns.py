@@ -0,0 +1,228 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (
+    annotations,
+)  # flake8: noqa F821 - Allows access to class name from within.
+
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Union
+
+from scribble.exceptions import DocumentException
+from scribble.obj import compile_path
+
+# NumPy is optional. It is only needed for columnar frames.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#########################################################################
+# Columnar frames.
+#
+# Register and field tables are thousands of elements with the same shape.
+#   Rather than fetching a path from each element every time we sort, group
+#   or format them, a frame fetches each path once into a column.
+#
+# Columns whose values are all Python ints, floats or bools become NumPy arrays,
+#   and sorting, grouping and duplicate removal on them are vectorized.
+#   Every other column is an object array, handled the same way the
+#   element-by-element routines in obj.py handle it. Either way, the results
+#   are the same as sorted_by, grouped_by and remove_duplicates.
+#########################################################################
+
+# Python types which make a numeric column, and the corresponding array types.
+NUMERIC = {int: "int64", float: "float64", bool: "bool"}
+
+
+class ColumnFrame:
+    """
+    A list of elements, along with a column of values for each path.
+      A frame can be used wherever a list of elements can.
+    """
+
+    elements: Any  # object array of the elements
+    columns: Dict[str, Any]  # path --> array of values, built on demand.
+
+    def __init__(self, elements: Sequence[Any], paths: Sequence[str] = ()):
+        """
+        :param elements: the elements, usually the results of a query.
+        :param paths: paths to fetch right away. Other paths are fetched when first used.
+        """
+        if np is None:
+            raise DocumentException("Columnar frames need numpy, which isn't installed")
+        self.elements = object_array(elements)
+        self.columns = {}
+        for path in paths:
+            self.column(path)
+
+    def column(self, path: str) -> Any:
+        """
+        The values at the path, one per element.
+        """
+        column = self.columns.get(path)
+        if column is None:
+            get = compile_path(path).get
+            column = self.columns[path] = to_array([get(e) for e in self.elements])
+        return column
+
+    def take(self, indices: Any) -> ColumnFrame:
+        """
+        A new frame with the elements (and columns) at the given positions.
+        """
+        frame = ColumnFrame.__new__(ColumnFrame)
+        frame.elements = self.elements[indices]
+        frame.columns = {path: column[indices] for path, column in self.columns.items()}
+        return frame
+
+    def sorted_by(self, path: str, reverse: bool = False) -> ColumnFrame:
+        """
+        The frame sorted by the value at the path. Equal values keep their order.
+        """
+        column = self.column(path)
+        n = len(column)
+
+        # CASE: numeric. A stable sort, reversed the way sorted(reverse=True) would do it.
+        if column.dtype != object:
+            if not reverse:
+                return self.take(np.argsort(column, kind="stable"))
+            return self.take(n - 1 - np.argsort(column[::-1], kind="stable")[::-1])
+
+        # OTHERWISE, sort the positions the same way obj.sorted_by() sorts elements.
+        order = sorted(range(n), key=column.__getitem__, reverse=reverse)
+        return self.take(np.array(order, dtype=np.intp))
+
+    def grouped_by(self, path: str) -> List[ColumnFrame]:
+        """
+        Groups the elements by the value at the path, in order of first appearance.
+        """
+        # Group numbers for each element, with groups numbered in order of appearance.
+        groups, count = self._group_numbers(path)
+        if count == 0:
+            return []
+
+        # Gather each group's positions, keeping their original order.
+        order = np.argsort(groups, kind="stable")
+        bounds = np.cumsum(np.bincount(groups, minlength=count))[:-1]
+        return [self.take(positions) for positions in np.split(order, bounds)]
+
+    def remove_duplicates(self, path: str) -> ColumnFrame:
+        """
+        Keep the first element with each value at the path.
+        """
+        column = self.column(path)
+        if column.dtype != object:
+            _, first = np.unique(column, return_index=True)
+            return self.take(np.sort(first))
+
+        # Same as obj.remove_duplicates(): values must be hashable.
+        seen, keep = set(), []
+        for n, value in enumerate(column):
+            if value not in seen:
+                seen.add(value)
+                keep.append(n)
+        return self.take(np.array(keep, dtype=np.intp))
+
+    def consistent_values(self, *paths: str):
+        """
+        Verifies all the elements have equal values at the paths. Throws exception on failure.
+        """
+        for path in paths:
+            column = self.column(path)
+            if len(column) < 2:
+                return
+
+            # Find the first value which differs from the first element's.
+            if column.dtype != object:
+                different = np.flatnonzero(column != column[0])
+                current = column[different[0]] if len(different) else column[0]
+            else:
+                current = next((v for v in column if v != column[0]), column[0])
+
+            # Raise an exception if they have different values.
+            if current != column[0]:
+                raise DocumentException(
+                    f"Inconsistent values: {path} -- {column[0]}|{current}"
+                )
+
+    def strings(self, fields: Sequence[Union[str, Callable]]) -> List[List[str]]:
+        """
+        The fields of each element as strings, one row per element.
+          A field is either a path or a function of the element.
+        """
+        if not fields:
+            return [[] for _ in range(len(self))]
+        columns = [
+            self.column(field).tolist()
+            if isinstance(field, str)
+            else [field(e) for e in self.elements]
+            for field in fields
+        ]
+        return [[str(value) for value in row] for row in zip(*columns)]
+
+    def _group_numbers(self, path: str):
+        """
+        A group number for each element, with groups numbered in order of appearance.
+          Like obj.grouped_by(), values are grouped by their string form.
+        """
+        column = self.column(path)
+
+        # CASE: ints and bools. Equal values have equal strings, so group by value.
+        if column.dtype.kind in "ib":
+            _, first, inverse = np.unique(column, return_index=True, return_inverse=True)
+            renumber = np.empty(len(first), dtype=np.intp)
+            renumber[np.argsort(first, kind="stable")] = np.arange(len(first))
+            return renumber[inverse.reshape(-1)], len(first)
+
+        # OTHERWISE, group by strings, as obj.grouped() does.
+        numbers = {}
+        groups = [numbers.setdefault(str(value), len(numbers)) for value in column.tolist()]
+        return np.array(groups, dtype=np.intp), len(numbers)
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.elements.tolist())
+
+    def __getitem__(self, n: int) -> Any:
+        return self.elements[n]
+
+
+def to_array(values: List[Any]) -> Any:
+    """
+    An array of values: numeric if they are all ints, floats or bools, otherwise objects.
+    """
+    kinds = set(map(type, values))
+    if len(kinds) == 1:
+        dtype = NUMERIC.get(kinds.pop())
+        if dtype is not None:
+            try:
+                array = np.array(values, dtype=dtype)
+            except OverflowError:  # ints too big for 64 bits
+                return object_array(values)
+            if not (array.dtype.kind == "f" and np.isnan(array).any()):
+                return array
+    return object_array(values)
+
+
+def object_array(values: Sequence[Any]) -> Any:
+    """
+    A one dimensional array holding the values as they are.
+      (np.array() would try to turn nested lists into more dimensions)
+    """
+    array = np.empty(len(values), dtype=object)
+    for n, value in enumerate(values):
+        array[n] = value
+    return array
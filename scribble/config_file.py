@@ -13,60 +13,129 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import json
+import logging
 import os
+import pickle
+import stat
+import tempfile
+import time
 import yaml
+from contextlib import suppress
+from copy import deepcopy
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
+import scribble.projection as projection
+from scribble.binary_design import SUFFIX, is_binary, read_design, write_design
+from scribble.projection import include_tree, project
 
-def read(filename: str) -> any:
+# Use the C version of the yaml loader if libyaml is installed.
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def read(
+    filename: str,
+    object_pairs_hook: Callable = None,
+    lazy: bool = False,
+    include: Optional[List[str]] = None,
+) -> any:
     """
-    Parse a configuration file, either yaml or json.
+    Parse a configuration file, either yaml or json, or a binary design file (.sbd).
     If extension isn't specified, will check to see which one exists.
     :param filename: name of file, possibly without extension
+    :param object_pairs_hook: builds each mapping from its list of (key, value) pairs,
+           in place of a dict. (Same as json's object_pairs_hook)
+    :param lazy: for a binary design, return the top node unread. (See binary_design.py)
+    :param include: if given, only read these paths of a design. (See projection.py)
     :return:  structured object or None
     """
 
     # If the file doesn't exist, try adding .yaml or .json to the file name.
-    if os.path.isfile(filename):
-        path = filename
-    elif os.path.isfile(f"{filename}.yaml"):
-        path = f"{filename}.yaml"
-    elif os.path.isfile(f"{filename}.json"):
-        path = f"{filename}.json"
-    else:
-        raise FileNotFoundError(
-            f"Unable to find any of these configuration files:\n  "
-            f"{filename}\n  {filename}.yaml\n  {filename}.json"
-        )
+    path, status = find(filename)
 
     # Open the file and parse the contents.
     #   The json library parses json *much* faster than the yaml library,
     #   so use the json library if appropriate.
+    #   Json is projected as it is parsed, other formats once they are read.
     if Path(path).suffix == ".json":
-        obj = load_json(path)
+        return load_json(path, object_pairs_hook, include)
+    elif is_binary(path):
+        obj = read_design(path, object_pairs_hook, lazy)
     else:
-        obj = load_yaml(path)
+        obj = cache.load(path, status, object_pairs_hook)
+    if include is not None:
+        obj = project(obj, include_tree(include))
 
     # Return the configuration
     return obj
 
 
-def load_yaml(name: str) -> any:
+def find(filename: str) -> Tuple[str, os.stat_result]:
+    """
+    The name of the configuration file, along with its status.
+      Looks for the file as given, then with .yaml or .json added.
+    """
+    for path in (filename, f"{filename}.yaml", f"{filename}.json"):
+        with suppress(OSError):
+            status = os.stat(path)
+            if stat.S_ISREG(status.st_mode):
+                return path, status
+
+    raise FileNotFoundError(
+        f"Unable to find any of these configuration files:\n  "
+        f"{filename}\n  {filename}.yaml\n  {filename}.json"
+    )
+
+
+def load_yaml(name: str, object_pairs_hook: Callable = None) -> any:
     with open(name, "r") as fp:
-        obj = yaml.safe_load(fp)
+        if object_pairs_hook is None:
+            obj = yaml.load(fp, Loader=SafeLoader)
+        else:
+            obj = yaml.load(fp, Loader=pairs_loader(object_pairs_hook))
     return obj
 
 
-def load_json(name: str) -> any:
+def load_json(
+    name: str, object_pairs_hook: Callable = None, include: Optional[List[str]] = None
+) -> any:
     with open(name, "r") as fp:
-        obj = json.load(fp)
+        if include is None:
+            obj = json.load(fp, object_pairs_hook=object_pairs_hook)
+        else:
+            obj = projection.load_json(fp.read(), include_tree(include), object_pairs_hook)
     return obj
 
 
+def pairs_loader(object_pairs_hook: Callable) -> type:
+    """
+    A safe yaml loader which builds each mapping with object_pairs_hook, like json does.
+    """
+
+    class PairsLoader(SafeLoader):
+        def construct_object(self, node: yaml.Node, deep: bool = False) -> any:
+            # Each alias gets its own copy of the anchored value, as from_obj() would make.
+            if node in self.constructed_objects:
+                return deepcopy(self.constructed_objects[node])
+            return super().construct_object(node, deep)
+
+    def construct_mapping(loader: SafeLoader, node: yaml.MappingNode) -> any:
+        # Handle merge keys (<<) the same way the safe loader does.
+        loader.flatten_mapping(node)
+        return object_pairs_hook(loader.construct_pairs(node, deep=True))
+
+    PairsLoader.add_constructor("tag:yaml.org,2002:map", construct_mapping)
+    return PairsLoader
+
+
 def write(obj: any, filename: str):
     """
-    Write a configuration file, either yaml or json.
+    Write a configuration file, either yaml or json, or a binary design file (.sbd).
     If extension isn't specified, will check to see which one exists.
     :param obj: the object to be saved in the config file.
     :param filename: name of file, possibly without extension
@@ -80,14 +149,16 @@ def write(obj: any, filename: str):
         extension = ".yaml"
         filename = name + extension
 
-    # If not explicitly yaml or json, then add .yaml to the output name.
-    if extension != ".yaml" and extension != ".json":
+    # If not explicitly yaml, json or binary, then add .yaml to the output name.
+    if extension not in (".yaml", ".json", SUFFIX):
         extension = ".yaml"
         filename = filename + extension
 
     # save the object as requested.
     if extension == ".yaml":
         save_yaml(obj, filename)
+    elif extension == SUFFIX:
+        write_design(obj, filename)
     else:
         save_json(obj, filename)
 
@@ -100,3 +171,195 @@ def save_json(obj: any, name: str):
 def save_yaml(obj: any, name: str):
     with open(name, "w") as fp:
         yaml.safe_dump(obj, fp)
+
+
+#########################################################################
+# Caching parsed yaml.
+#
+# The same yaml files are read over and over: the config, the design and the
+#   Fixup.yaml in every type directory. Even with libyaml, the objects are
+#   constructed in Python, so parsing is slow.
+#
+# Each yaml file is parsed once per process, as plain dicts and lists.
+#   Every read gets its own copy, built with the caller's object_pairs_hook,
+#   so callers are free to change what they get. As with from_obj(), values
+#   repeated through yaml aliases are copied separately. A cached file is parsed
+#   again if its modification time or size changes.
+#
+# Large files (usually designs) are read once, so they aren't kept in memory.
+#   With a cache directory, parsed files of any size are also pickled to disk
+#   for the next run. (The document's --cache-dir, see document.py)
+#
+# Json isn't cached. The json library parses it faster than it can be copied.
+#########################################################################
+
+MEMORY_LIMIT = 1024 * 1024  # Largest yaml file to keep in memory.
+
+
+class ParseStats(NamedTuple):
+    hits: int  # Reads answered from memory.
+    disk_hits: int  # Reads answered from the cache directory.
+    misses: int  # Files which were parsed.
+    parse_seconds: float  # Time spent parsing.
+    saved_seconds: float  # Parse time avoided, less the time spent copying.
+
+
+class YamlCache:
+    """
+    Parsed yaml files, keyed by path and checked against each file's time and size.
+    """
+
+    def __init__(self, directory: str = ""):
+        """
+        :param directory: where to keep parsed files between runs, if anywhere.
+        """
+        self.directory = directory
+        self.entries = {}  # path --> (stamp, plain object, seconds to parse)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.parse_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def load(
+        self, path: str, status: os.stat_result, object_pairs_hook: Callable = None
+    ) -> Any:
+        """
+        A fresh copy of a parsed yaml file, built with object_pairs_hook.
+        """
+        start = time.perf_counter()
+        key = os.path.abspath(path)
+        stamp = (status.st_mtime_ns, status.st_size)
+        keep = status.st_size <= MEMORY_LIMIT
+
+        # CASE: we parsed this version of the file earlier in the run.
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            obj = rebuild(entry[1], object_pairs_hook or dict)
+            self.saved_seconds += entry[2] - (time.perf_counter() - start)
+            return obj
+
+        # CASE: a large file with nowhere to keep it. Just parse it.
+        if not keep and not self.directory:
+            self.misses += 1
+            obj = load_yaml(path, object_pairs_hook)
+            self.parse_seconds += time.perf_counter() - start
+            return obj
+
+        # CASE: an earlier run parsed this version of the file.
+        entry = self._read_sidecar(key, stamp)
+        if entry is not None:
+            self.disk_hits += 1
+
+        # OTHERWISE, parse it as plain dicts and lists.
+        else:
+            self.misses += 1
+            obj = load_yaml(path)
+            seconds = time.perf_counter() - start
+            self.parse_seconds += seconds
+            entry = (stamp, obj, seconds)
+            self._write_sidecar(key, entry)
+
+        # The object we have is private, unless we keep it for later reads.
+        obj = entry[1]
+        if keep:
+            self.entries[key] = entry
+        if keep or object_pairs_hook is not None:
+            obj = rebuild(obj, object_pairs_hook or dict)
+        return obj
+
+    def stats(self) -> ParseStats:
+        return ParseStats(
+            self.hits, self.disk_hits, self.misses, self.parse_seconds, self.saved_seconds
+        )
+
+    def clear(self):
+        self.entries.clear()
+
+    def _sidecar(self, key: str) -> Path:
+        return Path(self.directory) / f"{hashlib.sha256(key.encode()).hexdigest()}.pickle"
+
+    def _read_sidecar(self, key: str, stamp: Tuple[int, int]) -> Optional[Tuple]:
+        """
+        The entry saved by an earlier run, if it is for the same version of the file.
+        """
+        if not self.directory:
+            return None
+        start = time.perf_counter()
+        try:
+            with open(self._sidecar(key), "rb") as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring cached copy of {key}: {e}")
+            return None
+        if saved["path"] != key or saved["stamp"] != stamp:
+            return None
+        self.saved_seconds += saved["seconds"] - (time.perf_counter() - start)
+        return stamp, saved["obj"], saved["seconds"]
+
+    def _write_sidecar(self, key: str, entry: Tuple):
+        """
+        Save a parsed file for later runs. Failures only cost speed.
+        """
+        if not self.directory:
+            return
+        stamp, obj, seconds = entry
+        saved = dict(path=key, stamp=stamp, obj=obj, seconds=seconds)
+        name = self._sidecar(key)
+        temp = None
+        try:
+            name.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=name.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, name)
+        except Exception as e:
+            logging.warning(f"Unable to cache parsed copy of {key}: {e}")
+            if temp is not None:
+                with suppress(OSError):
+                    os.remove(temp)
+
+
+def rebuild(obj: Any, object_pairs_hook: Callable) -> Any:
+    """
+    A copy of plain dicts and lists, with each dict built by object_pairs_hook.
+      Every occurrence of a value gets its own copy, even if the yaml shared it with an alias.
+      The tree is walked with an explicit stack, so deep trees don't recurse.
+    """
+    if not isinstance(obj, (dict, list)):
+        return obj
+
+    # Each entry is (original, its remaining children, (key, copy) pairs so far, its own key).
+    stack = [(obj, children(obj), [], None)]
+    while True:
+        original, items, built, key = stack[-1]
+        for k, value in items:
+            if isinstance(value, (dict, list)):
+                stack.append((value, children(value), [], k))
+                break
+            built.append((k, value))
+
+        # All the children are copied. Copy the original and hand it to its parent.
+        else:
+            stack.pop()
+            if isinstance(original, dict):
+                copy = object_pairs_hook(built)
+            else:
+                copy = [value for _, value in built]
+            if not stack:
+                return copy
+            stack[-1][2].append((key, copy))
+
+
+def children(obj: Any) -> Iterator[Tuple[Any, Any]]:
+    """
+    An iterator over the (key, child) pairs of a dict or list.
+    """
+    return iter(obj.items()) if isinstance(obj, dict) else enumerate(obj)
+
+
+# The process wide cache of parsed yaml.
+cache = YamlCache()
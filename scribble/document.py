@@ -15,14 +15,19 @@
 
 from typing import List
 from os.path import dirname
+import logging
 import sys
 from pathlib import Path
+import scribble.config_file as config_file
 import scribble.template as template
 from scribble.exceptions import DocumentException
 from scribble.importer import JinjaFileLoader, addImportPath
+from scribble.binary_design import is_binary
+from scribble.memo import QueryMemo, DEFAULT_ENTRIES, DEFAULT_BYTES
 from scribble.scope import Element, MemoizedQueryStream
 from scribble.section import Section, Snippet
-from scribble.fixup import fixup_document
+from scribble.snapshot import Snapshot
+from scribble.fixup import fixup_document, consulted as fixups_consulted
 from scribble.diagrams import Figure, Image
 import argparse
 from scribble.path_interpolation import initPathInterpolation, pathLookup
@@ -36,6 +41,7 @@ def document(
     sections: List[str] = None,
     directories: List[str] = None,
     values: List[str] = None,
+    cache_dir: str = "",
 ):
     """
     Create a document.
@@ -48,6 +54,7 @@ def document(
     :param sections: A list of document section to add to the configuration.
     :param directories: A list of snippet directories to add to the configuration.
     :param values: A list of "path=value" strings to update the document
+    :param cache_dir: Where to keep snapshots of the fixed up document, if anywhere.
     """
 
     # Default the following parameters to empty list
@@ -56,7 +63,7 @@ def document(
     values = values or []
 
     # Read the configuration and prepare to create a document.
-    doc = setup(config, output, design_file, sections, directories, values)
+    doc = setup(config, output, design_file, sections, directories, values, cache_dir)
 
     # Pass globals as context to all subsequent sections
     context = doc.globals if doc.globals else {}
@@ -71,6 +78,13 @@ def document(
             for text in Section(section, doc, **context):
                 f.write(str(text))
 
+    # Report how much yaml parsing the cache saved.
+    stats = config_file.cache.stats()
+    logging.info(
+        f"Yaml files: {stats.misses} parsed in {stats.parse_seconds:.3f}s, "
+        f"{stats.hits + stats.disk_hits} cached reads saved {stats.saved_seconds:.3f}s"
+    )
+
 
 def setup(
     config: str,
@@ -79,10 +93,18 @@ def setup(
     sections: List[str],
     directories: List[str],
     values: List[str],
+    cache_dir: str = "",
 ):
     """
     Read in the document and design data needed to create a document.
+    :param cache_dir: Where to keep snapshots of the fixed up document. (See snapshot.py)
     """
+    # Queries made while the design is being built must not be answered from an earlier document.
+    MemoizedQueryStream.disable()
+
+    # Parsed yaml files can be kept alongside the snapshots. (See config_file.py)
+    config_file.cache.directory = f"{cache_dir}/yaml" if cache_dir else ""
+
     # Read in the document configuration (or start from scratch)
     if config:
         doc = Element.read(config)  # config cannot have interpolations.
@@ -127,9 +149,7 @@ def setup(
         **(doc.paths or {}),
     )
 
-    # Read in the design file (if present)
-    if doc.design_file:
-        doc.design = Element.read(pathLookup(doc.design_file, doc.config))
+    design_file = doc.design_file and pathLookup(doc.design_file, doc.config)
 
     # Add the additional document directories to sys.path so we can find sections.
     if doc.directories:
@@ -139,7 +159,15 @@ def setup(
         addImportPath(*directories)
 
     # Keep track of which directories contain component snippets. Mainly to help with Fixups.
-    doc.snippets = [path for path in sys.path if Path(f"{path}/components").is_dir()]
+    #   (A directory added by an earlier document in the same process is only listed once)
+    snippets = [path for path in sys.path if Path(f"{path}/components").is_dir()]
+    doc.snippets = list(dict.fromkeys(snippets))
+
+    # A snapshot is keyed by the document as configured, including its snippet directories.
+    #   Lazy fixups aren't done until the document is rendered, so there is nothing to save.
+    #   An audit has to run the fixups it reports on.
+    use_snapshot = cache_dir and not doc.fixup_lazy and not doc.fixup_audit
+    snapshot = Snapshot(cache_dir, doc, design_file) if use_snapshot else None
 
     # Prepare to load jinja2 templates as Python modules.
     JinjaFileLoader.install()
@@ -149,12 +177,43 @@ def setup(
         Section=Section, Snippet=Snippet, Figure=Figure, Image=Image
     )
 
-    # Apply fixups to the document.
-    fixup_document(doc)
+    # If a previous run had the same inputs, start from its fixed up document.
+    saved = snapshot.load() if snapshot else None
+    if saved:
+        doc, index = saved
+
+    # OTHERWISE, read in the design file (if present)
+    #   Large designs can set "design_share_strings" to store repeated keys and strings once,
+    #   and "design_lazy" to convert only the parts of the design which are used.
+    #   Binary designs (.sbd) are always lazy.
+    #   A document which only uses some of the design can list the paths in "design_include".
+    lazy = bool(doc.design_lazy) or is_binary(doc.design_file or "")
+    if not saved:
+        index = None
+        if design_file:
+            doc.design = Element.read(
+                design_file,
+                share_strings=bool(doc.design_share_strings),
+                lazy=lazy,
+                include=list(doc.design_include) if doc.design_include else None,
+            )
+
+        # Apply fixups to the document. ("fixup_lazy" waits until each element is used)
+        fixup_document(doc)
 
     # Finished. Our design/document tree is set up. No more changes to the design tree.
-    #  We can "memoize" future queries against the tree.
-    MemoizedQueryStream.enable()
+    #  We can index the tree and "memoize" future queries against it.
+    #  The memo is sized by the optional "query_memo" settings.
+    memo = QueryMemo(
+        doc.config or doc.output_name,
+        max_entries=doc.query_memo.entries or DEFAULT_ENTRIES,
+        max_bytes=doc.query_memo.bytes or DEFAULT_BYTES,
+    )
+    MemoizedQueryStream.enable(doc, memo, lazy=lazy, index=index)
+
+    # Save a snapshot for the next run. (It needs the whole design, so it can't be lazy)
+    if snapshot and not saved:
+        snapshot.save(doc, MemoizedQueryStream.design_index(), fixups_consulted)
     return doc
 
 
@@ -168,6 +227,7 @@ def main() -> None:
          --design-file <name of object model design file>
          --snippets <list of directories where snippets are found>
          --values  <list of path=value pairs to be inserted into the document>
+         --cache-dir <directory for snapshots of the fixed up document>
 
     The command line arguments are merged into the document configuration.
       - document "sections" are appended together
@@ -188,6 +248,7 @@ def main() -> None:
         directories=args.directories,
         design_file=args.design_file,
         values=args.values,
+        cache_dir=args.cache_dir,
     )
 
 
@@ -212,6 +273,11 @@ def parse_args():
         default=[],
     )
     parser.add_argument("--design-file", help="Name of the Object Model design file")
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for snapshots of the fixed up document, to speed up later runs",
+        default="",
+    )
     parser.add_argument(
         "--values",
         help="Followed by a list of path=value strings to be inserted into the document",
@@ -13,11 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import sys
+import time
 from contextlib import suppress
 from os.path import dirname
-from scribble.scope import Element
-from scribble.importer import LoadSourceFile
-from scribble.obj import scan, set_path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from scribble.config_file import find
+from scribble.exceptions import DocumentException
+from scribble.objdict import LazyList, LazyObjdict
+from scribble.scope import Element, MemoizedQueryStream
+from scribble.importer import LoadSourceFile, LoadSourceModule
+from scribble.obj import PatchPlan, Pending, scan, set_path
 from scribble.path_interpolation import pathLookup
 from scribble.section import load_section
 
@@ -41,6 +49,35 @@ from scribble.section import load_section
 # It is possible for a fixup to add or remove sub-elements, changing the shape of the design tree.
 #   Fixups must be applied in a top-down manner.   document -->  design --> individual elements
 #
+# A snippet's Fixup.py may define FixupBatch(elements, document) in place of Fixup().
+#   It is called with all the elements of its type, in the order they were reached, and the
+#   snippet's patches are applied after it. To keep the top-down order, the elements below
+#   an element waiting for a batch are held back until the batch has run. The design is
+#   fixed up in rounds: scan down to the batched elements, run the batches, then scan below
+#   them, including any elements the batches added. Elements of a batched type nested inside
+#   one another go to the batch in separate rounds.
+#   An element's more specific types can't have per element fixups or patches once a more
+#   general type has a batch, since they would be applied before the batch.
+#
+# A document with "fixup_lazy" set puts off each element's snippet fixups until the element is
+#   first used: by a query filtering on it, by a Snippet dispatching on its type, or by reading
+#   any of its values. Its enclosing elements are fixed up first, keeping the top-down order.
+#   A batch runs when the first of its elements is used. Lazy fixups must not change the shape
+#   of the design tree or the types of its elements, since the design index may be built before
+#   they run. If they change an indexed subtree, the document fails rather than giving queries
+#   which quietly miss elements. Document type and design fixups are always applied right away.
+#   In a lazy design (See objdict.LazyObjdict), elements are marked pending as they are converted,
+#   so the design is only converted as it is used. A batch converts the whole design, though,
+#   since it needs all its elements.
+#
+# Snippet fixups are looked up by element type in a FixupRegistry. Each snippet's Fixup.py is
+#   loaded (and its Fixup.yaml read and compiled into a PatchPlan) once per document, not once
+#   per element. Patch values are copied each time they are applied, so elements never share them.
+#
+# Every directory searched for fixups is remembered, whether or not it had any.
+#   A snapshot of the fixed up document depends on what those directories hold. (See snapshot.py)
+#
+consulted: Set[str] = set()
 
 
 def fixup_document(document: Element):
@@ -66,6 +103,12 @@ def fixup_document(document: Element):
     errors get fixed.
     """
 
+    consulted.clear()
+
+    # With "fixup_audit", time each fixup and record what it changed. (See FixupAudit)
+    global audit
+    audit = FixupAudit(document) if document.fixup_audit else None
+
     # Apply Document Type fixups from directories of the document generator modules
     for module in document.document_sections:
         apply_fixup_function(document, document, find_section_directory(module))
@@ -81,18 +124,71 @@ def fixup_document(document: Element):
         )
 
     # Apply Element (snippet) to each matching element of the design.
+    #   With "fixup_lazy", each element is fixed up when it is first used.
     if document.snippets and document.design:
-        scan(document.design, lambda element: fixup_snippet(element, document))
+        registry = FixupRegistry(document.snippets)
+        if document.fixup_lazy:
+            LazyFixups(registry, document).defer(document.design)
+        else:
+            fixup_snippets(document.design, document, registry)
 
+    # Report on the fixups which were applied.
+    if audit:
+        audit.write(pathLookup(document.fixup_audit, document.config))
 
-def fixup_snippet(element: Element, document: Element):
+
+def fixup_snippets(design: Element, document: Element, registry: "FixupRegistry"):
+    """
+    Apply snippet fixups to each element of the design, top down.
+      The elements below an element waiting for a batch are fixed up after the batch runs.
+    """
+    tops = [design]
+    while tops:
+        # Scan down to the elements waiting for batches, fixing up the elements on the way.
+        held = []
+        stack = [iter(tops)]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, dict):
+                    if fixup_snippet(item, document, registry):
+                        held.append(item)
+                    else:
+                        stack.append(iter(item.values()))
+                    break
+                elif isinstance(item, list):
+                    stack.append(iter(item))
+                    break
+            else:
+                stack.pop()
+
+        # Run the batches, then carry on below the elements which waited for them.
+        registry.run_batches(document)
+        tops = [value for element in held for value in element.values()]
+
+
+def fixup_snippet(
+    element: Element, document: Element, registry: "FixupRegistry" = None
+) -> bool:
     """
     Apply fixups to a snippet. Start with most general type and finish with most specific.
+    :param registry: the snippet fixups, loaded once for the whole design.
+       Batch fixups are queued in the registry, to be run by registry.run_batches().
+    :return: whether the element was queued for a batch.
     """
+    queued = False
     if element._types:
-        for typ in reversed(element._types):
-            for dir in document.snippets:
-                fixup_element(element, document, f"{dir}/components/{typ}")
+        registry = registry or FixupRegistry(document.snippets)
+        for fixups in registry.element_fixups(element):
+            fixup, patches, batch = fixups
+            if batch:
+                registry.queue(fixups, element)
+                queued = True
+                continue
+            if fixup:
+                fixup(element, document)
+            if patches:
+                patches.apply(element, copy=True)
+    return queued
 
 
 def fixup_element(element: Element, document: Element, dir: str):
@@ -108,9 +204,13 @@ def apply_fixup_patches(element: Element, document: Element, dir: str):
     Apply Fixup.yaml patches to an element.
     """
     # Get the Fixup.yaml file if there is one.
+    consulted.add(dir)
     with suppress(FileNotFoundError):
         patches = Element.read(f"{dir}/Fixup")
-        if patches:
+        if patches and audit:
+            source = find(f"{dir}/Fixup")[0]
+            audit.run(source, [element], lambda: apply_patches(element, patches))
+        elif patches:
             apply_patches(element, patches)
 
 
@@ -126,15 +226,587 @@ def apply_fixup_function(element: Element, document: Element, dir: str):
     Apply Fixup.py function to an element.
     """
 
+    consulted.add(dir)
+
     # Create a dummy module name so we don't have name conflicts when we load Fixup.py
     dummy_name = f"Fixup.Fix_{dir.replace('/', '_')}"
 
     # If it exists, apply the fixup function.
     fixup = LoadSourceFile("Fixup", dummy_name, f"{dir}/Fixup.py")
+    if fixup and audit:
+        fixup = audit.function(fixup, f"{dir}/Fixup.py")
     if fixup:
         fixup(element, document)
 
 
+# The fixups for one type of element in one snippet directory:
+#   a function, patches, and a batch function.
+Fixups = Tuple[Optional[Callable], Optional[PatchPlan], Optional[Callable]]
+
+PATCH_FILES = ("Fixup", "Fixup.yaml", "Fixup.json")
+
+
+class FixupRegistry:
+    """
+    The snippet fixups for each type of element.
+      The snippet directories are scanned once. Each Fixup.py is loaded, and each
+      Fixup.yaml read, the first time an element of its type is seen.
+    """
+
+    def __init__(self, snippets: List[str]):
+        """
+        :param snippets: directories containing a "components" directory of snippets.
+        """
+        self.snippets = snippets
+        self.components = [component_files(f"{dir}/components") for dir in snippets]
+        self.by_type = {}  # type --> fixups from each snippet directory which has them.
+        self.batches = {}  # id(fixups) --> (fixups, elements waiting for the batch function)
+
+    def fixups(self, typ: str) -> List[Fixups]:
+        """
+        The fixups for a type, in snippet directory order.
+        """
+        fixups = self.by_type.get(typ)
+        if fixups is None:
+            fixups = self.by_type[typ] = self._load(typ)
+        return fixups
+
+    def element_fixups(self, element: Element) -> List[Fixups]:
+        """
+        The fixups of an element, from its most general type to its most specific.
+          A batch runs once its round is scanned, so no fixups may follow it on the same
+          element. Otherwise they would be applied before the more general batch.
+        """
+        fixups = []
+        batched = None
+        for typ in reversed(element._types):
+            for f in self.fixups(typ):
+                if batched and not f[2]:
+                    raise DocumentException(
+                        f"Element {element.name or ''} has fixups for {typ} which would run"
+                        f" before the FixupBatch for {batched}. Use FixupBatch for {typ} as well."
+                    )
+                if f[2] and not batched:
+                    batched = typ
+                fixups.append(f)
+        return fixups
+
+    def _load(self, typ: str) -> List[Fixups]:
+        fixups = []
+        for dir, components in zip(self.snippets, self.components):
+            path = f"{dir}/components/{typ}"
+            consulted.add(path)
+            files = components.get(typ, ())
+
+            # The function or batch function, if there is one.
+            fixup = batch = None
+            if "Fixup.py" in files:
+                dummy_name = f"Fixup.Fix_{path.replace('/', '_')}"
+                module = LoadSourceModule(dummy_name, f"{path}/Fixup.py")
+                batch = getattr(module, "FixupBatch", None)
+                fixup = None if batch else getattr(module, "Fixup", None)
+
+            # The patches, from the first patch file found. (Same order as Element.read)
+            #   They are compiled once, then applied to each element in a single walk.
+            patches = None
+            name = next((name for name in PATCH_FILES if name in files), None)
+            if name:
+                patches = Element.read(f"{path}/{name}")
+                patches = PatchPlan(patches) if patches else None
+
+            # When auditing, each fixup reports to the audit.
+            if audit:
+                fixup = fixup and audit.function(fixup, f"{path}/Fixup.py")
+                batch = batch and audit.batch(batch, f"{path}/Fixup.py")
+                patches = patches and AuditedPlan(audit, patches, f"{path}/{name}")
+
+            if fixup or patches or batch:
+                fixups.append((fixup, patches, batch))
+        return fixups
+
+    def queue(self, fixups: Fixups, element: Element):
+        """
+        Queue an element for a batch fixup.
+        """
+        self.batches.setdefault(id(fixups), (fixups, []))[1].append(element)
+
+    def run_batches(self, document: Element):
+        """
+        Run the batch fixups on the elements queued for them, in the order they were first queued.
+        """
+        batches, self.batches = self.batches, {}
+        for (_, patches, batch), elements in batches.values():
+            batch(elements, document)
+            if patches:
+                for element in elements:
+                    patches.apply(element, copy=True)
+
+
+class LazyFixups:
+    """
+    Snippet fixups which are applied to each element when it is first used.
+      Until then, the element's class is a pending version of its own. The first
+      use of the element applies its fixups and gives it back its own class.
+    """
+
+    def __init__(self, registry: FixupRegistry, document: Element):
+        self.registry = registry
+        self.document = document
+        self.parents = {}  # id(element) --> nearest enclosing element with fixups.
+        self.batches = {}  # id(fixups) --> (fixups, elements) for batches not yet run.
+        self.classes = {}  # element class --> pending version of the class
+        self.converting = {}  # lazy element class --> version which defers fixups as converted
+        self.design = None  # The design, if it is lazy.
+
+    def defer(self, design: Element):
+        """
+        Mark each element of the design which has snippet fixups as pending.
+          A lazy design is left as it is. Its elements are marked as they are converted.
+        """
+        if isinstance(design, LazyObjdict):
+            self.design = design
+            self._defer_converted(design)
+            return
+
+        # Scan down the tree, remembering the nearest pending element above.
+        stack = [(iter((design,)), None)]
+        while stack:
+            items, above = stack[-1]
+            for item in items:
+                if isinstance(item, dict):
+                    children = iter(item.values())  # Before it is pending.
+                    if self._has_fixups(item):
+                        self.parents[id(item)] = above
+                        object.__setattr__(item, "__class__", self.pending_class(type(item)))
+                        above = item
+                    stack.append((children, above))
+                    break
+                elif isinstance(item, list):
+                    stack.append((iter(item), above))
+                    break
+            else:
+                stack.pop()
+
+    def _defer_converted(self, design: LazyObjdict):
+        """
+        Mark the parts of a lazy design which were already converted, and have the rest
+          marked as they are converted.
+        """
+        # Follow the values which were already converted, without converting any others.
+        object.__setattr__(design, "__class__", self.converting_class(type(design)))
+        self.converted(None, design)
+        stack = [(design, iter(dict.values(design)))]
+        while stack:
+            owner, values = stack[-1]
+            for value in values:
+                if isinstance(value, LazyObjdict):
+                    object.__setattr__(value, "__class__", self.converting_class(type(value)))
+                    self.converted(owner, value)
+                    stack.append((value, iter(dict.values(value))))
+                    break
+                elif isinstance(value, LazyList):
+                    value.kind = self.converting_class(value.kind)
+                    stack.append((owner, list.__iter__(value)))
+                    break
+            else:
+                stack.pop()
+
+    def converted(self, owner: Optional[Element], element: Element):
+        """
+        Mark an element of a lazy design as pending, if it has fixups, as it is converted.
+        """
+        # The nearest pending element above. If it was already fixed up, so are those above it.
+        above = owner if isinstance(owner, Pending) else self.parents.get(id(owner))
+        if not isinstance(above, Pending):
+            above = None
+
+        # Elements without fixups remember it too, for the elements converted below them.
+        if self._has_fixups(element):
+            self.parents[id(element)] = above
+            object.__setattr__(element, "__class__", self.pending_class(type(element)))
+        elif above is not None:
+            self.parents[id(element)] = above
+
+    def converting_class(self, cls: type) -> type:
+        """
+        The version of a lazy element class which defers the fixups of each element it converts.
+        """
+        converting = self.converting.get(cls)
+        if converting is None:
+            fixer = self
+
+            def lazy(_, value):
+                return LazyObjdict.lazy.__func__(converting, value)
+
+            def _converted(owner, value):
+                value = cls._converted(owner, value)
+                if isinstance(value, LazyObjdict):
+                    fixer.converted(owner, value)
+                return value
+
+            methods = dict(__slots__=(), lazy=classmethod(lazy), _converted=_converted)
+            converting = type(cls.__name__, (cls,), methods)
+            self.converting[cls] = self.converting[converting] = converting
+        return converting
+
+    def _has_fixups(self, element: dict) -> bool:
+        if not element._types:
+            return False
+        fixups = self.registry.element_fixups(element)
+        for f in fixups:
+            if f[2]:
+                self.batches.setdefault(id(f), (f, []))[1].append(element)
+        return bool(fixups)
+
+    def fix(self, element: Element):
+        """
+        Apply the pending fixups of an element, after those of the elements enclosing it.
+        """
+        # Find the enclosing elements which are still pending, and fix from the top down.
+        chain = []
+        while isinstance(element, Pending):
+            chain.append(element)
+            element = self.parents[id(element)]
+        for element in reversed(chain):
+            self._fix(element)
+
+    def _fix(self, element: Element):
+        # Give the element its own class back.
+        if not isinstance(element, Pending):
+            return
+        object.__setattr__(element, "__class__", type(element).__bases__[-1])
+        del self.parents[id(element)]
+
+        # Apply its functions and patches. As when fixing up the whole design,
+        #   the elements below it are seen as they are, not yet fixed up.
+        fixups = self.registry.element_fixups(element)
+        with Pending.hold():
+            for fixup, patches, batch in fixups:
+                if fixup:
+                    fixup(element, self.document)
+                if patches and not batch:
+                    patches.apply(element, copy=True)
+        self.check(element)
+
+        # Then any batches it belongs to.
+        for fixups in fixups:
+            if fixups[2]:
+                self._run_batch(fixups)
+
+    def _run_batch(self, fixups: Fixups):
+        """
+        Run a batch on all its elements, once the rest of their fixups are applied.
+        """
+        # In a lazy design, convert the rest of the design to find all the batch's elements.
+        if self.design is not None and id(fixups) in self.batches:
+            order = {}
+            with Pending.hold():
+                scan(self.design, lambda element: order.setdefault(id(element), len(order)))
+            self.batches[id(fixups)][1].sort(key=lambda element: order[id(element)])
+
+        _, elements = self.batches.pop(id(fixups), (None, None))
+        if elements is None:
+            return
+        for element in elements:
+            self.fix(element)
+        _, patches, batch = fixups
+        with Pending.hold():
+            batch(elements, self.document)
+            if patches:
+                for element in elements:
+                    patches.apply(element, copy=True)
+        for element in elements:
+            self.check(element)
+
+    def check(self, element: Element):
+        """
+        Fail if fixing up an element changed the elements of its subtree after it was indexed.
+        """
+        index = MemoizedQueryStream.index
+        if index is not None and element in index and not index.unchanged(element):
+            raise DocumentException(
+                f"Lazy fixups of design element '{index.path_of(element)}' added, removed or"
+                " retyped elements after the design was indexed. Turn off fixup_lazy."
+            )
+
+    def pending_class(self, cls: type) -> type:
+        """
+        The pending version of an element class, whose instances are fixed up when used.
+        """
+        pending = self.classes.get(cls)
+        if pending is None:
+            methods = {name: pending_method(name) for name in PENDING_METHODS}
+            methods.update(__slots__=(), fixer=self, __getattr__=pending_getattr)
+            pending = type(f"Pending{cls.__name__}", (PendingFixups, cls), methods)
+            self.classes[cls] = pending
+        return pending
+
+
+class PendingFixups(Pending):
+    """
+    An element whose snippet fixups haven't been applied yet.
+    """
+
+    __slots__ = ()
+    fixer: LazyFixups
+
+
+# The methods which use an element. Each applies the pending fixups first.
+PENDING_METHODS = (
+    "__getitem__",
+    "get",
+    "__contains__",
+    "__iter__",
+    "__len__",
+    "keys",
+    "values",
+    "items",
+    "__setitem__",
+    "__delitem__",
+    "__setattr__",
+    "__delattr__",
+    "update",
+    "pop",
+    "popitem",
+    "setdefault",
+    "__eq__",
+    "__ne__",
+    "__bool__",
+    "__repr__",
+    "__str__",
+    "__reduce_ex__",
+)
+
+
+def pending_method(name: str) -> Callable:
+    def method(self, *args, **kwargs):
+        if not Pending.held:
+            self.fixer.fix(self)
+            return getattr(self, name)(*args, **kwargs)
+        return getattr(type(self).__bases__[-1], name)(self, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+def pending_getattr(self, key: str):
+    if key.startswith("__") and key.endswith("__"):
+        raise AttributeError(key)
+    if not Pending.held:
+        self.fixer.fix(self)
+        return getattr(self, key)
+    return type(self).__bases__[-1].__getattr__(self, key)
+
+
+#########################################################################
+# Auditing fixups.
+#
+# With "fixup_audit: <report.json>" in the document config, every fixup is
+#   timed, and the design is compared before and after each application to
+#   find the paths it changed. The report lists, for each Fixup.py or
+#   Fixup.yaml, the time spent, the number of elements it was applied to, and
+#   the paths written by each application. The slowest fixups are also
+#   summarized on stderr.
+#
+# The fixups are wrapped as they are loaded, and only when auditing, so an
+#   unaudited document runs exactly as before. Auditing is slow: each
+#   application copies the subtree it is applied to.
+#
+# With lazy fixups, the report only covers fixups applied during setup.
+#   Once it is written, the wrapped fixups stop copying and just run.
+#########################################################################
+
+TOP_FIXUPS = 10  # How many of the slowest fixups to list on stderr.
+
+# The audit of the current document, if it is being audited.
+audit: Optional["FixupAudit"] = None
+
+
+class FixupAudit:
+    """
+    The time spent by each fixup, and the paths it wrote.
+    """
+
+    def __init__(self, document: Element):
+        self.sources = {}  # source file --> dict(seconds, elements, writes)
+        self.paths = {id(document): "document"}  # id(element) --> design path
+        self._add_paths(document.design, "design")
+        self.active = True  # Until the report is written.
+
+    def function(self, fixup: Callable, source: str) -> Callable:
+        """
+        Wrap a Fixup(element, document) function.
+        """
+        return lambda element, document: self.run(
+            source, [element], lambda: fixup(element, document)
+        )
+
+    def batch(self, batch: Callable, source: str) -> Callable:
+        """
+        Wrap a FixupBatch(elements, document) function.
+        """
+        return lambda elements, document: self.run(
+            source, elements, lambda: batch(elements, document)
+        )
+
+    def run(self, source: str, elements: List[Element], fn: Callable):
+        """
+        Apply a fixup to some elements, noting its time and the paths it wrote.
+        """
+        # Once the report is written, fixups run without copying anything.
+        if not self.active:
+            return fn()
+
+        with Pending.hold():
+            before = [plain(element) for element in elements]
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+
+        entry = self.sources.setdefault(source, dict(seconds=0.0, elements=0, writes=[]))
+        entry["seconds"] += seconds
+        entry["elements"] += len(elements)
+        with Pending.hold():
+            for element, old in zip(elements, before):
+                top = self.paths.get(id(element)) or new_label(element)
+                changed = changed_paths(old, plain(element), top)
+                if changed:
+                    entry["writes"].append(changed)
+
+    def write(self, filename: str, top: int = TOP_FIXUPS):
+        """
+        Write out the report, and summarize the slowest fixups on stderr.
+        """
+        self.active = False
+        with open(filename, "w") as f:
+            json.dump(self.sources, f, indent=2)
+
+        slowest = sorted(self.sources.items(), key=lambda i: -i[1]["seconds"])[:top]
+        print(f"Slowest fixups (full report in {filename}):", file=sys.stderr)
+        for source, entry in slowest:
+            print(
+                f"  {entry['seconds']:8.3f}s  {entry['elements']:8} elements  "
+                f"{len(entry['writes']):8} changed  {source}",
+                file=sys.stderr,
+            )
+
+    def _add_paths(self, root: Any, path: str):
+        """
+        Remember the design path of each element.
+        """
+        stack = [(root, path)]
+        while stack:
+            obj, path = stack.pop()
+            if isinstance(obj, dict):
+                self.paths.setdefault(id(obj), path)
+                children = [(v, f"{path}.{k}") for k, v in obj.items()]
+            elif isinstance(obj, list):
+                children = [(v, f"{path}[{n}]") for n, v in enumerate(obj)]
+            else:
+                continue
+            stack.extend(reversed(children))
+
+
+class AuditedPlan:
+    """
+    A patch plan which reports to the audit.
+    """
+
+    __slots__ = ("audit", "plan", "source")
+
+    def __init__(self, audit: FixupAudit, plan: PatchPlan, source: str):
+        self.audit = audit
+        self.plan = plan
+        self.source = source
+
+    def apply(self, obj: Any, copy: bool = False):
+        self.audit.run(self.source, [obj], lambda: self.plan.apply(obj, copy))
+
+    def __bool__(self) -> bool:
+        return bool(self.plan)
+
+
+def new_label(element: Any) -> str:
+    """
+    How the audit names an element which wasn't in the design when the audit started.
+    """
+    # Not every dict has types, eg. a design replaced by a document fixup.
+    types = getattr(element, "_types", None)
+    return f"<new {types[0]}>" if types else "<new element>"
+
+
+def plain(obj: Any) -> Any:
+    """
+    A copy of an object tree as plain dicts and lists, to compare against later.
+    """
+    # Walk with a stack, so deep designs don't hit the recursion limit.
+    #   Each entry is a container of the copy, a key into it, and the object to copy there.
+    top = [None]
+    stack = [(top, 0, obj)]
+    while stack:
+        parent, key, obj = stack.pop()
+        if isinstance(obj, dict):
+            copy = dict.fromkeys(obj)  # Keep the key order.
+            stack.extend((copy, k, v) for k, v in obj.items())
+        elif isinstance(obj, list):
+            copy = [None] * len(obj)
+            stack.extend((copy, n, v) for n, v in enumerate(obj))
+        else:
+            copy = obj
+        parent[key] = copy
+    return top[0]
+
+
+# Marks a key or index which is on only one side of a comparison.
+_ABSENT = object()
+
+
+def changed_paths(old: Any, new: Any, path: str) -> List[str]:
+    """
+    The paths where two object trees differ. A new or removed subtree is one path.
+    """
+    # Walk with a stack, pushing children in reverse so paths are listed in order.
+    changed = []
+    stack = [(old, new, path)]
+    while stack:
+        old, new, path = stack.pop()
+        if old is _ABSENT or new is _ABSENT:
+            changed.append(path)
+        elif isinstance(old, dict) and isinstance(new, dict):
+            children = [
+                (old.get(key, _ABSENT), new.get(key, _ABSENT), f"{path}.{key}")
+                for key in {**old, **new}
+            ]
+            stack.extend(reversed(children))
+        elif isinstance(old, list) and isinstance(new, list):
+            children = [
+                (
+                    old[n] if n < len(old) else _ABSENT,
+                    new[n] if n < len(new) else _ABSENT,
+                    f"{path}[{n}]",
+                )
+                for n in range(max(len(old), len(new)))
+            ]
+            stack.extend(reversed(children))
+        elif type(old) is not type(new) or old != new:
+            changed.append(path)
+    return changed
+
+
+def component_files(dir: str) -> Dict[str, Set[str]]:
+    """
+    The files in each component directory of a snippet directory.
+    """
+    components = {}
+    with suppress(OSError):
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    with suppress(OSError):
+                        components[entry.name] = set(os.listdir(entry.path))
+    return components
+
+
 def find_section_directory(modulePath: str) -> str:
     """
     Here is the situation:
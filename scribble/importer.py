@@ -306,6 +306,18 @@ def LoadSourceFile(functionName: str, moduleName: str, filePath: str):
     :return: None if can't find it.
     """
 
+    # Load the module and look up the specified function.
+    module = LoadSourceModule(moduleName, filePath)
+    fn = getattr(module, functionName, None)
+    return fn
+
+
+def LoadSourceModule(moduleName: str, filePath: str):
+    """
+    Load a module with the given name from a file at a given location.
+    :return: None if can't find it.
+    """
+
     # If the file exists,
     if not _os.path.isfile(filePath):
         return None
@@ -316,7 +328,4 @@ def LoadSourceFile(functionName: str, moduleName: str, filePath: str):
 
     # Load the module
     spec.loader.exec_module(module)
-
-    # Look up the specified function.
-    fn = getattr(module, functionName, None)
-    return fn
+    return module
@@ -0,0 +1,634 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (
+    annotations,
+)  # flake8: noqa F821 - Allows access to class name from within.
+
+import sys
+from bisect import bisect_left, bisect_right
+from numbers import Number
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from intervaltree import IntervalTree
+
+from scribble.obj import Pending, compile_path, get_path, orderable
+from scribble.registry import TYPES
+
+
+#########################################################################
+# A frozen index of the design tree.
+#
+# Once setup() is finished, the design tree doesn't change, so we can
+#   index it once and answer queries without walking the tree.
+#
+# The elements are kept in a flat array in the same order subtrees() visits
+#   them (children before parents). The subtree of an element is then a
+#   contiguous slice of the array, ending with the element itself:
+#        elements[start[p] : p + 1]
+#   Anything indexed by position can be restricted to a subtree with bisect.
+#
+# Note the index is only valid while the tree is frozen. If the tree changes,
+#   build a new index.
+#########################################################################
+
+
+class DesignIndex:
+    """
+    An inverted index from type names to the elements of a design tree,
+    along with secondary indexes on the values found at paths.
+    """
+
+    elements: List[Any]  # Elements in subtrees() order.
+    start: List[int]  # Position of the first element in each element's subtree.
+    position: Dict[int, int]  # id(element) --> position
+    types: Dict[str, Tuple[int, ...]]  # type name --> positions, in document order
+    parent: List[int]  # Position of each element's parent element, or -1 at the top.
+    kids: Dict[int, List[int]]  # Positions of each element's child elements.
+    segments: List[str]  # Path from each element's parent element to the element.
+
+    secondary: Dict[Tuple[str, int, str], Any]  # Secondary indexes, built on demand.
+
+    hits: int  # Number of queries answered from the index.
+    scans: int  # Number of queries which had to scan the tree instead.
+
+    def __init__(self, root: Any, kind: type):
+        """
+        Index all the elements of the tree.
+        :param root: the top of the design tree.
+        :param kind: the class of the elements being indexed (eg. Element)
+        """
+        self.elements = []
+        self.start = []
+        self.position = {}
+        self.parent = []
+        self.segments = []
+        self.kids = {}
+        self.secondary = {}
+        self.hits = 0
+        self.scans = 0
+
+        # Indexing only looks at the shape of the tree, so it doesn't do any pending work.
+        with Pending.hold():
+
+            # Add every element of the tree to the flat array.
+            self._add(root, kind)
+
+            # Invert the types, keeping each list of positions in document order.
+            types = {}
+            for pos, element in enumerate(self.elements):
+                for typ in element._types or []:
+                    positions = types.setdefault(typ, [])
+                    if not positions or positions[-1] != pos:
+                        positions.append(pos)
+            self.types = {typ: tuple(positions) for typ, positions in types.items()}
+
+            # Give each element the mask of its types, if it has room for one.
+            self.kind = kind
+            self._set_masks()
+
+    def _set_masks(self):
+        if hasattr(self.kind, "_type_mask"):
+            for element in self.elements:
+                mask = TYPES.element_mask(element._types or ())
+                object.__setattr__(element, "_type_mask", mask)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Positions are keyed by id and type masks are numbered per process,
+        #   so they are rebuilt when the index is unpickled.
+        state = dict(self.__dict__)
+        del state["position"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.position = {id(e): pos for pos, e in enumerate(self.elements)}
+        self._set_masks()
+
+    def _add(self, root: Any, kind: type):
+        """
+        Add the elements of a tree, visiting children before parents like subtrees().
+          The tree is walked with an explicit stack, so deep trees don't recurse.
+        """
+        elements, start, position = self.elements, self.start, self.position
+        parent, segments = self.parent, self.segments
+
+        # Elements whose parent hasn't been added yet. (Parents come after their children)
+        orphans = []
+
+        # Each entry is (object, its keyed children, where its subtree starts,
+        #   path from the nearest enclosing element).
+        stack = [(root, keyed(root), 0, "")]
+        while stack:
+            obj, items, first, path = stack[-1]
+            for key, item in items:
+                if isinstance(item, (dict, list)):
+                    step = f"[{key}]" if isinstance(obj, list) else f".{key}"
+                    here = "" if isinstance(obj, kind) else path
+                    stack.append((item, keyed(item), len(elements), here + step))
+                    break
+            else:
+                # All the children are done. Add the object itself if it is an element.
+                stack.pop()
+                if not isinstance(obj, kind):
+                    continue
+                pos = len(elements)
+                position[id(obj)] = pos
+                elements.append(obj)
+                start.append(first)
+                parent.append(-1)
+                segments.append(path.lstrip("."))
+
+                # We are the parent of every orphan within our subtree.
+                kids = []
+                while orphans and orphans[-1] >= first:
+                    kids.append(orphans.pop())
+                    parent[kids[-1]] = pos
+                self.kids[pos] = kids[::-1]
+                orphans.append(pos)
+
+        # Whatever is left over is at the top of the tree.
+        self.kids[-1] = orphans
+
+    def __contains__(self, element: Any) -> bool:
+        return id(element) in self.position
+
+    def subtree(self, element: Any) -> Tuple[int, int]:
+        """
+        The range of positions [lo, hi) occupied by an element's subtree.
+        """
+        pos = self.position[id(element)]
+        return self.start[pos], pos + 1
+
+    def unchanged(self, element: Any) -> bool:
+        """
+        Does the element's subtree still hold the same elements, of the same types,
+          as when it was indexed?
+        """
+        lo, hi = self.subtree(element)
+        masks = hasattr(self.kind, "_type_mask")
+        pos = lo
+        with Pending.hold():
+            for e in elements_below(element, self.kind):
+                if pos == hi or e is not self.elements[pos]:
+                    return False
+                if masks and e._type_mask != TYPES.element_mask(e._types or ()):
+                    return False
+                pos += 1
+        return pos == hi
+
+    def parent_of(self, element: Any) -> Optional[Any]:
+        """
+        The nearest element enclosing the element, or None at the top of the tree.
+        """
+        pos = self.parent[self.position[id(element)]]
+        return self.elements[pos] if pos >= 0 else None
+
+    def ancestor_positions(self, element: Any) -> List[int]:
+        """
+        Positions of the elements enclosing the element, nearest first.
+        """
+        positions = []
+        pos = self.parent[self.position[id(element)]]
+        while pos >= 0:
+            positions.append(pos)
+            pos = self.parent[pos]
+        return positions
+
+    def sibling_positions(self, element: Any) -> List[int]:
+        """
+        Positions of the other elements which share the element's parent.
+        """
+        pos = self.position[id(element)]
+        return [kid for kid in self.kids[self.parent[pos]] if kid != pos]
+
+    def path_of(self, element: Any) -> str:
+        """
+        The path from the root of the tree to the element, eg. "design.cores[1]".
+        """
+        pos = self.position[id(element)]
+        segments = []
+        while pos >= 0:
+            segments.append(self.segments[pos])
+            pos = self.parent[pos]
+        return ".".join(s for s in reversed(segments) if s).replace(".[", "[")
+
+    def instances(self, element: Any, *types: str) -> List[Any]:
+        """
+        The elements of a subtree which are instances of any of the types, in document order.
+        """
+        lo, hi = self.subtree(element)
+        self.hits += 1
+        return [self.elements[pos] for pos in self.type_positions(lo, hi, *types)]
+
+    def type_positions(self, lo: int, hi: int, *types: str) -> Sequence[int]:
+        """
+        Positions in the range [lo, hi) of elements which are instances of any of the types.
+        """
+        # Slice out the positions for each type which fall within the range.
+        slices = [within(self.types.get(typ, ()), lo, hi) for typ in types]
+
+        # Merge the positions. An element can belong to several of the types.
+        if len(slices) == 1:
+            return slices[0]
+        return sorted(set().union(*slices))
+
+    def scope(self, element: Any) -> IndexScope:
+        return IndexScope(self, element)
+
+    def values(self, lo: int, hi: int, path: str) -> ValueIndex:
+        return self._secondary(ValueIndex, lo, hi, path)
+
+    def members(self, lo: int, hi: int, path: str) -> MemberIndex:
+        return self._secondary(MemberIndex, lo, hi, path)
+
+    def intervals(self, lo: int, hi: int, base: str, size: str) -> IntervalIndex:
+        return self._secondary(IntervalIndex, lo, hi, (base, size))
+
+    def _secondary(self, kind: type, lo: int, hi: int, path: Any):
+        """
+        Fetch a secondary index which covers the range [lo, hi), building it if needed.
+          Secondary indexes are built once per (subtree, path). We use an index of
+          the whole design if there is one, otherwise an index of the subtree itself.
+        """
+        top = len(self.elements) - 1
+        for root in (top, hi - 1):
+            secondary = self.secondary.get((kind.__name__, root, path))
+            if secondary is not None and secondary.lo <= lo:
+                return secondary
+
+        root = hi - 1
+        secondary = kind(self, self.start[root], hi, path)
+        self.secondary[(kind.__name__, root, path)] = secondary
+        return secondary
+
+
+class IndexScope:
+    """
+    The subtree of one element, as seen through the index.
+       This is the "access" object the query planner pushes predicates down to.
+    """
+
+    ordering = None  # Positions come out in document order, not sorted by a path.
+
+    def __init__(self, index: DesignIndex, element: Any):
+        self.index = index
+        self.lo, self.hi = index.subtree(element)
+
+    def lookup(self, step) -> Optional[Sequence[int]]:
+        """
+        The positions of the elements which satisfy a query step, or None if not indexed.
+        """
+        lo, hi = self.lo, self.hi
+        op, args = step.op, step.args
+        if op == "is_instance":
+            return self.index.type_positions(lo, hi, *args)
+        elif op == "has_key_value":
+            return self.index.values(lo, hi, args[0]).equal(lo, hi, args[1])
+        elif op == "contains_key":
+            return self.index.values(lo, hi, args[0]).present(lo, hi)
+        elif op == "hasnt_key_value":
+            return self.index.values(lo, hi, args[0]).not_equal(lo, hi, *args[1:])
+        elif op == "value_contains":
+            return self.index.members(lo, hi, args[0]).containing(lo, hi, args[1])
+        elif op == "ancestors_of" and args[0] in self.index:
+            return within(self.index.ancestor_positions(args[0]), lo, hi)
+        elif op == "siblings" and args[0] in self.index:
+            return within(self.index.sibling_positions(args[0]), lo, hi)
+        elif op == "overlapping":
+            intervals = self.index.intervals(lo, hi, *args[2:])
+            return intervals.overlapping(lo, hi, *args[:2])
+        elif op == "containing":
+            return self.index.intervals(lo, hi, *args[1:]).containing(lo, hi, args[0])
+        return None
+
+    def all(self) -> Sequence[int]:
+        return range(self.lo, self.hi)
+
+    def elements(self, positions: Sequence[int]) -> List[Any]:
+        self.index.hits += 1
+        elements = self.index.elements
+        if isinstance(positions, range):
+            return elements[positions.start : positions.stop]
+        return [elements[pos] for pos in positions]
+
+
+class ValueIndex:
+    """
+    A hash index from the value found at a path to the positions of the elements
+    holding that value. Answers has_key_value, hasnt_key_value and contains_key.
+    """
+
+    def __init__(self, index: DesignIndex, lo: int, hi: int, path: str):
+        self.index = index
+        self.path = path
+        self.lo, self.hi = lo, hi
+        self.positions = {}  # value --> positions
+        self.unhashable = []  # positions of values which have to be compared one by one
+        self.none = []  # positions where the value is missing
+
+        get = compile_path(path).get
+        for pos in range(lo, hi):
+            value = get(index.elements[pos])
+            if value is None:
+                self.none.append(pos)
+            try:
+                self.positions.setdefault(value, []).append(pos)
+            except TypeError:
+                self.unhashable.append(pos)
+
+    def equal(self, lo: int, hi: int, value: Any) -> Optional[Sequence[int]]:
+        """
+        Positions in [lo, hi) whose value equals the given value, or None if it can't be hashed.
+        """
+        try:
+            positions = within(self.positions.get(value, ()), lo, hi)
+        except TypeError:
+            return None
+
+        # Values we couldn't hash might still compare equal.
+        elements, get = self.index.elements, compile_path(self.path).get
+        others = [
+            pos for pos in within(self.unhashable, lo, hi) if get(elements[pos]) == value
+        ]
+        return sorted([*positions, *others]) if others else positions
+
+    def not_equal(self, lo: int, hi: int, *values: Any) -> Optional[Sequence[int]]:
+        """
+        Positions in [lo, hi) whose value is none of the given values.
+        """
+        excluded = set()
+        for value in values:
+            positions = self.equal(lo, hi, value)
+            if positions is None:
+                return None
+            excluded.update(positions)
+        return [pos for pos in range(lo, hi) if pos not in excluded]
+
+    def present(self, lo: int, hi: int) -> Sequence[int]:
+        """
+        Positions in [lo, hi) where the path has a value.
+        """
+        missing = set(within(self.none, lo, hi))
+        return [pos for pos in range(lo, hi) if pos not in missing]
+
+
+class MemberIndex:
+    """
+    An index from the items of the container found at a path to the positions
+    of the elements holding that container. Answers value_contains.
+       Hashable items are found by equality, other items (eg. elements) by identity.
+    """
+
+    def __init__(self, index: DesignIndex, lo: int, hi: int, path: str):
+        self.index = index
+        self.path = path
+        self.lo, self.hi = lo, hi
+        self.positions = {}  # item --> positions
+        self.identities = {}  # id(item) --> positions
+        self.others = []  # positions of containers which have to be checked one by one
+
+        get = compile_path(path).get
+        for pos in range(lo, hi):
+            container = get(index.elements[pos])
+            if not container:
+                continue
+            elif isinstance(container, (list, tuple, dict)):
+                for item in container:
+                    try:
+                        positions = self.positions.setdefault(item, [])
+                    except TypeError:
+                        positions = self.identities.setdefault(id(item), [])
+                    if not positions or positions[-1] != pos:
+                        positions.append(pos)
+            else:
+                self.others.append(pos)
+
+    def containing(self, lo: int, hi: int, value: Any) -> Sequence[int]:
+        """
+        Positions in [lo, hi) whose container holds the value.
+        """
+        try:
+            positions = self.positions.get(value, ())
+        except TypeError:
+            positions = self.identities.get(id(value), ())
+        positions = within(positions, lo, hi)
+
+        # Odd containers (eg. strings) have to be checked one by one.
+        elements, get = self.index.elements, compile_path(self.path).get
+        others = [
+            pos
+            for pos in within(self.others, lo, hi)
+            if contains(get(elements[pos]), value)
+        ]
+        return sorted([*positions, *others]) if others else positions
+
+
+class IntervalIndex:
+    """
+    An interval tree over the address ranges of elements, where each element
+    covers [base, base+size). Answers overlapping and containing.
+       Elements without a numeric base and a positive size cover nothing.
+    """
+
+    def __init__(self, index: DesignIndex, lo: int, hi: int, paths: Tuple[str, str]):
+        self.index = index
+        self.lo, self.hi = lo, hi
+        self.tree = IntervalTree()
+
+        base_path, size_path = paths
+        for pos in range(lo, hi):
+            element = index.elements[pos]
+            interval = address_range(element, base_path, size_path)
+            if interval is not None:
+                self.tree.addi(*interval, pos)
+
+    def overlapping(self, lo: int, hi: int, begin: int, end: int) -> List[int]:
+        """
+        Positions in [lo, hi) whose range overlaps the region [begin, end).
+        """
+        if not begin < end:
+            return []
+        return self._positions(lo, hi, self.tree[begin:end])
+
+    def containing(self, lo: int, hi: int, address: int) -> List[int]:
+        """
+        Positions in [lo, hi) whose range contains the address.
+        """
+        return self._positions(lo, hi, self.tree[address])
+
+    @staticmethod
+    def _positions(lo: int, hi: int, intervals) -> List[int]:
+        return sorted(i.data for i in intervals if lo <= i.data < hi)
+
+
+def address_range(element: Any, base: str, size: str) -> Optional[Tuple[int, int]]:
+    """
+    The range [begin, end) covered by an element, or None if it doesn't have one.
+    """
+    begin, length = get_path(element, base), get_path(element, size)
+    if not isinstance(begin, Number) or not isinstance(length, Number):
+        return None
+    if not length > 0:
+        return None
+    return begin, begin + length
+
+
+class OrderedIndex:
+    """
+    The results of a query, sorted by the numeric value found at a path.
+       Answers sorted_by, between, top_k, min_by and max_by with bisect,
+       so the results are sorted once rather than once per query.
+    """
+
+    def __init__(self, elements: Sequence[Any], path: str):
+        """
+        :param elements: the query results, in their original order.
+        :param path: where to find the numeric value in each element.
+        """
+        self.path = path
+        self.source = elements
+
+        # Sort the numeric values, keeping equal values in their original order.
+        #   Anything else (missing values, strings, NaN) is left out of the index.
+        entries, get = [], compile_path(path).get
+        for n, element in enumerate(elements):
+            value = get(element)
+            if orderable(value):
+                entries.append((value, n))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.keys = [value for value, _ in entries]
+        self.ordinals = [n for _, n in entries]  # original position of each entry
+        self.elements = [elements[n] for n in self.ordinals]
+        self.descending = None  # Built the first time it is needed.
+
+        # If every value is numeric, the index holds the complete sorted results.
+        self.complete = len(entries) == len(elements)
+
+    def run(self, step) -> Sequence[Any]:
+        """
+        The results of an ordered query step (sorted_by, between, top_k) on our path.
+        """
+        op, args = step.op, step.args
+        if op == "between":
+            return self.between(*args[1:])
+        elif op == "top_k":
+            return self.top_k(*args[1:])
+        elif op == "sorted_by" and self.complete:
+            return self.sorted(args[1])
+        else:
+            return list(step.run(self.source))
+
+    def sorted(self, reverse: bool = False) -> Sequence[Any]:
+        """
+        The elements in the same order as sorted_by(path, reverse).
+        """
+        if not reverse:
+            return self.elements
+        if self.descending is None:
+            self.descending = self.largest(len(self.keys))
+        return self.descending
+
+    def between(self, lo: Any, hi: Any) -> List[Any]:
+        """
+        Elements whose value is in the range lo..hi (inclusive), in their original order.
+        """
+        first, last = bisect_left(self.keys, lo), bisect_right(self.keys, hi)
+        return [self.source[n] for n in sorted(self.ordinals[first:last])]
+
+    def top_k(self, k: int, reverse: bool = False) -> Sequence[Any]:
+        """
+        The k elements with the smallest values (largest if reverse), in sorted order.
+        """
+        k = max(k, 0)
+        return self.largest(k) if reverse else self.elements[:k]
+
+    def largest(self, k: int) -> List[Any]:
+        """
+        The k elements with the largest values. Elements with equal values
+          keep their original order, the same as a stable reverse sort.
+        """
+        keys, result, hi = self.keys, [], len(self.keys)
+        while hi > 0 and len(result) < k:
+            lo = bisect_left(keys, keys[hi - 1], 0, hi)
+            result.extend(self.elements[lo:hi])
+            hi = lo
+        return result[:k]
+
+    def min(self) -> Optional[Any]:
+        return self.elements[0] if self.elements else None
+
+    def max(self) -> Optional[Any]:
+        if not self.elements:
+            return None
+        return self.elements[bisect_left(self.keys, self.keys[-1])]
+
+    def __sizeof__(self) -> int:
+        # The elements belong to the design. Count only our own lists.
+        lists = (self.keys, self.ordinals, self.elements, self.descending or [])
+        return object.__sizeof__(self) + sum(map(sys.getsizeof, lists))
+
+
+def elements_below(root: Any, kind: type) -> Iterator[Any]:
+    """
+    The elements of a tree, children before parents, in the order they are indexed.
+    """
+    stack = [(root, keyed(root))]
+    while stack:
+        obj, items = stack[-1]
+        for _, item in items:
+            if isinstance(item, (dict, list)):
+                stack.append((item, keyed(item)))
+                break
+        else:
+            stack.pop()
+            if isinstance(obj, kind):
+                yield obj
+
+
+def keyed(obj: Any) -> Iterator[Tuple[Any, Any]]:
+    """
+    An iterator over the (key, child) pairs of a dict or list.
+    """
+    if isinstance(obj, dict):
+        return iter(obj.items())
+    elif isinstance(obj, list):
+        return enumerate(obj)
+    else:
+        return iter(())
+
+
+def contains(container: Any, value: Any) -> bool:
+    """
+    Does the container hold the value?
+      Hashable values are compared by equality, others (like elements) by identity.
+    """
+    if not container:
+        return False
+    try:
+        hash(value)
+    except TypeError:
+        return isinstance(container, (list, tuple)) and any(
+            item is value for item in container
+        )
+    return value in container
+
+
+def within(positions: Sequence[int], lo: int, hi: int) -> Sequence[int]:
+    """
+    The slice of a sorted list of positions which falls in the range [lo, hi).
+    """
+    return positions[bisect_left(positions, lo) : bisect_left(positions, hi)]
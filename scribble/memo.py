@@ -0,0 +1,151 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple
+
+#########################################################################
+# A bounded memo for query results.
+#
+# Entries are evicted in least recently used order whenever the memo
+#   grows past its entry budget or its byte budget.
+#
+# Query results are keyed on the element they were started from.
+#   Python ids can be reused once an object is garbage collected, so each
+#   entry holds a reference to its element. As long as the entry exists, the
+#   element can't be collected and its id can't be handed to another object.
+#########################################################################
+
+DEFAULT_ENTRIES = 4096
+DEFAULT_BYTES = 64 * 1024 * 1024
+
+
+class MemoStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+
+
+class QueryMemo:
+    """
+    A least recently used memo with an entry budget and a byte budget.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        max_entries: int = DEFAULT_ENTRIES,
+        max_bytes: int = DEFAULT_BYTES,
+    ):
+        """
+        :param name: a label for the memo, usually the document it serves.
+        :param max_entries: the maximum number of results to remember.
+        :param max_bytes: the maximum (approximate) size of the remembered results.
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key --> (owner, value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, owner: Any, default: Any = None) -> Any:
+        """
+        Fetch a remembered value, marking it as recently used.
+        :param owner: the object the key was derived from. It must be the same object.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] is not owner:
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, key: Hashable, owner: Any, default: Any = None) -> Any:
+        """
+        Fetch a remembered value without counting it or marking it as used.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] is not owner:
+            return default
+        return entry[1]
+
+    def put(self, key: Hashable, owner: Any, value: Any) -> Any:
+        """
+        Remember a value, evicting older values to stay within budget.
+        :param owner: an object kept alive for as long as the value is remembered.
+        :return: the value
+        """
+        # Replace any previous value.
+        self.discard(key)
+
+        # Don't remember values which would blow the entire budget by themselves.
+        size = sizeof(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return value
+
+        # Save the value as the most recently used.
+        self.entries[key] = (owner, value, size)
+        self.bytes += size
+
+        # Evict the least recently used values until we are within budget.
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, _, old) = self.entries.popitem(last=False)
+            self.bytes -= old
+            self.evictions += 1
+
+        return value
+
+    def discard(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    @property
+    def stats(self) -> MemoStats:
+        return MemoStats(
+            self.hits, self.misses, self.evictions, len(self.entries), self.bytes
+        )
+
+
+def sizeof(value: Any) -> int:
+    """
+    The approximate number of bytes held by a memoized value.
+      Query results are lists of references to elements which are owned by the design,
+      so we count the containers, not the elements.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(
+            sys.getsizeof(item) for item in value if isinstance(item, (list, tuple))
+        )
+    return size
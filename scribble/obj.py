@@ -15,29 +15,74 @@
 
 from __future__ import annotations
 
+import heapq
 import re
 from collections import OrderedDict
-from typing import Any, Iterator, List, Iterable, TypeVar
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import lru_cache
+from numbers import Number
+from typing import Any, Iterator, List, Iterable, Optional, TypeVar
 
 T = TypeVar("T")
 
 
+#########################################################################
+# Traversals of the object tree.
+#
+# Design trees can be deep, and a recursive generator pays for every level of
+#   "yield from" on every item it produces. Instead, the traversals keep an
+#   explicit stack of iterators, one per open dict or list.
+#########################################################################
+
+
 def subtrees(obj: Any) -> Iterator[Any]:
     """
     Scan through all elements of an object structure, yielding a sequence of subtrees.
+       Children come before their parents.
     :param obj: object to be scanned
     :return: iteration of subobjects
     """
+    stack = [(obj, children(obj))]
+    while stack:
+        node, items = stack[-1]
+        for item in items:
+            if isinstance(item, (dict, list)):
+                stack.append((item, children(item)))
+                break
+            yield item
+        else:
+            stack.pop()
+            yield node
+
+
+def subdicts(obj: Any) -> Iterator[dict]:
+    """
+    Like subtrees(), but only yields the dictionaries, skipping lists and leaf values.
+    """
+    stack = [(obj, children(obj))]
+    while stack:
+        node, items = stack[-1]
+        for item in items:
+            if isinstance(item, (dict, list)):
+                stack.append((item, children(item)))
+                break
+        else:
+            stack.pop()
+            if isinstance(node, dict):
+                yield node
+
+
+def children(obj: Any) -> Iterator[Any]:
+    """
+    An iterator over the children of a dict or list. Other values have no children.
+    """
     if isinstance(obj, dict):
-        for k, v in obj.items():
-            yield from subtrees(v)
+        return iter(obj.values())
     elif isinstance(obj, list):
-        for v in obj:
-            yield from subtrees(v)
+        return iter(obj)
     else:
-        pass
-
-    yield obj
+        return iter(())
 
 
 def scan(obj: Any, fn):
@@ -45,17 +90,78 @@ def scan(obj: Any, fn):
     Pre-order scan all subobjects of an object, invoking a function at each subobject.
     Unlike subtrees() above, the object can be mutated as it is scanned.
     """
-    if isinstance(obj, dict):
-        fn(obj)
-        for k, v in obj.items():
-            scan(v, fn)
+    stack = [iter((obj,))]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, dict):
+                fn(item)
+                stack.append(iter(item.values()))
+                break
+            elif isinstance(item, list):
+                stack.append(iter(item))
+                break
+        else:
+            stack.pop()
 
-    elif isinstance(obj, list):
-        for v in obj:
-            scan(v, fn)
 
-    else:
-        pass
+#########################################################################
+# Deferred values.
+#
+# A big design doesn't have to be in memory all at once. Parts of it can
+#   stay where they are, say in a memory mapped file, until they are used.
+#########################################################################
+
+
+class Deferred:
+    """
+    A dict or list which hasn't been read yet, such as a node of a binary design file.
+      Lazy object dictionaries read it when it is first used. (See objdict.LazyObjdict)
+    """
+
+    __slots__ = ()
+
+    def materialize(self) -> Any:
+        """
+        Read the value as a plain dict or list. Its own nested values may still be deferred.
+        """
+        raise NotImplementedError
+
+
+class Unavailable:
+    """
+    A value which is known to exist, but can't be used. For example, a part of the
+      design which was left out when the design was read. Paths through it fail.
+    """
+
+    __slots__ = ()
+
+    def fail(self, path: str):
+        """
+        Raise an exception explaining why the value at the path can't be used.
+        """
+        raise NotImplementedError
+
+
+class Pending:
+    """
+    An object dictionary with work left to do before it is used, such as lazy fixups.
+      Using it does the work first. (See fixup.LazyFixups)
+    """
+
+    __slots__ = ()
+
+    # While held, pending objects are used as they are, without doing their work.
+    #   For code which only looks at the shape of the tree, like the design index.
+    held = 0
+
+    @classmethod
+    @contextmanager
+    def hold(cls):
+        cls.held += 1
+        try:
+            yield
+        finally:
+            cls.held -= 1
 
 
 def get_path(obj: dict, key: str) -> Any:
@@ -64,19 +170,7 @@ def get_path(obj: dict, key: str) -> Any:
         Allows shortcut:   getPath(obj, "a.b.c")   -->   obj["a"]["b"["c"]
         but returns None if the intermediate values are not defined.
     """
-    # Split the path into pieces
-    path = split_path(key)
-
-    # Scan down the path, one piece at a time, stopping if None (not defined)
-    val = obj
-    for p in path:
-        if isinstance(val, list) and 0 <= int(p) < len(val):
-            val = val[int(p)]
-        elif isinstance(val, dict) and p in val:
-            val = val[p]
-        else:
-            return None
-    return val
+    return compile_path(key).get(obj)
 
 
 def set_path(obj: dict, key: str, value: Any):
@@ -85,35 +179,97 @@ def set_path(obj: dict, key: str, value: Any):
         Allows shortcut:   setPath(obj, "a.b.c", value)   -->   obj["a"]["b"["c"] = value
         but it creates intermediate nodes if they don't already exist.
     """
-    # Split the path into pieces
-    path = split_path(key)
-    last = path.pop()
-
-    # Scan down the path, one piece at a timem, creating empty maps as needed.
-    #  Assumes intermediate objects are lists or dicts.
-    val = obj
-    for p in path:
-        # Case: Index into existing list
-        if isinstance(val, list):  # Index into existing list.
-            val = val[int(p)]
-        # Case: Follow existing key.
-        elif p in val:
-            val = val[p]
-        # Case: Create new empty list.
-        elif p == "0" or p == "+" or p == "++":
-            val = []
-        # Case: Create new dictionary with entry.
-        else:
-            val[p] = type(val)()
-            val = val[p]
+    compile_path(key).set(obj, value)
+
+
+#########################################################################
+# Compiled paths.
+#
+# Paths are used over and over, often thousands of times each, as keys for
+#   sorting, grouping and filtering. Rather than splitting the path and
+#   parsing its list indices on every lookup, each path is compiled once
+#   into an accessor holding the pieces, with list indices already parsed.
+#########################################################################
+
 
-    # save the value in the final position.
+class PathAccessor:
+    """
+    A compiled path, which fetches or sets the value at the path.
+    """
+
+    __slots__ = ("path", "steps")
 
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = tuple((p, list_index(p)) for p in split_path(path))
+
+    def get(self, obj: Any) -> Any:
+        """
+        Fetch the value at the path, or None if any of the intermediate values are not defined.
+        """
+        # Scan down the path, one piece at a time, stopping if None (not defined)
+        val = obj
+        for p, index in self.steps:
+            if isinstance(val, dict):
+                if p not in val:
+                    return None
+                val = val[p]
+            elif isinstance(val, list):
+                if index is None:
+                    raise ValueError(f"'{p}' in path '{self.path}' is not a list index")
+                if not 0 <= index < len(val):
+                    return None
+                val = val[index]
+            elif isinstance(val, Unavailable):
+                val.fail(self.path)
+            else:
+                return None
+        return val
+
+    def set(self, obj: Any, value: Any):
+        """
+        Set the value at the path, creating intermediate nodes if they don't already exist.
+        """
+        *path, (last, last_index) = self.steps
+
+        # Scan down the path, one piece at a time, creating empty maps as needed.
+        val = obj
+        for p, index in path:
+            val = step_into(val, p, index)
+
+        # save the value in the final position.
+        set_last(val, last, last_index, value)
+
+
+def step_into(val: Any, p: str, index: Optional[int]) -> Any:
+    """
+    Take one step down a path being set, creating an empty map if needed.
+      Assumes intermediate objects are lists or dicts.
+    """
+    # Case: Index into existing list
+    if isinstance(val, list):  # Index into existing list.
+        return val[int(p) if index is None else index]
+    # Case: Follow existing key.
+    elif p in val:
+        return val[p]
+    # Case: Create new empty list.
+    elif p == "0" or p == "+" or p == "++":
+        return []
+    # Case: Create new dictionary with entry.
+    else:
+        val[p] = type(val)()
+        return val[p]
+
+
+def set_last(val: Any, last: str, last_index: Optional[int], value: Any):
+    """
+    Save a value at the last piece of a path.
+    """
     # CASE List:
     if isinstance(val, list):
         # CASE: "++",  append new list to existing list.
         if last == "++":
-            val = val.extend(value)
+            val.extend(value)
 
         # CASE: end of list or "+", add new value to end of list
         elif last == "+" or int(last) == len(val):
@@ -121,13 +277,108 @@ def set_path(obj: dict, key: str, value: Any):
 
         # OTHERWISE, insert new value into array. (throw exception if out of bounds)
         else:
-            val[int(last)] = value
+            val[last_index] = value
 
     # Case: Map:  Save the new value.
     else:
         val[last] = value
 
 
+@lru_cache(maxsize=4096)
+def compile_path(path: str) -> PathAccessor:
+    """
+    Compile a dot separated path into an accessor, remembering the most recently used paths.
+    """
+    return PathAccessor(path)
+
+
+#########################################################################
+# Compiled patches.
+#
+# A set of patches {path: value} is usually applied to many elements, such as
+#   the Fixup.yaml of a snippet. Rather than walking down from the element
+#   for each path, the paths are compiled once into a tree of steps, and
+#   paths with a common beginning share the walk down to where they part.
+#
+# The patches must have the same effect as setting each path in turn.
+#   Each step of the tree holds its operations in patch order. A path only
+#   joins an earlier walk down the same piece if nothing in between could
+#   change what that piece refers to: no operation on the same key, and no
+#   list operation when the piece could be a list index.
+#########################################################################
+
+SET, DESCEND = "set", "descend"
+
+
+class PatchPlan:
+    """
+    Patches compiled into a tree of steps, which are applied in one walk of an object.
+    """
+
+    __slots__ = ("ops",)
+
+    def __init__(self, patches: dict):
+        """
+        :param patches: {path: value} where each path is dot separated, as in set_path().
+        """
+        self.ops = []  # (SET, piece, index, value) or (DESCEND, piece, index, ops)
+        for path, value in patches.items():
+            steps = compile_path(path).steps
+            if not steps:
+                raise ValueError(f"Patch has an empty path: {path!r}")
+            add_patch(self.ops, steps, value)
+
+    def apply(self, obj: Any, copy: bool = False):
+        """
+        Apply the patches to an object.
+        :param copy: patch in copies of dict and list values, so the plan can be applied again.
+        """
+        apply_ops(self.ops, obj, copy)
+
+    def __bool__(self) -> bool:
+        return bool(self.ops)
+
+
+def add_patch(ops: List[tuple], steps: tuple, value: Any):
+    (p, index), *rest = steps
+    if not rest:
+        ops.append((SET, p, index, value))
+        return
+
+    # Join the latest walk down the same piece, unless something since could interfere.
+    listy = index is not None or p in ("+", "++")
+    for op in reversed(ops):
+        if op[1] == p or (listy and (op[2] is not None or op[1] in ("+", "++"))):
+            if op[0] == DESCEND and op[1] == p:
+                add_patch(op[3], rest, value)
+                return
+            break
+
+    child = []
+    ops.append((DESCEND, p, index, child))
+    add_patch(child, rest, value)
+
+
+def apply_ops(ops: List[tuple], val: Any, copy: bool):
+    for kind, p, index, arg in ops:
+        if kind == DESCEND:
+            apply_ops(arg, step_into(val, p, index), copy)
+        else:
+            if copy and isinstance(arg, (dict, list)):
+                arg = deepcopy(arg)
+            set_last(val, p, index, arg)
+
+
+def list_index(piece: str) -> Optional[int]:
+    """
+    The list index represented by a piece of a path, or None if it isn't a number.
+    """
+    try:
+        return int(piece)
+    except ValueError:
+        return None
+
+
 def split_path(path: str) -> List[str]:
     pieces = re.findall(splitter, path)
     return pieces
@@ -146,7 +397,7 @@ def grouped_by(seq: Iterable[T], path: str) -> Iterable[List[T]]:
     """
     Groups items by the given key (actually path to key).
     """
-    return grouped(seq, key=lambda item: get_path(item, path))
+    return grouped(seq, key=compile_path(path).get)
 
 
 def grouped(seq: Iterable[T], *, key) -> Iterable[List[T]]:
@@ -176,19 +427,60 @@ def sorted_by(seq: Iterable[T], path: str, reverse=False) -> Iterable[T]:
     Returns a list of objects sorted by the given key (path to key)
     """
 
-    def key(obj):
-        return get_path(obj, path)
-
     seq = list(seq)
 
-    return sorted(seq, key=key, reverse=reverse)
+    return sorted(seq, key=compile_path(path).get, reverse=reverse)
+
+
+def orderable(value: Any) -> bool:
+    """
+    Is the value a number which can be ordered? (NaN can't, like in index.OrderedIndex)
+    """
+    return isinstance(value, Number) and value == value
+
+
+def between(seq: Iterable[T], path: str, lo, hi) -> Iterable[T]:
+    """
+    Keep the objects whose numeric value at the path is in the range lo..hi (inclusive).
+    """
+    get = compile_path(path).get
+    for obj in seq:
+        value = get(obj)
+        if orderable(value) and lo <= value <= hi:
+            yield obj
+
+
+def top_k(seq: Iterable[T], path: str, k: int, reverse=False) -> List[T]:
+    """
+    The k objects with the smallest numeric values at the path (largest if reverse),
+      in the same order sorted_by() would produce. NaN values are left out.
+    """
+    key = compile_path(path).get
+    numeric = [obj for obj in seq if orderable(key(obj))]
+    return heapq.nlargest(k, numeric, key) if reverse else heapq.nsmallest(k, numeric, key)
+
+
+def min_by(seq: Iterable[T], path: str) -> Optional[T]:
+    """
+    The first object with the smallest numeric value at the path, or None if there are none.
+    """
+    found = top_k(seq, path, 1)
+    return found[0] if found else None
+
+
+def max_by(seq: Iterable[T], path: str) -> Optional[T]:
+    """
+    The first object with the largest numeric value at the path, or None if there are none.
+    """
+    found = top_k(seq, path, 1, reverse=True)
+    return found[0] if found else None
 
 
 def remove_duplicates(seq: Iterable[T], path: str) -> Iterable[T]:
     """
     Keep the first of each object which matches the key.
     """
-    return remove_dups(seq, key=lambda e: e.get_path(path))
+    return remove_dups(seq, key=compile_path(path).get)
 
 
 def remove_dups(seq: Iterable[T], *, key):
@@ -18,15 +18,49 @@ from __future__ import (
 )  # flake8: noqa F821 - Allows access to class name from within.
 
 from datetime import date
+from functools import lru_cache
 from numbers import Number
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import scribble.config_file as config
+from scribble.binary_design import is_binary
+from scribble.projection import include_tree, project
 from scribble.exceptions import DocumentException
-from scribble.obj import subtrees, set_path, get_path
+from scribble.obj import Deferred, subtrees, set_path, get_path
 
 MISSING = ""  # For debugging - save name of missing key
 
 
+# String sharing: while reading, identical keys and short strings are stored once.
+#   It only dedupes strings. Each object is still a full dict with its own keys,
+#   so it trims the strings left in memory, not the dicts, and barely moves peak RSS.
+#
+# Strings up to this long are shared. Longer ones (descriptions) are rarely
+#   repeated, so they aren't worth remembering.
+SHARE_LIMIT = 40
+
+
+def share(s: str, strings: Dict[str, str]) -> str:
+    """
+    Return the first copy we saw of a short string, so identical strings are stored once.
+    """
+    if not isinstance(s, str) or len(s) > SHARE_LIMIT:
+        return s
+    return strings.setdefault(s, s)
+
+
+def shared(value: any, strings: Dict[str, str]) -> any:
+    """
+    A value just parsed, with its strings (and any strings in its lists) shared.
+      Dictionaries have already been through the parser's hook.
+    """
+    if isinstance(value, str):
+        return share(value, strings)
+    if isinstance(value, list):
+        value[:] = [shared(item, strings) for item in value]
+    return value
+
+
 def keepers(d: dict) -> dict:
     """
     filters out the "None" values from a dictionary
@@ -44,15 +78,27 @@ class SimpleObjdict(dict):
 
     """
 
+    # No per-instance __dict__. Attributes are stored as dictionary items.
+    __slots__ = ()
+
     ##########################################################
     # Wrapper functions which implement a shallow dictionary
     ##########################################################
 
     def __init__(self, old: dict = {}, **kwargs: dict):
-        obj = {**{k: v for k, v in old.items() if k not in kwargs}, **kwargs}
-        super().__init__(keepers(obj))
+        # Copy the old values which aren't being replaced, then the new ones, dropping "None"s.
+        super().__init__()
+        for k, v in old.items():
+            if v is not None and k not in kwargs:
+                self[k] = v
+        for k, v in kwargs.items():
+            if v is not None:
+                self[k] = v
 
     def __getattr__(self, key: str) -> any:
+        # Python's own hooks (pickle, copy, ...) are never items.
+        if key.startswith("__") and key.endswith("__"):
+            raise AttributeError(key)
         return self[key]
 
     def __setattr__(self, key: str, value: any):
@@ -73,6 +119,10 @@ class SimpleObjdict(dict):
     def __bool__(self):
         return self != {}
 
+    def __getstate__(self):
+        # Only the items are pickled. (Element's type mask only makes sense in one process)
+        return None
+
     def update(self, other={}, **kwargs):
         """
         Does the real work of setting values.
@@ -108,39 +158,124 @@ class Objdict(SimpleObjdict):
     TODO: ensure the "missing node" throws an exception when converted to string.
     """
 
+    __slots__ = ()
+
     @classmethod
-    def from_obj(cls, obj: any) -> Objdict:
+    def from_obj(cls, obj: any, share_strings: bool = False) -> Objdict:
         """
         Recursively convert an object to object dictionaries, even if embedded in lists.
           Used primarily for accessing configurations, so it doesn't need to convert class objects.
+        :param share_strings: share a single copy of identical keys and short strings.
         """
-        # CASE: list. Convert each item in the list.
-        if isinstance(obj, list):
-            value = [cls.from_obj(item) for item in obj]
-
-        # CASE: dictionary. Convert each item in the dictionary.
-        elif isinstance(obj, dict):
-            d = {k: cls.from_obj(v) for k, v in obj.items()}
-            value = cls(**d)
-
-        # CASE: basic number or string. Use the item "as is"
-        elif (
-            isinstance(obj, str)
-            or isinstance(obj, Number)
-            or isinstance(obj, date)
-            or obj is None
-        ):
-            value = obj
+        return cls._from_obj(obj, {} if share_strings else None)
 
-        # CASE: object with an internal dictionary. Treat like a dictionary.
-        elif hasattr(obj, "__dict__"):
-            value = cls.from_obj(obj.__dict__)
+    @classmethod
+    def _from_obj(cls, obj: any, strings: Optional[Dict[str, str]]) -> Objdict:
+        """
+        Does the real work of from_obj().
+          The object is walked with an explicit stack, so very deep objects don't recurse.
+        :param strings: the strings seen so far when sharing strings, otherwise None.
+        """
+        # Each entry is (keys of a dictionary or None for a list, items still to convert,
+        #    items converted so far). We start with a list holding the object.
+        top = []
+        stack = [(None, iter((obj,)), top)]
+        while stack:
+            keys, items, converted = stack[-1]
+            for item in items:
+
+                # CASE: list. Convert each item in the list.
+                if isinstance(item, list):
+                    stack.append((None, iter(item), []))
+                    break
+
+                # CASE: dictionary. Convert each item in the dictionary.
+                elif isinstance(item, dict):
+                    stack.append((list(item), iter(item.values()), []))
+                    break
+
+                # CASE: string. Use it "as is", or share it with identical strings.
+                elif isinstance(item, str):
+                    converted.append(item if strings is None else share(item, strings))
+
+                # CASE: basic number. Use the item "as is"
+                elif isinstance(item, Number) or isinstance(item, date) or item is None:
+                    converted.append(item)
+
+                # CASE: object with an internal dictionary. Treat like a dictionary.
+                elif hasattr(item, "__dict__"):
+                    attrs = item.__dict__
+                    stack.append((list(attrs), iter(attrs.values()), []))
+                    break
+
+                # OTHERWISE: we need to figure it out.
+                else:
+                    raise DocumentException(
+                        f"Objdict.from_dict: can't convert value {item}"
+                    )
+
+            # All the items are converted. Build the list or dictionary holding them.
+            else:
+                stack.pop()
+                if keys is None:
+                    value = converted
+                else:
+                    if strings is not None:
+                        keys = [share(k, strings) for k in keys]
+                    value = cls.from_pairs(zip(keys, converted))
+                if stack:
+                    stack[-1][2].append(value)
+
+        return top[0]
 
-        # OTHERWISE: we need to figure it out.
-        else:
-            raise DocumentException(f"Objdict.from_dict: can't convert value {obj}")
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, any]]) -> Objdict:
+        """
+        Build an object dictionary from (key, value) pairs whose values are already converted.
+          Like the constructor, keys with a value of None are left out. If a key is
+          repeated, the last value wins.
+        """
+        obj = cls()
+        for k, v in pairs:
+            if v is not None:
+                obj[k] = v
+            elif k in obj:
+                del obj[k]
+        return obj
 
-        return value
+    @classmethod
+    def pairs_hook(
+        cls, share_strings: bool = False, make: Optional[type] = None
+    ) -> Callable[[List[Tuple]], Objdict]:
+        """
+        A hook for the json and yaml parsers, so they build object dictionaries
+          directly as they parse. (See config_file.read)
+        :param share_strings: share a single copy of identical keys and short strings.
+        :param make: the kind of dictionary to build, if not our own class.
+        """
+        make = make or cls
+        if not share_strings:
+            return cls.from_pairs if make is cls else make
+
+        strings = {}
+        remember = strings.setdefault
+
+        # Same as from_pairs(), but sharing the keys and strings. (This runs a lot)
+        def hook(pairs: List[Tuple]) -> Objdict:
+            obj = make()
+            for k, v in pairs:
+                if v is None:
+                    obj.pop(k, None)
+                    continue
+                elif isinstance(v, str):
+                    if len(v) <= SHARE_LIMIT:
+                        v = remember(v, v)
+                elif isinstance(v, list):
+                    shared(v, strings)
+                obj[share(k, strings)] = v
+            return obj
+
+        return hook
 
     @staticmethod
     def to_dict(obj):
@@ -159,12 +294,32 @@ class Objdict(SimpleObjdict):
         return value
 
     @classmethod
-    def read(cls, filename: str) -> Objdict:
+    def read(
+        cls,
+        filename: str,
+        share_strings: bool = False,
+        lazy: bool = False,
+        include: Optional[List[str]] = None,
+    ) -> Objdict:
         """
         Read a configuration file as a new object.
+          The object dictionaries are built as the file is parsed.
+        :param share_strings: share repeated keys and short strings. (See from_obj)
+        :param lazy: leave nested values as plain dicts and lists until they are used.
+          Binary designs are always read lazily, straight from the mapped file.
+        :param include: only read these paths, leaving out the rest. (See projection.py)
         """
-        obj = config.read(filename)
-        return cls.from_obj(obj)
+        if is_binary(filename):
+            obj = lazy_class(cls).lazy(config.read(filename, lazy=True))
+            return obj if include is None else project(obj, include_tree(include))
+        if not lazy:
+            hook = cls.pairs_hook(share_strings)
+            return config.read(filename, object_pairs_hook=hook, include=include)
+
+        # Let the parser build plain dictionaries. They are converted as they are reached.
+        hook = cls.pairs_hook(share_strings, make=dict) if share_strings else None
+        obj = config.read(filename, object_pairs_hook=hook, include=include)
+        return lazy_class(cls).lazy(obj)
 
     def write(self, filename: str):
         """
@@ -200,6 +355,209 @@ class Objdict(SimpleObjdict):
         yield from subtrees(self)
 
 
+###############################################################################
+#
+# Lazy object dictionaries.
+#
+# A document often uses a small part of a big design, say one core from a full chip.
+#   Rather than converting every nested dict and list when the design is read,
+#   a lazy object dictionary holds its values as they were parsed. Each nested
+#   dict or list is converted the first time it is fetched, by attribute, index,
+#   path or traversal, and the converted value replaces the plain one. From then on
+#   the same object is returned every time, just as if it had been converted up front.
+#
+# A nested value can also be Deferred, like the nodes of a binary design file,
+#   in which case it is read when it is converted.
+#
+# The conversion is shallow: the new object dictionary holds plain values of its own.
+#   Code which goes around the dictionary methods (dict(obj), {**obj}) sees the
+#   plain values.
+#
+###############################################################################
+
+
+def convertible(value: any) -> bool:
+    """
+    Is the value a plain dict or list (or a deferred one), still waiting to be converted?
+    """
+    return type(value) is dict or type(value) is list or isinstance(value, Deferred)
+
+
+class LazyObjdict:
+    """
+    A mixin which converts the nested values of an object dictionary when they are fetched.
+      Use lazy_class() to make a lazy version of an object dictionary class.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def lazy(cls, value: any) -> any:
+        """
+        Wrap a plain value, leaving its own values to be converted when they are used.
+        """
+        if isinstance(value, Deferred):
+            value = value.materialize()
+        if type(value) is dict:
+            return cls.from_pairs(value.items())
+        elif type(value) is list:
+            return LazyList(value, cls)
+        else:
+            return value
+
+    def __getitem__(self, key: str) -> any:
+        value = dict.__getitem__(self, key)  # Missing keys still go to __missing__.
+        if convertible(value):
+            value = self._converted(self.lazy(value))
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key: str, default: any = None) -> any:
+        return self[key] if key in self else default
+
+    def values(self):
+        self._convert_all()
+        return dict.values(self)
+
+    def items(self):
+        self._convert_all()
+        return dict.items(self)
+
+    def pop(self, key: str, *default: any) -> any:
+        if key in self:
+            self[key]  # Convert the value before handing it out.
+        return dict.pop(self, key, *default)
+
+    def popitem(self) -> Tuple[str, any]:
+        self._convert_all()
+        return dict.popitem(self)
+
+    def setdefault(self, key: str, default: any = None) -> any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __eq__(self, other: any) -> bool:
+        self._convert_all()  # Deferred values don't compare equal to what they hold.
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other: any) -> bool:
+        return not self == other
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    __hash__ = None
+
+    def __reduce_ex__(self, protocol: int):
+        # Lazy classes are made on the fly, so they are pickled by the class they are made from.
+        _, _, *rest = dict.__reduce_ex__(self, protocol)
+        return (lazy_object, (lazy_base(type(self)),), *rest)
+
+    def _convert_all(self):
+        """
+        Convert all our values, as when we are traversed.
+        """
+        for key, value in dict.items(self):
+            if convertible(value):
+                dict.__setitem__(self, key, self._converted(self.lazy(value)))
+
+    def _converted(self, value: any) -> any:
+        """
+        Called with each of our values, or a value in one of our lists, as it is converted.
+          Lists remember us, so their items are passed to us as well. (See fixup.LazyFixups)
+        """
+        if isinstance(value, LazyList):
+            value.owner = self
+        return value
+
+
+class LazyList(list):
+    """
+    A list inside a lazy object dictionary. Its items are converted when they are fetched.
+    """
+
+    __slots__ = ("kind", "owner")
+
+    def __init__(self, items: Iterable, kind: type):
+        """
+        :param kind: the object dictionary class to convert dictionaries into.
+        """
+        super().__init__(items)
+        self.kind = lazy_class(kind)
+        self.owner = None  # The object dictionary holding the list, once it is converted.
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._convert_all()
+            return list.__getitem__(self, index)
+        value = list.__getitem__(self, index)
+        if convertible(value):
+            value = self._converted(self.kind.lazy(value))
+            list.__setitem__(self, index, value)
+        return value
+
+    def __iter__(self):
+        self._convert_all()
+        return list.__iter__(self)
+
+    def __reversed__(self):
+        self._convert_all()
+        return list.__reversed__(self)
+
+    def __eq__(self, other: any) -> bool:
+        self._convert_all()
+        return list.__eq__(self, other)
+
+    def __ne__(self, other: any) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce_ex__(self, protocol: int):
+        return LazyList, (list(self), lazy_base(self.kind))
+
+    def pop(self, index: int = -1) -> any:
+        self[index]  # Convert the item before handing it out.
+        return list.pop(self, index)
+
+    def copy(self) -> list:
+        return self[:]
+
+    def _convert_all(self):
+        for n, value in enumerate(list.__iter__(self)):
+            if convertible(value):
+                list.__setitem__(self, n, self._converted(self.kind.lazy(value)))
+
+    def _converted(self, value: any) -> any:
+        return self.owner._converted(value) if self.owner is not None else value
+
+
+@lru_cache(maxsize=None)
+def lazy_class(cls: type) -> type:
+    """
+    The lazy version of an object dictionary class. Its instances are still instances of cls.
+    """
+    if issubclass(cls, LazyObjdict):
+        return cls
+    return type(f"Lazy{cls.__name__}", (LazyObjdict, cls), {"__slots__": ()})
+
+
+def lazy_base(lazy: type) -> type:
+    """
+    The class a lazy class was made from.
+    """
+    return lazy.__bases__[-1]
+
+
+def lazy_object(cls: type) -> LazyObjdict:
+    """
+    An empty lazy version of an object dictionary, for unpickling.
+    """
+    lazy = lazy_class(cls)
+    return lazy.__new__(lazy)
+
+
 class InvalidObject:
     """
     An empty object which is falsish, returns itself on reads, and dies when printed.
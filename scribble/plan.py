@@ -0,0 +1,417 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (
+    annotations,
+)  # flake8: noqa F821 - Allows access to class name from within.
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from scribble.index import address_range, contains
+from scribble.obj import (
+    sorted_by,
+    grouped_by,
+    examples,
+    remove_duplicates,
+    between,
+    top_k,
+    compile_path,
+)
+
+#########################################################################
+# Query plans.
+#
+# A QueryStream doesn't run its query routines as they are called.
+#   Instead, it records each one as a "step" of a plan, and the plan runs
+#   when the results are needed.
+#
+# A step is "pure" if its results depend only on the design and its arguments.
+#   Pure plans are hashable, so their results can be remembered and reused.
+#   Steps which take a Python function (filter, sorted) are not pure,
+#   since two lambdas never compare equal.
+#########################################################################
+
+
+class Step(NamedTuple):
+    op: str
+    args: Tuple
+
+    @property
+    def pure(self) -> bool:
+        if self.op not in PURE:
+            return False
+
+        # The arguments must be hashable to be part of a key.
+        try:
+            hash(self.args)
+        except TypeError:
+            return False
+        return True
+
+    def run(self, seq: Iterable) -> Iterable:
+        return OPERATORS[self.op](seq, *self.args)
+
+    def __str__(self):
+        return f"{self.op}({', '.join(map(repr, self.args))})"
+
+
+Plan = Tuple[Step, ...]
+
+
+def pure_prefix(plan: Plan) -> int:
+    """
+    The number of leading steps in the plan which are pure.
+    """
+    for n, step in enumerate(plan):
+        if not step.pure:
+            return n
+    return len(plan)
+
+
+def plan_key(plan: Plan) -> Hashable:
+    return tuple((step.op, *step.args) for step in plan)
+
+
+#########################################################################
+# The query planner.
+#
+# Before a plan runs, it is rearranged to do less work.
+#   - Filters commute with each other, so within each run of consecutive
+#     filters the most selective ones go first. Filters which take a
+#     function keep their order and go last.
+#   - In the leading run of filters, predicates which the index can answer
+#     are pushed down to the index. Their positions are intersected, smallest
+#     first, and only the survivors are handed to the remaining steps.
+#   - A sort is skipped when the elements are already in that order.
+#
+# Ordered steps (sorted_by, between, top_k) can instead be answered by an
+#   OrderedIndex over the results of the steps before them. (See index.py)
+#
+# The planner is given an "access" object for the index, if there is one.
+#   access.lookup(step) --> sorted positions answering the step, or None
+#   access.all()        --> positions of every element in scope
+#   access.elements(positions) --> the corresponding elements
+#   access.ordering     --> (path, reverse) if the positions come out sorted
+#########################################################################
+
+FILTERS = {
+    "is_instance",
+    "is_not_instance",
+    "contains_key",
+    "has_key_value",
+    "hasnt_key_value",
+    "value_contains",
+    "between",
+    "overlapping",
+    "containing",
+    "ancestors_of",
+    "siblings",
+    "filter",
+}
+
+ORDERED = {"sorted_by", "between", "top_k"}
+
+# Rough fraction of elements which pass a filter, when the index can't tell us.
+SELECTIVITY = {
+    "is_instance": 0.1,
+    "has_key_value": 0.1,
+    "value_contains": 0.1,
+    "ancestors_of": 0.01,
+    "siblings": 0.01,
+    "containing": 0.05,
+    "overlapping": 0.1,
+    "between": 0.2,
+    "contains_key": 0.5,
+    "is_not_instance": 0.9,
+    "hasnt_key_value": 0.9,
+    "filter": 1.0,
+}
+
+
+class QueryPlan:
+    """
+    An optimized plan, ready to run.
+    """
+
+    access: List[Tuple[Step, Sequence[int]]]  # Steps answered by the index.
+    steps: List[Tuple[Step, bool]]  # Remaining steps, and whether they are skipped.
+
+    def __init__(self, plan: Plan, access=None, ordering=None):
+        """
+        :param plan: the steps to run.
+        :param access: the index, if the plan runs against the design.
+        :param ordering: (path, reverse) if the source is already sorted.
+        """
+        self.scope = access
+        self.access = []
+        self.steps = []
+
+        # Split off the leading run of filters.
+        n = 0
+        while n < len(plan) and plan[n].op in FILTERS:
+            n += 1
+        leading, rest = plan[:n], plan[n:]
+
+        # Push the leading filters down to the index where possible.
+        if access is not None:
+            remaining = []
+            for step in leading:
+                positions = access.lookup(step)
+                if positions is None:
+                    remaining.append(step)
+                else:
+                    self.access.append((step, positions))
+            self.access.sort(key=lambda a: len(a[1]))
+            leading = remaining
+
+        # Reorder the filters in each run, and drop any redundant sorts.
+        if access is not None:
+            ordering = access.ordering
+        for run in runs(leading, rest):
+            for step in run:
+                skip = False
+                if step.op == "sorted_by":
+                    skip = ordering == step.args
+                    ordering = step.args
+                elif step.op == "top_k":
+                    ordering = (step.args[0], step.args[2])
+                elif step.op == "sorted":
+                    ordering = None
+                self.steps.append((step, skip))
+
+    def run(
+        self, source: Iterable, explain: Explanation = None, scanning: bool = True
+    ) -> Iterable:
+        """
+        Run the plan against the source, or against the index if there is one.
+        :param scanning: whether taking elements from the source counts as scanning the design.
+        """
+        # Find the starting elements, either from the index or from the source.
+        if self.scope is not None:
+            positions = intersect([p for _, p in self.access], self.scope.all())
+            seq = self.scope.elements(positions)
+            if explain is not None:
+                for step, p in self.access:
+                    explain.add(f"index: {step} --> {len(p)} elements")
+                explain.scanned += len(seq)
+        else:
+            seq = source
+            if explain is not None and scanning:
+                seq = explain.scan(seq)
+
+        # Run the remaining steps.
+        for step, skip in self.steps:
+            if skip:
+                if explain is not None:
+                    explain.add(f"skip: {step}, already in order")
+                continue
+            seq = step.run(seq)
+            if explain is not None:
+                seq = explain.count(str(step), seq)
+
+        return seq
+
+
+def ordered_steps(plan: Plan, ordering=None) -> List[int]:
+    """
+    Positions of the ordered steps in a plan, leaving out sorts which
+      find the elements already in order.
+    """
+    found = []
+    for n, step in enumerate(plan):
+        if step.op == "sorted_by" and step.args == ordering:
+            continue
+        elif step.op in ("sorted_by", "top_k"):
+            ordering = (step.args[0], step.args[-1])
+        elif step.op == "sorted":
+            ordering = None
+        if step.op in ORDERED:
+            found.append(n)
+    return found
+
+
+def runs(*plans: Plan) -> Iterable[List[Step]]:
+    """
+    Split plans into runs of filters and single non-filter steps,
+      with the most selective filters first.
+    """
+    for plan in plans:
+        run = []
+        for step in plan:
+            if step.op in FILTERS:
+                run.append(step)
+                continue
+            if run:
+                yield sorted(run, key=selectivity)
+                run = []
+            yield [step]
+        if run:
+            yield sorted(run, key=selectivity)
+
+
+def selectivity(step: Step) -> float:
+    return SELECTIVITY[step.op]
+
+
+def intersect(lists: List[Sequence[int]], everything: Sequence[int]) -> Sequence[int]:
+    """
+    Intersect sorted lists of positions, smallest first.
+    """
+    if not lists:
+        return everything
+    result = lists[0]
+    for other in lists[1:]:
+        members = set(other)
+        result = [p for p in result if p in members]
+    return result
+
+
+class Explanation:
+    """
+    A report of how a plan ran, step by step.
+    """
+
+    def __init__(self, title: str = ""):
+        self.lines = [title] if title else []
+        self.scanned = 0
+
+    def add(self, line: str):
+        self.lines.append(line)
+
+    def scan(self, seq: Iterable) -> Iterable:
+        """
+        Count the elements taken from the source.
+        """
+        for e in seq:
+            self.scanned += 1
+            yield e
+
+    def count(self, label: str, seq: Iterable) -> Iterable:
+        """
+        Count the elements coming out of a step.
+        """
+        counter = [label, 0]
+        self.lines.append(counter)
+
+        def counting():
+            for e in seq:
+                counter[1] += 1
+                yield e
+
+        return counting()
+
+    def __str__(self):
+        lines = [
+            line if isinstance(line, str) else f"step: {line[0]} --> {line[1]} elements"
+            for line in self.lines
+        ]
+        return "\n".join([*lines, f"scanned: {self.scanned} elements"])
+
+
+#########################################################################
+# The query operators, each of which transforms a sequence of elements.
+#########################################################################
+
+
+OPERATORS: Dict[str, Callable[..., Iterable]] = {
+    "is_instance": lambda seq, *types: (e for e in seq if e.is_instance(*types)),
+    "is_not_instance": lambda seq, *types: (
+        e for e in seq if e.is_not_instance(*types)
+    ),
+    "contains_key": lambda seq, path: where(seq, path, lambda v: v is not None),
+    "has_key_value": lambda seq, path, value: where(seq, path, lambda v: v == value),
+    "hasnt_key_value": lambda seq, path, *values: (
+        where(seq, path, lambda v: v not in values)
+    ),
+    "value_contains": lambda seq, path, value: (
+        where(seq, path, lambda v: contains(v, value))
+    ),
+    "ancestors_of": lambda seq, element: among(seq, element.ancestors()),
+    "siblings": lambda seq, element: among(seq, element.siblings()),
+    "sorted_by": lambda seq, path, reverse: sorted_by(seq, path, reverse),
+    "between": lambda seq, path, lo, hi: between(seq, path, lo, hi),
+    "overlapping": lambda seq, begin, end, base, size: (
+        e for e in seq if overlaps(address_range(e, base, size), begin, end)
+    ),
+    "containing": lambda seq, address, base, size: (
+        e for e in seq if covers(address_range(e, base, size), address)
+    ),
+    "top_k": lambda seq, path, k, reverse: top_k(seq, path, k, reverse),
+    "remove_duplicates": lambda seq, path: remove_duplicates(seq, path),
+    "examples": lambda seq, path: examples(grouped_by(seq, path)),
+    "filter": lambda seq, fn: (e for e in seq if fn(e)),
+    "sorted": lambda seq, key, reverse: sorted(seq, key=key, reverse=reverse),
+}
+
+PURE = {
+    "is_instance",
+    "is_not_instance",
+    "contains_key",
+    "has_key_value",
+    "hasnt_key_value",
+    "value_contains",
+    "sorted_by",
+    "between",
+    "top_k",
+    "overlapping",
+    "containing",
+    "remove_duplicates",
+    "examples",
+}
+
+
+def where(seq: Iterable, path: str, test: Callable[[Any], bool]) -> Iterable:
+    """
+    Keep the elements whose value at the path passes the test.
+    """
+    get = compile_path(path).get
+    return (e for e in seq if test(get(e)))
+
+
+def among(seq: Iterable, elements: Iterable) -> Iterable:
+    """
+    Keep the elements which are (the very same objects) among the given elements.
+    """
+    ids = {id(e) for e in elements}
+    return (e for e in seq if id(e) in ids)
+
+
+def overlaps(interval: Optional[Tuple[int, int]], begin: int, end: int) -> bool:
+    """
+    Does an address range overlap the region [begin, end)? An empty region overlaps nothing.
+    """
+    return interval is not None and begin < end and interval[0] < end and begin < interval[1]
+
+
+def covers(interval: Optional[Tuple[int, int]], address: int) -> bool:
+    """
+    Does an address range contain the address?
+    """
+    return interval is not None and interval[0] <= address < interval[1]
+
+
+def step(op: str, *args: Any) -> Step:
+    return Step(op, args)
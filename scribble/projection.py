@@ -0,0 +1,272 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (
+    annotations,
+)  # flake8: noqa F821 - Allows access to class name from within.
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from scribble.exceptions import DocumentException
+from scribble.obj import Deferred, Unavailable, split_path
+
+#########################################################################
+# Reading only part of a design.
+#
+# A document usually renders a few subtrees of a design. The document config
+#   can list the design paths it needs, eg.  design_include: [cores, memoryMap]
+#   and the rest of the design is left out as it is read.
+#
+# The paths form a tree of keys. Along the paths, dicts keep their simple
+#   values (and their "_types"), but only keep the dicts and lists which are
+#   on a path. Lists are passed through: each of their items is projected in
+#   the same way. Below the end of a path, everything is kept.
+#
+# A left out value is replaced by an ExcludedObject, which raises an exception
+#   as soon as it is used. The document then fails with a clear message rather
+#   than quietly rendering INVALID values.
+#
+# Json is projected as it is scanned. The whole file is still read and parsed:
+#   this drops dicts, it doesn't skip text. The parts which are kept are parsed by
+#   the json library. The parts left out are run through the json library's scanner
+#   as well, with a hook which drops each dict as soon as it is parsed. The strings,
+#   numbers and lists inside them are still created and then freed. What is saved is
+#   building elements from them and keeping them in memory. (Scanning for brackets
+#   in Python was tried, and was slower than the json library's scanner)
+#########################################################################
+
+# The paths to keep, as a tree of keys. None marks the end of a path.
+IncludeTree = Dict[str, Optional["IncludeTree"]]
+
+ALWAYS_KEPT = "_types"
+
+
+class ExcludedObject(Unavailable):
+    """
+    A part of the design which was left out by "design_include". Using it raises an exception.
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fail(self, path: str = ""):
+        via = f" (fetching '{path}')" if path else ""
+        raise DocumentException(
+            f"Design path '{self.path}' was left out by design_include{via}. "
+            f"Add it to design_include in the document config."
+        )
+
+    def __getattr__(self, key: str):
+        if key.startswith("__"):
+            raise AttributeError(key)
+        self.fail(key)
+
+    def __getitem__(self, key: Any):
+        self.fail(str(key))
+
+    def __setitem__(self, key: Any, value: Any):
+        self.fail(str(key))
+
+    def __contains__(self, key: Any):
+        self.fail(str(key))
+
+    def __iter__(self):
+        self.fail()
+
+    def __len__(self):
+        self.fail()
+
+    def __bool__(self):
+        self.fail()
+
+    def __str__(self):
+        self.fail()
+
+    def __repr__(self):
+        return f"ExcludedObject({self.path!r})"
+
+
+def include_tree(paths: Iterable[str]) -> IncludeTree:
+    """
+    Build a tree of keys from a list of dot separated paths.
+      A path which is a prefix of another keeps the whole subtree.
+      Paths can't pick out list items, since every item of a list is projected the same way.
+    """
+    tree = {}
+    for path in paths:
+        if "[" in path:
+            raise DocumentException(
+                f"design_include path '{path}' has a list index. Every item of a list is kept"
+                f" or left out alike, so leave out the index, eg. 'cores[0].regs' --> 'cores.regs'."
+            )
+        pieces = split_path(path)
+        if not pieces:
+            continue
+        *pieces, last = pieces
+        node = tree
+        for piece in pieces:
+            if piece in node and node[piece] is None:
+                break
+            node = node.setdefault(piece, {})
+        else:
+            node[last] = None
+    return tree
+
+
+def excluded(tree: IncludeTree, key: str, path: str) -> Optional[str]:
+    """
+    The path of a dict or list value which is left out, or None if it is kept.
+    """
+    if key in tree or key == ALWAYS_KEPT:
+        return None
+    return f"{path}.{key}" if path else key
+
+
+def project(obj: Any, tree: IncludeTree, path: str = "") -> Any:
+    """
+    Leave out the parts of an object which aren't on the paths, replacing them in place.
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            project(item, tree, path)
+    elif isinstance(obj, dict):
+        for key in list(obj):
+            value = dict.__getitem__(obj, key)  # Don't read lazy values we're leaving out.
+            if not is_container(value):
+                continue
+            left_out = excluded(tree, key, path)
+            if left_out is not None:
+                obj[key] = ExcludedObject(left_out)
+            elif tree.get(key) is not None:
+                project(obj[key], tree[key], f"{path}.{key}" if path else key)
+    return obj
+
+
+def is_container(value: Any) -> bool:
+    return isinstance(value, (dict, list, Deferred))
+
+
+#########################################################################
+# Projecting json as it is scanned.
+#########################################################################
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def load_json(text: str, tree: IncludeTree, object_pairs_hook: Callable = None) -> Any:
+    """
+    Parse json text, leaving out the parts which aren't on the paths.
+    :param object_pairs_hook: builds each dict from its (key, value) pairs, as in json.load().
+    """
+    scanner = JsonProjector(text, object_pairs_hook)
+    value, end = scanner.value(WHITESPACE.match(text, 0).end(), tree, "")
+    end = WHITESPACE.match(text, end).end()
+    if end != len(text):
+        raise json.JSONDecodeError("Extra data", text, end)
+    return value
+
+
+class JsonProjector:
+    """
+    Parses json text, building only the parts which are kept.
+    """
+
+    def __init__(self, text: str, object_pairs_hook: Callable = None):
+        self.text = text
+        self.hook = object_pairs_hook or dict
+        self.decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+        self.dropper = json.JSONDecoder(object_pairs_hook=discard)
+
+    def value(self, pos: int, tree: Optional[IncludeTree], path: str) -> Tuple[Any, int]:
+        """
+        Parse the value starting at pos. Returns the value and the position after it.
+        """
+        c = self.text[pos : pos + 1]
+        if tree is not None and c == "{":
+            return self.object(pos, tree, path)
+        elif tree is not None and c == "[":
+            return self.array(pos, tree, path)
+        return self.decoder.raw_decode(self.text, pos)
+
+    def object(self, pos: int, tree: IncludeTree, path: str) -> Tuple[Any, int]:
+        text = self.text
+        pairs = []
+        pos = WHITESPACE.match(text, pos + 1).end()
+        if text[pos : pos + 1] == "}":
+            return self.hook(pairs), pos + 1
+
+        while True:
+            # The key, then the colon.
+            if text[pos : pos + 1] != '"':
+                raise json.JSONDecodeError("Expecting property name", text, pos)
+            key, pos = scanstring(text, pos + 1)
+            pos = WHITESPACE.match(text, pos).end()
+            if text[pos : pos + 1] != ":":
+                raise json.JSONDecodeError("Expecting ':' delimiter", text, pos)
+            pos = WHITESPACE.match(text, pos + 1).end()
+
+            # The value. Drop it if it is a dict or list we are leaving out.
+            left_out = None
+            if text[pos : pos + 1] in ("{", "["):
+                left_out = excluded(tree, key, path)
+            if left_out is not None:
+                value, pos = ExcludedObject(left_out), self.drop(pos)
+            else:
+                inner = f"{path}.{key}" if path else key
+                value, pos = self.value(pos, tree.get(key), inner)
+            pairs.append((key, value))
+
+            # A comma for the next pair, or the end of the object.
+            pos = WHITESPACE.match(text, pos).end()
+            c = text[pos : pos + 1]
+            pos = WHITESPACE.match(text, pos + 1).end()
+            if c == "}":
+                return self.hook(pairs), pos
+            elif c != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, pos - 1)
+
+    def array(self, pos: int, tree: IncludeTree, path: str) -> Tuple[Any, int]:
+        text = self.text
+        values = []
+        pos = WHITESPACE.match(text, pos + 1).end()
+        if text[pos : pos + 1] == "]":
+            return values, pos + 1
+
+        while True:
+            value, pos = self.value(pos, tree, path)
+            values.append(value)
+            pos = WHITESPACE.match(text, pos).end()
+            c = text[pos : pos + 1]
+            pos = WHITESPACE.match(text, pos + 1).end()
+            if c == "]":
+                return values, pos
+            elif c != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, pos - 1)
+
+    def drop(self, pos: int) -> int:
+        """
+        Parse the dict or list starting at pos and drop it, returning the position after it.
+          Its dicts are dropped as they are parsed, but its other values are still created.
+        """
+        return self.dropper.raw_decode(self.text, pos)[1]
+
+
+def discard(pairs: list) -> None:
+    return None
@@ -0,0 +1,100 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from typing import Dict, Iterable, Tuple
+
+from scribble.template import NON_BREAKING_HYPHEN
+
+#########################################################################
+# A registry of type names.
+#
+# Each type name is given its own bit, so a list of types becomes a single
+#   integer mask. Once the design is frozen, every element is given the mask
+#   of its "_types", and is_instance() is a single AND against the (cached)
+#   mask of the types being queried.
+#
+# Bits are never reused, so a mask stays valid for the life of the process.
+#########################################################################
+
+
+class TypeRegistry:
+    """
+    Interns type names as bits of an integer mask, and remembers
+    how each type is described in the documentation.
+    """
+
+    def __init__(self):
+        self.bits = {}  # type name --> bit
+        self.masks = {}  # tuple of type names --> mask
+        self.documentation = {}  # type name --> documentation string
+
+    def element_mask(self, types: Iterable[str]) -> int:
+        """
+        The mask for an element's types, registering any new types.
+        """
+        mask = 0
+        for name in types:
+            bit = self.bits.get(name)
+            if bit is None:
+                bit = self.bits[name] = 1 << len(self.bits)
+                self.masks.clear()  # Cached query masks may include the new type.
+            mask |= bit
+        return mask
+
+    def mask(self, types: Tuple[str, ...]) -> int:
+        """
+        The mask for the types being queried. Unregistered types don't match anything.
+        """
+        mask = self.masks.get(types)
+        if mask is None:
+            mask = 0
+            for name in types:
+                mask |= self.bits.get(name, 0)
+            self.masks[types] = mask
+        return mask
+
+    def documentation_type(self, name: str) -> str:
+        """
+        The documentation string for a type, created once per type.
+        """
+        doc = self.documentation.get(name)
+        if doc is None:
+            doc = self.documentation[name] = documentation_type(name)
+        return doc
+
+
+def documentation_type(name: str) -> str:
+    """
+    Generate a plausible documentation string for a type.
+      (Works for some common cases - need a more general solution,probably based on schemas)
+    """
+
+    # Break CamelCase into separate words Camel Case.
+    #  (We assume underscores in a type are between two uppercase letters)
+    dt = re.sub("([A-Z][A-Z0-9_]*[a-z0-9_]*)", r" \1", name)
+
+    # Replace underscores with hyphens.
+    dt = dt.replace("_", NON_BREAKING_HYPHEN)
+
+    # We may introduced a leading space. Delete it.
+    #   TODO: (We should be able to do this as a single re.)
+    dt = re.sub("^ ", "", dt)
+
+    return dt
+
+
+# The registry shared by all designs.
+TYPES = TypeRegistry()
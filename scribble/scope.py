@@ -16,14 +16,26 @@
 from __future__ import (
     annotations,
 )  # flake8: noqa F821 - Allows access to class name from within.
-import re
+from copy import copy
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Hashable, Iterable, Iterator, List, Optional, Tuple
 
+from scribble.columns import ColumnFrame
 from scribble.exceptions import DocumentException
-from scribble.obj import sorted_by, grouped_by, grouped, examples, remove_duplicates
+from scribble.index import DesignIndex, OrderedIndex
+from scribble.memo import QueryMemo
+from scribble.obj import grouped_by, grouped, subdicts
 from scribble.objdict import Objdict, INVALID
-from scribble.template import NON_BREAKING_HYPHEN
+from scribble.plan import (
+    Explanation,
+    Plan,
+    QueryPlan,
+    ordered_steps,
+    plan_key,
+    pure_prefix,
+    step,
+)
+from scribble.registry import TYPES
 
 PROJDIR = Path(__file__).parent.parent
 
@@ -34,6 +46,9 @@ class Element(Objdict):
     Note elements generally have a "_types" list saying what type it is.
     """
 
+    # The mask of the element's types, given out when the design is indexed.
+    __slots__ = ("_type_mask",)
+
     def primary_type(self) -> str:
         return self._types[0]
 
@@ -48,19 +63,7 @@ class Element(Objdict):
         Use the "_type" property to generate a plausible documentation string for the type.
           (Works for some common cases - need a more general solution,probably based on schemas)
         """
-
-        # Break CamelCase into separate words Camel Case.
-        #  (We assume underscores in a type are between two uppercase letters)
-        dt = re.sub("([A-Z][A-Z0-9_]*[a-z0-9_]*)", r" \1", self._type)
-
-        # Replace underscores with hyphens.
-        dt = dt.replace("_", NON_BREAKING_HYPHEN)
-
-        # We may introduced a leading space. Delete it.
-        #   TODO: (We should be able to do this as a single re.)
-        dt = re.sub("^ ", "", dt)
-
-        return dt
+        return TYPES.documentation_type(self._type)
 
     def is_instance(self, *types: str) -> bool:
         """
@@ -68,17 +71,78 @@ class Element(Objdict):
         :param types:
         :return:
         """
-        return self._types and (set(self._types) & set(types))
+        # Once the design is indexed, compare the type masks.
+        try:
+            return bool(type_mask(self) & TYPES.mask(types))
+        except AttributeError:
+            return bool(self._types) and bool(set(self._types) & set(types))
 
     def is_not_instance(self, *types: str) -> bool:
-        return self._types and not (set(self._types) & set(types))
+        try:
+            mask = type_mask(self)
+            return bool(mask) and not mask & TYPES.mask(types)
+        except AttributeError:
+            return bool(self._types) and not (set(self._types) & set(types))
+
+    ##################################################################
+    # Where the element sits in the frozen design tree.
+    #   These come from the design index, so they only work once the
+    #   design is set up. A data item with the same name takes precedence.
+    ##################################################################
+
+    @property
+    def parent(self) -> Element:
+        """
+        The nearest element enclosing this one, or INVALID if there isn't one.
+        """
+        if "parent" in self:
+            return self["parent"]
+        index = MemoizedQueryStream.design_index()
+        if index is None or self not in index:
+            return INVALID
+        parent = index.parent_of(self)
+        return INVALID if parent is None else parent
+
+    @property
+    def path(self) -> str:
+        """
+        The path from the top of the document to this element, eg. "design.cores[1]"
+        """
+        if "path" in self:
+            return self["path"]
+        index = MemoizedQueryStream.design_index()
+        if index is None or self not in index:
+            return INVALID
+        return index.path_of(self)
+
+    def ancestors(self) -> List[Element]:
+        """
+        The elements enclosing this one, nearest first.
+        """
+        index = self._index()
+        return [index.elements[pos] for pos in index.ancestor_positions(self)]
+
+    def siblings(self) -> List[Element]:
+        """
+        The other elements which share this element's parent, in document order.
+        """
+        index = self._index()
+        return [index.elements[pos] for pos in index.sibling_positions(self)]
+
+    def _index(self) -> DesignIndex:
+        index = MemoizedQueryStream.design_index()
+        if index is None or self not in index:
+            raise DocumentException(
+                f"{self.get_path(primary_type) or 'element'} is not part of the design tree"
+            )
+        return index
 
     def query(self) -> QueryStream:
         """
         Start a query using the given design subtree.
         :return: A stream which can be "queried"
         """
-        iterator = (s for s in self.subtrees() if isinstance(s, Element))
+        iterator = (s for s in subdicts(self) if isinstance(s, Element))
         return MemoizedQueryStream(iterator, self)
 
 
@@ -86,21 +150,27 @@ class QueryStream(Iterable[Element]):
     """
     A QueryStream supports queries against a design element and its subelements.
        It is implemented as a stream of element subtrees, which are filtered by query routines.
+
+    The query routines don't run right away. Each one adds a step to the stream's plan,
+       and the plan is optimized and run the first time an element is taken from the stream.
+       (See plan.py for the query planner.)
     """
 
-    gen: Iterable[Element]
+    gen: Optional[Iterator[Element]]  # The results, once the plan has started running.
+    source: Iterable[Element]
+    plan: Plan
 
     def is_instance(self, *types: str) -> QueryStream:
         """
         Query to keep elements whose types are instances of the given type.
         """
-        return QueryStream(e for e in self if e.is_instance(*types))
+        return self._then("is_instance", *types)
 
     def is_not_instance(self, *types: str) -> QueryStream:
-        return QueryStream(e for e in self if e.is_not_instance(*types))
+        return self._then("is_not_instance", *types)
 
     def filter(self, fn):
-        return QueryStream(e for e in self if fn(e))
+        return self._then("filter", fn)
 
     # TODO: one of several
     def contains_key(
@@ -110,7 +180,7 @@ class QueryStream(Iterable[Element]):
         Selects elements with a specified piece of data present.
           :param path: A string path "a.b.c" representing a piece of data which must exist.
           """
-        return QueryStream(e for e in self if e.get_path(path) is not None)
+        return self._then("contains_key", path)
 
     # TODO: one of several
     def has_key_value(self, path: str, value: any) -> QueryStream:
@@ -119,20 +189,20 @@ class QueryStream(Iterable[Element]):
         :param path: A string path "a.b.c" representing a piece of data
         :param value: The corresponding value which must match.
         """
-        return QueryStream(e for e in self if e.get_path(path) == value)
+        return self._then("has_key_value", path, value)
 
     def hasnt_key_value(self, path: str, *values: any) -> QueryStream:
         """
         select elements which do NOT have any the specified values.
         """
-        return QueryStream(e for e in self if e.get_path(path) not in values)
+        return self._then("hasnt_key_value", path, *values)
 
     def value_contains(self, path: str, value: any) -> QueryStream:
-        def contains(e: Element) -> bool:
-            container = e.get_path(path)
-            return container and e in container
-
-        return self.filter(contains)
+        """
+        Selects elements where the container at the path holds the value.
+          Elements and other unhashable values must be the very same object.
+        """
+        return self._then("value_contains", path, value)
 
     def debug(self):
         """
@@ -146,8 +216,7 @@ class QueryStream(Iterable[Element]):
         """
         Group elements by a value, then pick the first of each group as an example.
         """
-        groups = self.grouped_by(path)
-        return QueryStream(examples(groups))
+        return self._then("examples", path)
 
     # TODO: Refactor so this is a query stream?
     def grouped_by(self, path: str) -> Iterable[List[Element]]:
@@ -160,10 +229,52 @@ class QueryStream(Iterable[Element]):
         return grouped(self, key=key)
 
     def sorted_by(self, path: str, reverse=False) -> QueryStream:
-        return QueryStream(sorted_by(self, path, reverse))
+        return self._then("sorted_by", path, reverse)
 
     def sorted(self, *, key, reverse=False) -> QueryStream:
-        return QueryStream(sorted(self, key=key, reverse=reverse))
+        return self._then("sorted", key, reverse)
+
+    def between(self, path: str, lo, hi) -> QueryStream:
+        """
+        Selects elements whose numeric value at the path is in the range lo..hi (inclusive).
+        """
+        return self._then("between", path, lo, hi)
+
+    def ancestors_of(self, element: Element) -> QueryStream:
+        """
+        Selects elements which enclose the given element.
+        """
+        return self._then("ancestors_of", element)
+
+    def siblings(self, element: Element) -> QueryStream:
+        """
+        Selects elements which share a parent with the given element (but not the element itself)
+        """
+        return self._then("siblings", element)
+
+    def overlapping(
+        self, lo: int, hi: int, base: str = "baseAddress", size: str = "size"
+    ) -> QueryStream:
+        """
+        Selects elements whose address range overlaps the region [lo, hi).
+          An element covers [base, base+size), found at the given paths.
+        """
+        return self._then("overlapping", lo, hi, base, size)
+
+    def containing(
+        self, address: int, base: str = "baseAddress", size: str = "size"
+    ) -> QueryStream:
+        """
+        Selects elements whose address range [base, base+size) contains the address.
+        """
+        return self._then("containing", address, base, size)
+
+    def top_k(self, path: str, k: int, reverse=False) -> QueryStream:
+        """
+        The k elements with the smallest numeric values at the path (largest if reverse),
+          in sorted order. Elements without a numeric value are dropped.
+        """
+        return self._then("top_k", path, k, reverse)
 
     def sortgroup_by(self, path: str) -> Iterable[List[Element]]:
         return self.sorted_by(path).grouped_by(path)
@@ -172,7 +283,7 @@ class QueryStream(Iterable[Element]):
         """
         Keep the first of each element which matches the key.
         """
-        return QueryStream(remove_duplicates(self, path))
+        return self._then("remove_duplicates", path)
 
     ##################################################################
     # "Collectors" to accumulate results of a query.
@@ -217,35 +328,97 @@ class QueryStream(Iterable[Element]):
 
         return element
 
+    def to_columns(self, paths: List[str]) -> ColumnFrame:
+        """
+        Collect the results into a columnar frame, with a column for each path.
+          The frame can be sorted, grouped and passed to ObjectTable. (Needs numpy)
+        """
+        return ColumnFrame(list(self), paths)
+
+    def min_by(self, path: str) -> Element:
+        """
+        The first element with the smallest numeric value at the path, or INVALID if none.
+        """
+        return self.top_k(path, 1).first()
+
+    def max_by(self, path: str) -> Element:
+        """
+        The first element with the largest numeric value at the path, or INVALID if none.
+        """
+        return self.top_k(path, 1, reverse=True).first()
+
     def exists(self) -> bool:
         return self.first() is not INVALID
 
     def count(self) -> int:
         return sum(1 for _ in self)
 
+    def explain(self) -> str:
+        """
+        Run the query and report the plan which was chosen, along with
+        how many elements were scanned to get the results.
+          The results are kept, so the stream can still be used afterwards.
+        """
+        if self.gen is not None:
+            raise DocumentException("explain() must come before using the query results")
+
+        explanation = Explanation(self._title())
+        self.gen = iter(list(self._run(explanation)))
+        return str(explanation)
+
     def _invalidate(self):
-        self.gen = None
+        self.gen = iter(())
+
+    ################################################
+    # Building and running the plan.
+    ################################################
+    def _then(self, op: str, *args) -> QueryStream:
+        """
+        Create a new stream which adds a step to our plan.
+        """
+        # CASE: we already started producing results. Continue from where we are.
+        if self.gen is not None:
+            return QueryStream(self.gen, (step(op, *args),))
+
+        # OTHERWISE, same stream with a longer plan.
+        stream = copy(self)
+        stream.plan = (*self.plan, step(op, *args))
+        return stream
+
+    def _run(self, explain: Explanation = None) -> Iterable[Element]:
+        """
+        Optimize and run the plan, producing the results.
+        """
+        return QueryPlan(self.plan).run(self.source, explain)
+
+    def _title(self) -> str:
+        return "query"
 
     ################################################
     # Query stream serves as a proxy for the underlying iterator.
     #  (In Scala, we would pimp it with an implicit conversion.)
     ################################################
-    def __init__(self, gen: Iterable[Element]):
+    def __init__(self, gen: Iterable[Element], plan: Plan = ()):
         if gen is INVALID:
             raise DocumentException("Attempting to query an INVALID")
 
-        if isinstance(gen, QueryStream):
-            self.gen = gen.gen
-        else:
-            self.gen = iter(gen)
+        self.source = gen
+        self.plan = plan
+        self.gen = None
 
     def __next__(self):
+        if self.gen is None:
+            self.gen = iter(self._run())
         return self.gen.__next__()
 
     def __iter__(self):
         return self
 
 
+# Fetch an element's type mask, raising AttributeError if it doesn't have one yet.
+type_mask = Element._type_mask.__get__
+
+
 # An alternate constructor for QueryStream.
 def Query(elements: List[Element]) -> QueryStream:
     return QueryStream(elements)
@@ -257,48 +430,194 @@ primary_type = "_types[0]"
 
 
 #########################################################################
-# A query stream which memo-izes the first "is_instance" query.
+# A query stream which memo-izes the results of queries.
 #   The idea is to remember the results of
-#         element.query().is_instance(xxx)
+#         element.query().is_instance(xxx).has_key_value(yyy, zzz).sorted_by(www)
 #   and to do the search only once.
-#   (we could expand it to other queries, but is_instance is the most common case)
+#
+# The leading pure steps of the plan are run once and their results are
+#   remembered, keyed by the element and the steps. Any impure steps
+#   (filter or sorted with a lambda) run on top of the remembered results.
+#   grouped_by() is remembered as well.
+#
+# Once the design is frozen, the planner pushes is_instance() down to a type index
+#   instead of scanning. The index is built once, and it covers every subtree of the design.
+#
+# Ordered steps (sorted_by, between, top_k) are answered from an OrderedIndex of
+#   the results before them. The ordered index is remembered like any other
+#   result, so each set of results is sorted by a path only once.
+#
+# Address queries (overlapping, containing) are answered from an interval tree
+#   over the (base, size) ranges of the elements in the subtree.
+#
+# Memoizing is global to the process. enable() replaces the index and memo, and
+#   disable() drops them, so a document set up later never answers its queries
+#   with results remembered for an earlier one.
 ##################################################################################
 class MemoizedQueryStream(QueryStream):
-    memo = {}
+    memo = QueryMemo()
     enabled = False
+    index: Optional[DesignIndex] = None
+    pending: Optional[Element] = None  # Top of a lazy tree which isn't indexed yet.
 
-    def __init__(self, gen, element: Element):
-        super().__init__(gen)
+    def __init__(self, gen, element: Element, plan: Plan = ()):
+        super().__init__(gen, plan)
         self.element = element
 
-    def is_instance(self, *types: str) -> QueryStream:
-
+    def grouped_by(self, path: str) -> Iterable[List[Element]]:
+        """
+        Groups items by the given key, remembering the groups.
+        """
+        plan = (*self.plan, step("grouped_by", path))
+        if not self.enabled or self.gen is not None or pure_prefix(plan) < len(plan):
+            return super().grouped_by(path)
+
+        # Fetch or create the groups. Hand out copies so the memo can't be altered.
+        key = self._key(plan)
+        groups = self.memo.get(key, self.element)
+        if groups is None:
+            groups = tuple(map(tuple, grouped_by(self._results(self.plan), path)))
+            self.memo.put(key, self.element, groups)
+        return [list(group) for group in groups]
+
+    def _run(self, explain: Explanation = None) -> Iterable[Element]:
         if not self.enabled:
-            return super().is_instance(*types)
+            return super()._run(explain)
 
-        # Create a hashable tuple from the args.
-        args = (id(self.element), *types)
+        # CASE: nothing to remember. Let the planner push what it can down to the index.
+        n = pure_prefix(self.plan)
+        if n == 0:
+            return self._scope(self.plan, explain)
 
-        # If memo is full, empty it out and start over. (infrequent if at all)
-        #  Note: this is a really lame replacement algorithm, but
-        #  it works surprisingly well in practice.
-        if len(MemoizedQueryStream.memo) > 1024:
-            MemoizedQueryStream.memo = {}
+        # Remember the results of the pure part of the plan, then run the rest.
+        results = self._results(self.plan[:n], explain)
+        return QueryPlan(self.plan[n:]).run(results, explain, scanning=False)
 
-        # Get results
-        # CASE: already memoized. Return the saved results.
-        if args in MemoizedQueryStream.memo:
-            results = MemoizedQueryStream.memo[args]
+    def _results(self, plan: Plan, explain: Explanation = None) -> Iterable[Element]:
+        """
+        The results of a pure plan, either remembered or freshly created.
+        """
+        if not plan:
+            return self._scope(plan, explain)
 
-        # OTHERWISE, scan for the results and save them
+        # CASE: already memoized. Return the saved results.
+        memo = self.memo
+        key = self._key(plan)
+        results = memo.get(key, self.element)
+        if results is not None:
+            if explain is not None:
+                explain.add(f"memo: all {len(plan)} steps remembered")
+            return results
+
+        # CASE: the plan has an ordered step. Answer it from an ordered index.
+        ordered = ordered_steps(plan)
+        if ordered:
+            n = ordered[-1]
+            results = self._ordered(plan[:n], plan[n].args[0], explain).run(plan[n])
+            if explain is not None:
+                explain.add(f"ordered: {plan[n]} --> {len(results)} elements")
+            ordering = (plan[n].args[0], plan[n].args[-1])
+            if plan[n].op == "between":
+                ordering = None
+            rest = QueryPlan(plan[n + 1 :], ordering=ordering)
+            return memo.put(key, self.element, tuple(rest.run(results, explain, False)))
+
+        # Continue from the longest part of the plan we remember, if any.
+        for n in range(len(plan) - 1, 0, -1):
+            results = memo.peek(self._key(plan[:n]), self.element)
+            if results is not None:
+                if explain is not None:
+                    explain.add(f"memo: first {n} steps remembered")
+                results = QueryPlan(plan[n:]).run(results, explain, scanning=False)
+                break
+
+        # OTHERWISE, run the plan from scratch.
         else:
-            results = super().is_instance(*types).collect()
-            MemoizedQueryStream.memo[args] = results
+            results = self._scope(plan, explain)
 
-        # Once we find the results, we may have additional queries appended onto the stream.
-        #    Additional queries are not memoized, just the first "is_instance()"
-        return QueryStream(results)
+        # Save the results.
+        return memo.put(key, self.element, tuple(results))
+
+    def _ordered(
+        self, plan: Plan, path: str, explain: Explanation = None
+    ) -> OrderedIndex:
+        """
+        An index of the results of a pure plan, sorted by the value at a path.
+        """
+        key = (*self._key(plan), "ordered", path)
+        ordered = self.memo.get(key, self.element)
+        if ordered is None:
+            ordered = OrderedIndex(self._results(plan, explain), path)
+            self.memo.put(key, self.element, ordered)
+        elif explain is not None:
+            explain.add(f"memo: ordered by {path!r}")
+        return ordered
+
+    def _scope(self, plan: Plan, explain: Explanation = None) -> Iterable[Element]:
+        """
+        Run a plan against the elements under our element.
+        """
+        # CASE: the element is part of the frozen design. Use the index.
+        #   A lazy design is indexed by its first query from the top, since that
+        #   query converts the whole design anyway.
+        index = self.index
+        if index is None and self.element is self.pending:
+            index = self.design_index()
+        if index is not None and self.element in index:
+            return QueryPlan(plan, index.scope(self.element)).run(None, explain)
+
+        # OTHERWISE, scan the tree.
+        if index is not None:
+            index.scans += 1
+        elements = (s for s in subdicts(self.element) if isinstance(s, Element))
+        return QueryPlan(plan).run(elements, explain)
+
+    def _title(self) -> str:
+        return f"query from {self.element.get_path(primary_type) or 'element'}"
+
+    def _key(self, plan: Plan) -> Hashable:
+        # The memo holds on to the element, so its id can't be reused while remembered.
+        return id(self.element), plan_key(plan)
 
     @classmethod
-    def enable(cls):
+    def enable(
+        cls,
+        root: Element = None,
+        memo: QueryMemo = None,
+        lazy: bool = False,
+        index: DesignIndex = None,
+    ):
+        """
+        Start memoizing queries. The design tree must not change afterwards.
+        :param root: the top of the frozen tree. If given, it is indexed by type.
+        :param memo: where to remember query results. Defaults to a new, empty memo.
+        :param lazy: wait to index the tree until the index is needed. (See objdict.lazy_class)
+        :param index: an index of the tree which was already built. (See snapshot.py)
+        """
         cls.enabled = True
+        if index is not None or root is None:
+            cls.index, cls.pending = index, None
+        elif lazy:
+            cls.index, cls.pending = None, root
+        else:
+            cls.index, cls.pending = DesignIndex(root, Element), None
+        cls.memo = memo if memo is not None else QueryMemo()
+
+    @classmethod
+    def disable(cls):
+        """
+        Stop memoizing queries and forget the index and everything remembered.
+        """
+        cls.enabled = False
+        cls.index, cls.pending = None, None
+        cls.memo = QueryMemo()
+
+    @classmethod
+    def design_index(cls) -> Optional[DesignIndex]:
+        """
+        The index of the frozen design, building it now if it was put off.
+        """
+        if cls.pending is not None:
+            cls.index = DesignIndex(cls.pending, Element)
+            cls.pending = None
+        return cls.index
@@ -17,9 +17,10 @@ from __future__ import (
     annotations,
 )  # flake8: noqa F821 - Allows early access to class name
 
+import sys
 from contextlib import suppress
 from os.path import splitext
-from typing import Iterable, List, Callable, Tuple, Any
+from typing import Dict, Iterable, List, Callable, Optional, Tuple, Any
 
 from scribble.exceptions import DocumentException, SnippetNotFound
 from scribble.importer import FunctionNotFoundError
@@ -94,6 +95,16 @@ def load_section(
             )
         path = _curpath_.rsplit(".", 1)[0] + path
 
+    # Find the function, and bind it to its parameters.
+    fn, module, path = find_section(path)
+    return bind_section(fn, module, path, scope, **kwargs), module
+
+
+def find_section(path: str) -> Found:
+    """
+    Import the function for an absolute section path.
+    :return: the function, its module, and the module path it was found at.
+    """
     # By convention, we invoke a function with the same name as module.
     function_name = path.rpartition(".")[2]
 
@@ -106,12 +117,24 @@ def load_section(
         path = f"{path}.{function_name}"
         fn, module = import_function(path, function_name)
 
-    # Return a function which binds _curpath_,
-    #   We may as well bind everything or somebody could introduce inconsistencies.
-    return (
-        lambda: Text(fn(scope, _curpath_=path, _file_=module.__file__, **kwargs)),
-        module,
-    )
+    return fn, module, path
+
+
+def bind_section(
+    fn: Callable,
+    module: Any,
+    path: str,
+    scope: Element,
+    *,
+    _curpath_=None,
+    _file_=None,
+    **kwargs,
+) -> Callable:
+    """
+    Return a function which binds _curpath_,
+      We may as well bind everything or somebody could introduce inconsistencies.
+    """
+    return lambda: Text(fn(scope, _curpath_=path, _file_=module.__file__, **kwargs))
 
 
 def Snippet(snippet_name: str, scope: Element, **kwargs) -> Text:
@@ -122,25 +145,64 @@ def Snippet(snippet_name: str, scope: Element, **kwargs) -> Text:
     :param kwargs: additional parameters passed to the section.
     :return: Text
     """
-    # Find the module path to the best section for processing this element.
-    paths = list(snippet_paths(snippet_name, scope._types))
-
-    # Find the first section which can be loaded.
-    for path in paths:
-        with suppress(ModuleNotFoundError, FunctionNotFoundError):
-            fn, _ = load_section(path, scope, **kwargs)
-            break
+    # Find the best section for processing this element, or remember there is none.
+    found = resolve_snippet(snippet_name, tuple(scope._types or ()))
 
     # if none, error.
-    else:
+    if found is None:
         raise SnippetNotFound(
             f"No snippet {snippet_name} found for types {scope._types}"
         )
 
     # Invoke the section's function. Note we are no longer suppressing NotFound errors.
+    fn = bind_section(*found, scope, **kwargs)
     return fn()
 
 
+#################################################################
+# Resolving snippets.
+#
+# Snippet() is called for every element a document renders, and finding the
+#   snippet can mean trying several types, each raising and catching import
+#   errors after probing the file system. The section found for each
+#   (snippet name, types) is remembered, and so is finding none.
+#
+# What can be imported only changes with the import path, so the whole
+#   cache is dropped whenever sys.path changes.
+#################################################################
+
+# A section which was found: its function, module and module path.
+Found = Tuple[Callable, Any, str]
+
+snippets_found: Dict[Tuple[str, Tuple[str, ...]], Optional[Found]] = {}
+snippets_path: List[str] = []  # The import path the snippets were found with.
+
+
+def resolve_snippet(snippet_name: str, types: Tuple[str, ...]) -> Optional[Found]:
+    """
+    The function, module and module path of the snippet for a list of types, or None if none.
+    """
+    global snippets_path
+    if sys.path != snippets_path:
+        snippets_found.clear()
+        snippets_path = list(sys.path)
+
+    key = (snippet_name, types)
+    if key not in snippets_found:
+        snippets_found[key] = find_snippet(snippet_name, types)
+    return snippets_found[key]
+
+
+def find_snippet(snippet_name: str, types: Iterable[str]) -> Optional[Found]:
+    """
+    Find the first section which can be loaded for the types, most specific first.
+    """
+    for path in snippet_paths(snippet_name, types):
+        with suppress(ModuleNotFoundError, FunctionNotFoundError):
+            return find_section(path)
+    return None
+
+
 def StringTemplate(
     template: str, scope: Element, *, _curpath_=None, kwargs=None, **kargs
 ) -> Text:
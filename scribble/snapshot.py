@@ -0,0 +1,161 @@
+# Copyright 2019 SiFive, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You should have received a copy of LICENSE.Apache2 along with
+# this software. If not, you may obtain a copy at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from contextlib import suppress
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from scribble.index import DesignIndex
+from scribble.objdict import Objdict
+
+#########################################################################
+# Snapshots of the fixed up document.
+#
+# setup() does the same work on every run: read the design, then apply the
+#   document, design and snippet fixups. With a cache directory, the finished
+#   document and its design index are pickled, and the next run with the same
+#   inputs loads them instead.
+#
+# A snapshot is found by a hash of
+#   - the document as configured, before the design is read. This covers the
+#     config file, the command line arguments and --values, along with the
+#     snippet directories found on sys.path (and so PYTHONPATH).
+#   - the contents of the design file.
+#   - the scribble sources and the Python version.
+#
+# Which fixups are consulted isn't known until they run, so each snapshot also
+#   records the fixup directories which were searched, along with a hash of
+#   the fixup files in each (or of their absence). A snapshot is only used if
+#   those directories still hold the same fixups.
+#
+# Only the fixup files themselves are hashed. A module which a Fixup.py imports
+#   can change without anyone noticing. Clear the cache directory after changing one.
+#
+# Snapshots are only an optimization. One which can't be read or written is
+#   simply rebuilt, with a warning.
+#########################################################################
+
+FIXUP_FILES = ("Fixup.py", "Fixup", "Fixup.yaml", "Fixup.json")
+BUFFER = 1024 * 1024
+
+
+class Snapshot:
+    """
+    A cached copy of a fixed up document and its design index.
+    """
+
+    def __init__(self, directory: str, doc: Objdict, design_file: str = ""):
+        """
+        :param directory: where snapshots are kept.
+        :param doc: the document as configured, with its snippet directories,
+           before the design is read.
+        :param design_file: the (interpolated) name of the design file, if any.
+        """
+        digest = hashlib.sha256()
+        digest.update(scribble_version().encode())
+        digest.update(sys.version.encode())
+        digest.update(json.dumps(Objdict.to_dict(doc), sort_keys=True, default=str).encode())
+        digest.update(file_digest(design_file).encode() if design_file else b"")
+        self.key = digest.hexdigest()
+        self.path = Path(directory) / f"{self.key}.pickle"
+
+    def load(self) -> Optional[Tuple[Objdict, DesignIndex]]:
+        """
+        The saved document and index, or None if there is no usable snapshot.
+        """
+        if not self.path.is_file():
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring document snapshot {self.path}: {e}")
+            return None
+
+        # The fixups must not have changed.
+        if saved["fixups"] != fixup_digests(saved["fixups"]):
+            logging.info(f"Fixups have changed. Rebuilding snapshot {self.path}")
+            return None
+        return saved["doc"], saved["index"]
+
+    def save(self, doc: Objdict, index: DesignIndex, fixup_dirs: Iterable[str]):
+        """
+        Save the fixed up document and its index.
+        :param fixup_dirs: the directories searched for fixups.
+        """
+        saved = dict(doc=doc, index=index, fixups=fixup_digests(fixup_dirs))
+        temp = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Write to a temporary file, so a reader never sees half a snapshot.
+            fd, temp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, self.path)
+        except Exception as e:
+            logging.warning(f"Unable to save document snapshot {self.path}: {e}")
+            if temp is not None:
+                with suppress(OSError):
+                    os.remove(temp)
+
+
+def fixup_digests(dirs: Iterable[str]) -> Dict[str, str]:
+    """
+    A hash of the fixup files in each directory, which changes if any are added or removed.
+    """
+    return {
+        dir: hashlib.sha256(
+            "".join(file_digest(os.path.join(dir, name)) for name in FIXUP_FILES).encode()
+        ).hexdigest()
+        for dir in sorted(dirs)
+    }
+
+
+def file_digest(name: str) -> str:
+    """
+    A hash of a file's contents, or "-" if there is no such file.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(BUFFER), b""):
+                digest.update(block)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return "-"
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def scribble_version() -> str:
+    """
+    A hash of the scribble sources, which stands in for a version number.
+    """
+    package = Path(__file__).parent
+    digest = hashlib.sha256()
+    for source in sorted(package.rglob("*.py")):
+        if "Test" not in source.relative_to(package).parts:
+            digest.update(str(source.relative_to(package)).encode())
+            digest.update(file_digest(str(source)).encode())
+    return digest.hexdigest()
+
@@ -21,7 +21,8 @@ import enum
 import itertools
 import typing as t
 
-from scribble.obj import get_path
+from scribble.columns import ColumnFrame
+from scribble.obj import compile_path
 from scribble.template import template_string
 
 
@@ -260,18 +261,28 @@ def ObjectTable(
 ) -> Table:
     """
     Build a table from a sequence of dictionary-like objects, given field names for each column.
+      The objects can also be a ColumnFrame, in which case the columns are used directly.
     """
     # For each object, create a list of strings with the corresponding fields.
     #  TODO: treat "null" as a blank field.
-    strings = [[getValue(obj, path) for path in field_names] for obj in objects]
+    if isinstance(objects, ColumnFrame):
+        strings = objects.strings(field_names)
+
+    # (Compile the paths once, rather than once per object)
+    else:
+        getters = [getter(path) for path in field_names]
+        strings = [[str(get(obj)) for get in getters] for obj in objects]
 
     # Build a table from the object's values
     return Table(strings, header, title, reference_id, autowidth, roles)
 
 
 def getValue(obj, key) -> str:
-    if isinstance(key, str):
-        v = get_path(obj, key)
-    else:
-        v = key(obj)
-    return str(v)
+    return str(getter(key)(obj))
+
+
+def getter(key) -> t.Callable[[t.Any], t.Any]:
+    """
+    A function to fetch a field, given either a path or a function.
+    """
+    return compile_path(key).get if isinstance(key, str) else key
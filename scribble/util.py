@@ -14,7 +14,9 @@
 # limitations under the License.
 
 from typing import List
+from scribble.columns import ColumnFrame
 from scribble.exceptions import DocumentException
+from scribble.obj import compile_path
 from scribble.scope import Element
 from scribble.section import Text
 
@@ -24,19 +26,24 @@ def consistent_values(elements: List[Element], *paths: str):
     Verifies all the elements have equal data items. Throws exception on failure.
        We are checking for consistent values, NOT for invalid data.
        It is OK if the value is missing, as long as it is missing on all of the elements.
-    :param elements: A List of similar elements
+    :param elements: A List of similar elements, or a ColumnFrame of them
     :param paths: the reference paths which must match
     """
+    # CASE: a columnar frame. Compare whole columns at once.
+    if isinstance(elements, ColumnFrame):
+        return elements.consistent_values(*paths)
+
     # if there is more than one element
     if len(elements) > 1:
 
         # For each of the given paths
         for path in paths:
+            get = compile_path(path).get
 
             # Compare the first element with all the subsequent ones
-            first = elements[0].get_path(path)
+            first = get(elements[0])
             for subsequent in elements[1:]:
-                current = subsequent.get_path(path)
+                current = get(subsequent)
 
                 # Raise an exception if they have different values.
                 if first != current: